@@ -30,11 +30,12 @@ __date__ ="$4-Apr-2016 10:05:01$"
 import MySQLdb as mdb
 import uuid as myUuid
 import  utils as af
-import json
 #import yaml
 import time
 import logging
 import datetime
+import threading
+import collections
 from jsonschema import validate as js_v, exceptions as js_e
 
 HTTP_Bad_Request = 400
@@ -142,24 +143,167 @@ class db_base_Exception(Exception):
         Exception.__init__(self, message)
         self.http_code = http_code
 
-class db_base():
+class db_pool(object):
+    '''Pool of database connections. At most 'size' connections are used at the same time; a thread asking for a
+    connection when all are in use waits until one is released. Idle connections not used during 'check_interval'
+    seconds are checked with a ping before being returned, and opened again if they fail
+    '''
+    def __init__(self, host, user, passwd, database, size=10, check_interval=60, logger=None):
+        self.host = host
+        self.user = user
+        self.passwd = passwd
+        self.database = database
+        self.size = size
+        self.check_interval = check_interval
+        self.logger = logger or logging.getLogger('db')
+        self.idle = []      # list of (connection, time of last use)
+        self.in_use = 0
+        self.lock = threading.Condition()
+
+    def acquire(self):
+        with self.lock:
+            while not self.idle and self.in_use >= self.size:
+                self.lock.wait()
+            con, last_used = self.idle.pop() if self.idle else (None, 0)
+            self.in_use += 1
+        try:
+            if con and time.time() - last_used > self.check_interval:
+                try:
+                    con.ping()
+                except mdb.Error as e:
+                    self.logger.warn("DB: connection lost %s. Reconnecting", str(e))
+                    self._close(con)
+                    con = None
+            if not con:
+                con = mdb.connect(self.host, self.user, self.passwd, self.database)
+            return con
+        except mdb.Error:
+            self.release(None)
+            raise
+
+    def release(self, con, discard=False):
+        with self.lock:
+            self.in_use -= 1
+            if con and not discard:
+                self.idle.append((con, time.time()))
+            self.lock.notify()
+        if con and discard:
+            self._close(con)
+
+    def _close(self, con):
+        try:
+            con.close()
+        except mdb.Error:
+            pass
+
+    def clear(self):
+        '''Close the idle connections. They will be opened again when needed'''
+        with self.lock:
+            idle = self.idle
+            self.idle = []
+        for con, _ in idle:
+            self._close(con)
+
+
+class db_pool_connection(object):
+    '''Used as the database connection by db_base. 'with self.con:' takes a connection from the pool for the current
+    thread, begins a transaction and returns the connection to the pool at the end; and 'self.con.cursor()' creates a
+    cursor on the connection of the current thread. So every thread uses its own connection and cursor.
+    Connections that produce an OperationalError (e.g. server has gone away) are discarded
+    '''
+    def __init__(self, pool):
+        self.pool = pool
+        self.local = threading.local()
+
+    def __enter__(self):
+        local = self.local
+        if getattr(local, "depth", 0):
+            # nested 'with': the outer one ends the transaction
+            local.depth += 1
+            return local.con.cursor()
+        local.con = self.pool.acquire()
+        try:
+            cursor = local.con.__enter__()
+        except mdb.Error:
+            self.pool.release(local.con, discard=True)
+            local.con = None
+            raise
+        local.depth = 1
+        return cursor
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        local = self.local
+        local.depth -= 1
+        if local.depth:
+            return False
+        con = local.con
+        local.con = None
+        discard = isinstance(exc_value, mdb.OperationalError)
+        try:
+            con.__exit__(exc_type, exc_value, traceback)
+        except mdb.Error:
+            discard = True
+            if not exc_type:
+                self.pool.release(con, discard)
+                raise
+        self.pool.release(con, discard)
+        return False
+
+    def cursor(self, *args, **kwargs):
+        con = getattr(self.local, "con", None)
+        if not con:
+            raise AttributeError("database cursor requested out of a transaction 'with self.con'")
+        return con.cursor(*args, **kwargs)
+
+    def close(self):
+        self.pool.clear()
+
+
+class db_bulk_insert(object):
+    '''Rows gathered by db_base._new_row_bulk, to be written by db_base._insert_bulk with multi-row INSERT statements.
+    Tables are written in the order they are first used, so a row can only reference rows of previously used tables
+    '''
+    def __init__(self):
+        self.uuids = []         # values of the uuids rows
+        self.tables = collections.OrderedDict()    # table: {columns: [values of each row]}
+
+    def __len__(self):
+        return len(self.uuids) + sum(len(rows) for columns in self.tables.values() for rows in columns.values())
+
+
+class db_base(object):
     tables_with_created_field=()
+    bulk_insert_rows = 500      # maximum number of rows of a bulk INSERT statement
     
-    def __init__(self, host=None, user=None, passwd=None, database=None, log_name='db', log_level=None):
+    def __init__(self, host=None, user=None, passwd=None, database=None, log_name='db', log_level=None,
+                 pool_size=10):
         self.host = host
         self.user = user
         self.passwd = passwd
         self.database = database
+        self.pool_size = pool_size
+        self.pool = None
         self.con = None
+        self._local = threading.local()
         self.log_level=log_level
         self.logger = logging.getLogger(log_name)
         if self.log_level:
             self.logger.setLevel( getattr(logging, log_level) )
         
+    @property
+    def cur(self):
+        '''database cursor of the current thread'''
+        return self._local.cur
+
+    @cur.setter
+    def cur(self, cursor):
+        self._local.cur = cursor
+
     def connect(self, host=None, user=None, passwd=None, database=None):
         '''Connect to specific data base. 
         The first time a valid host, user, passwd and database must be provided,
         Following calls can skip this parameters
+        It creates a pool of 'pool_size' connections, that are opened when needed
         '''
         try:
             if host:        self.host = host
@@ -167,7 +311,12 @@ class db_base():
             if passwd:      self.passwd = passwd
             if database:    self.database = database
 
-            self.con = mdb.connect(self.host, self.user, self.passwd, self.database)
+            if self.pool:
+                self.pool.clear()
+            self.pool = db_pool(self.host, self.user, self.passwd, self.database, size=self.pool_size,
+                                logger=self.logger)
+            self.pool.release(self.pool.acquire())    # check that it can be connected
+            self.con = db_pool_connection(self.pool)
             self.logger.debug("DB: connected to '%s' at '%s@%s'", self.database, self.user, self.host)
         except mdb.Error as e:
             raise db_base_Exception("Cannot connect to DataBase '{}' at '{}@{}' Error {}: {}".format(
@@ -230,8 +379,8 @@ class db_base():
         if e.args[0]==2006 or e.args[0]==2013 : #MySQL server has gone away (((or)))    Exception 2013: Lost connection to MySQL server during query
             if tries>1:
                 self.logger.warn("DB Exception '%s'. Retry", str(e))
-                #reconnect
-                self.connect()
+                #reconnect. The failing connection is already discarded; idle ones are probably lost too
+                self.pool.clear()
                 return
             else:
                 raise db_base_Exception("Database connection timeout Try Again", HTTP_Request_Timeout)
@@ -258,68 +407,60 @@ class db_base():
                 raise db_base_Exception("Field {} does not exist".format(e.args[1][uk+14:wc]), HTTP_Bad_Request)
         raise db_base_Exception("Database internal Error {}: {}".format(e.args[0], e.args[1]), HTTP_Internal_Server_Error)
     
-    def __str2db_format(self, data):
-        '''Convert string data to database format. 
-        If data is None it returns the 'Null' text,
-        otherwise it returns the text surrounded by quotes ensuring internal quotes are escaped.
+    def __db_param(self, value):
+        '''Convert a value into a query parameter. None is translated to Null, and any other non unicode value is
+        converted to string, as the database columns are compared and stored as text
         '''
-        if data==None:
-            return 'Null'
-        else:
-            return json.dumps(str(data))
-    
-    def __tuple2db_format_set(self, data):
-        '''Compose the needed text for a SQL SET, parameter 'data' is a pair tuple (A,B),
-        and it returns the text 'A="B"', where A is a field of a table and B is the value 
-        If B is None it returns the 'A=Null' text, without surrounding Null by quotes
-        If B is not None it returns the text "A='B'" or 'A="B"' where B is surrounded by quotes,
-        and it ensures internal quotes of B are escaped.
-        '''
-        if data[1]==None:
-            return str(data[0]) + "=Null"
-        else:
-            return str(data[0]) + '=' + json.dumps(str(data[1]))
-    
-    def __tuple2db_format_where(self, data):
-        '''Compose the needed text for a SQL WHERE, parameter 'data' is a pair tuple (A,B),
-        and it returns the text 'A="B"', where A is a field of a table and B is the value 
-        If B is None it returns the 'A is Null' text, without surrounding Null by quotes
-        If B is not None it returns the text "A='B'" or 'A="B"' where B is surrounded by quotes,
-        and it ensures internal quotes of B are escaped.
+        if value is None or isinstance(value, unicode):
+            return value
+        return str(value)
+
+    def __sql(self, text):
+        '''Escape the % of a text that is part of a parameterized statement'''
+        return str(text).replace("%", "%%")
+
+    def __where_shape(self, data, params):
+        '''Obtain the shape of a WHERE dictionary: a tuple of (key, kind) where kind is None for a Null value, the
+        number of elements for a list or tuple, or -1 for any other value. The values are appended to 'params'
         '''
-        if data[1]==None:
-            return str(data[0]) + " is Null"
-        
-#         if type(data[1]) is tuple:  #this can only happen in a WHERE_OR clause
-#             text =[]
-#             for d in data[1]:
-#                 if d==None:
-#                     text.append(str(data[0]) + " is Null")
-#                     continue
-#                 out=str(d)
-#                 if "'" not in out:
-#                     text.append( str(data[0]) + "='" + out + "'" )
-#                 elif '"' not in out:
-#                     text.append( str(data[0]) + '="' + out + '"' )
-#                 else:
-#                     text.append( str(data[0]) + '=' + json.dumps(out) )
-#             return " OR ".join(text)
-
-        out=str(data[1])
-        return str(data[0]) + '=' + json.dumps(out)
-
-    def __tuple2db_format_where_not(self, data):
-        '''Compose the needed text for a SQL WHERE(not). parameter 'data' is a pair tuple (A,B),
-        and it returns the text 'A<>"B"', where A is a field of a table and B is the value 
-        If B is None it returns the 'A is not Null' text, without surrounding Null by quotes
-        If B is not None it returns the text "A<>'B'" or 'A<>"B"' where B is surrounded by quotes,
-        and it ensures internal quotes of B are escaped.
+        shape = []
+        for key, value in data.iteritems():
+            if value is None:
+                shape.append((key, None))
+            elif type(value) is list or type(value) is tuple:
+                shape.append((key, len(value)))
+                params.extend(map(self.__db_param, value))
+            else:
+                shape.append((key, -1))
+                params.append(self.__db_param(value))
+        return tuple(shape)
+
+    def __where_text(self, shape, join=" AND ", negate=False):
+        '''Compose the SQL text of a WHERE shape, with a %s placeholder per value:
+        'A=%s' ('A<>%s' if negate), 'A is Null' ('A is not Null'), 'A IN (%s,%s)' ('A NOT IN (%s,%s)')
         '''
-        if data[1]==None:
-            return str(data[0]) + " is not Null"
-        out=str(data[1])
-        return str(data[0]) + '<>' + json.dumps(out)
-    
+        text = []
+        for key, kind in shape:
+            key = self.__sql(key)
+            if kind is None:
+                text.append(key + (" is not Null" if negate else " is Null"))
+            elif kind == -1:
+                text.append(key + ("<>%s" if negate else "=%s"))
+            elif kind == 0:
+                text.append("TRUE" if negate else "FALSE")
+            else:
+                text.append(key + (" NOT IN (" if negate else " IN (") + ",".join(("%s",) * kind) + ")")
+        return join.join(text)
+
+    def __set_text(self, keys):
+        '''Compose the SQL text of a SET, with a %s placeholder per value: A=%s,B=%s'''
+        return ",".join(self.__sql(key) + "=%s" for key in keys)
+
+    def _execute(self, cmd, params=()):
+        '''Execute a parameterized statement at self.cur'''
+        self.logger.debug("%s %s", cmd, params)
+        self.cur.execute(cmd, tuple(params))
+
     def __remove_quotes(self, data):
         '''remove single quotes ' of any string content of data dictionary'''
         for k,v in data.items():
@@ -335,14 +476,15 @@ class db_base():
             WHERE: dictionary of elements to update
         Return: the number of updated rows, exception if error
         '''
-                #gettting uuid 
-        values = ",".join(map(self.__tuple2db_format_set, UPDATE.iteritems() ))
+        params = map(self.__db_param, UPDATE.values())
         if modified_time:
-            values += ",modified_at={:f}".format(modified_time)
-        cmd= "UPDATE " + table +" SET " + values +\
-            " WHERE " + " and ".join(map(self.__tuple2db_format_where, WHERE.iteritems() ))
-        self.logger.debug(cmd)
-        self.cur.execute(cmd) 
+            params.append(modified_time)
+        where_shape = self.__where_shape(WHERE, params)
+        cmd = "UPDATE " + self.__sql(table) + " SET " + self.__set_text(UPDATE.keys())
+        if modified_time:
+            cmd += ",modified_at=%s"
+        cmd += " WHERE " + self.__where_text(where_shape, " and ")
+        self._execute(cmd, params)
         return self.cur.rowcount
     
     def _new_row_internal(self, table, INSERT, add_uuid=False, root_uuid=None, created_time=0):
@@ -373,23 +515,71 @@ class db_base():
             else:
                 created_at=time.time()
             #inserting new uuid
-            cmd = "INSERT INTO uuids (uuid, root_uuid, used_at, created_at) VALUES ('{:s}','{:s}','{:s}', {:f})".format(uuid, root_uuid, table, created_at)
-            self.logger.debug(cmd)
-            self.cur.execute(cmd)
+            self._execute("INSERT INTO uuids (uuid, root_uuid, used_at, created_at) VALUES (%s,%s,%s,%s)",
+                          (uuid, root_uuid, table, created_at))
         #insertion
-        cmd= "INSERT INTO " + table +" SET " + \
-            ",".join(map(self.__tuple2db_format_set, INSERT.iteritems() )) 
+        params = map(self.__db_param, INSERT.values())
+        cmd = "INSERT INTO " + self.__sql(table) + " SET " + self.__set_text(INSERT.keys())
         if created_time:
-            cmd += ",created_at=%f" % created_time
-        self.logger.debug(cmd)
-        self.cur.execute(cmd)
-        self.cur.rowcount
+            cmd += ",created_at=%s"
+            params.append(created_time)
+        self._execute(cmd, params)
         return uuid
 
+    def _new_row_bulk(self, bulk, table, INSERT, add_uuid=False, root_uuid=None, created_time=0):
+        ''' Gather one row to be inserted with _insert_bulk, with the same parameters and uuid handling than
+        _new_row_internal. 'bulk' is a db_bulk_insert. Nothing is written at database
+        Return: uuid
+        '''
+        if add_uuid:
+            #create uuid if not provided
+            if 'uuid' not in INSERT:
+                uuid = INSERT['uuid'] = str(myUuid.uuid1()) # create_uuid
+            else: 
+                uuid = str(INSERT['uuid'])
+            #defining root_uuid if not provided
+            if root_uuid is None:
+                root_uuid = uuid
+            bulk.uuids.append((uuid, root_uuid, table, created_time or time.time()))
+        else:
+            uuid=None
+        columns = tuple(INSERT.keys())
+        values = map(self.__db_param, INSERT.values())
+        if created_time:
+            columns += ("created_at",)
+            values.append(created_time)
+        bulk.tables.setdefault(table, collections.OrderedDict()).setdefault(columns, []).append(values)
+        return uuid
+
+    def __insert_rows(self, table, columns, rows):
+        '''Write rows with a multi-row INSERT statement per bulk_insert_rows rows. Return the number of statements'''
+        statements = 0
+        for index in range(0, len(rows), self.bulk_insert_rows):
+            chunk = rows[index:index + self.bulk_insert_rows]
+            values = "(" + ",".join(("%s",) * len(columns)) + ")"
+            cmd = "INSERT INTO {} ({}) VALUES {}".format(self.__sql(table), self.__sql(",".join(columns)),
+                                                         ",".join((values,) * len(chunk)))
+            self._execute(cmd, [value for row in chunk for value in row])
+            statements += 1
+        return statements
+
+    def _insert_bulk(self, bulk):
+        ''' Write the rows gathered at a db_bulk_insert: first the uuids rows and then each table in the order they
+        were used. It DOES NOT begin or end the transaction, so self.con.cursor must be created
+        Return: the number of INSERT statements
+        '''
+        statements = 0
+        if bulk.uuids:
+            statements += self.__insert_rows("uuids", ("uuid", "root_uuid", "used_at", "created_at"), bulk.uuids)
+        for table, table_columns in bulk.tables.iteritems():
+            for columns, rows in table_columns.iteritems():
+                statements += self.__insert_rows(table, columns, rows)
+        bulk.uuids = []
+        bulk.tables.clear()
+        return statements
+
     def _get_rows(self,table,uuid):
-        cmd = "SELECT * FROM {} WHERE uuid='{}'".format(str(table), str(uuid))
-        self.logger.debug(cmd)
-        self.cur.execute(cmd)
+        self._execute("SELECT * FROM " + self.__sql(table) + " WHERE uuid=%s", (str(uuid),))
         rows = self.cur.fetchall()
         return rows
     
@@ -437,6 +627,41 @@ class db_base():
                 self._format_error(e, tries)
             tries -= 1
 
+    def update_rows_case(self, table, column, values, modified_time=0):
+        ''' Update several rows of a table with a single command, changing a column to a different value per row.
+        Atributes
+            table: table where to update
+            column: column to change
+            values: dictionary with the current value of the column: new value
+        Return: the number of updated rows, exception if error
+        '''
+        if not values:
+            return 0
+        if table in self.tables_with_created_field and modified_time==0:
+            modified_time=time.time()
+        params = []
+        for old_value, new_value in values.iteritems():
+            params += [self.__db_param(old_value), self.__db_param(new_value)]
+        if modified_time:
+            params.append(modified_time)
+        params += map(self.__db_param, values.keys())
+        column_ = self.__sql(column)
+        cmd = "UPDATE {} SET {}=CASE {} {} END".format(self.__sql(table), column_, column_,
+                                                       " ".join(("WHEN %s THEN %s",) * len(values)))
+        if modified_time:
+            cmd += ",modified_at=%s"
+        cmd += " WHERE " + self.__where_text(((column, len(values)),))
+        tries = 2
+        while tries:
+            try:
+                with self.con:
+                    self.cur = self.con.cursor()
+                    self._execute(cmd, params)
+                    return self.cur.rowcount
+            except (mdb.Error, AttributeError) as e:
+                self._format_error(e, tries)
+            tries -= 1
+
     def delete_row_by_id(self, table, uuid):
         tries = 2
         while tries:
@@ -444,16 +669,12 @@ class db_base():
                 with self.con:
                     #delete host
                     self.cur = self.con.cursor()
-                    cmd = "DELETE FROM {} WHERE uuid = '{}'".format(table, uuid)
-                    self.logger.debug(cmd)
-                    self.cur.execute(cmd)
+                    self._execute("DELETE FROM " + self.__sql(table) + " WHERE uuid=%s", (str(uuid),))
                     deleted = self.cur.rowcount
                     if deleted:
                         #delete uuid
                         self.cur = self.con.cursor()
-                        cmd = "DELETE FROM uuids WHERE root_uuid = '{}'".format(uuid)
-                        self.logger.debug(cmd)
-                        self.cur.execute(cmd)
+                        self._execute("DELETE FROM uuids WHERE root_uuid=%s", (str(uuid),))
                 return deleted
             except (mdb.Error, AttributeError) as e:
                 self._format_error(e, tries, "delete", "dependencies")
@@ -469,29 +690,20 @@ class db_base():
             'LIMIT': limit of number of rows (Optional)
         Return: the number of deleted or exception if error
         '''
-        #print sql_dict
-        from_  = "FROM " + str(sql_dict['FROM'])
-        #print 'from_', from_
-        if 'WHERE' in sql_dict and len(sql_dict['WHERE']) > 0:
-            w=sql_dict['WHERE']
-            where_ = "WHERE " + " AND ".join(map(self.__tuple2db_format_where, w.iteritems())) 
-        else: where_ = ""
-        if 'WHERE_NOT' in sql_dict and len(sql_dict['WHERE_NOT']) > 0: 
-            w=sql_dict['WHERE_NOT']
-            where_2 = " AND ".join(map(self.__tuple2db_format_where_not, w.iteritems()))
-            if len(where_)==0:   where_ = "WHERE " + where_2
-            else:                where_ = where_ + " AND " + where_2
-        #print 'where_', where_
-        limit_ = "LIMIT " + str(sql_dict['LIMIT']) if 'LIMIT' in sql_dict else ""
-        #print 'limit_', limit_
-        cmd =  " ".join( ("DELETE", from_, where_, limit_) )
+        params = []
+        where_shape = self.__where_shape(sql_dict.get('WHERE') or {}, params)
+        where_not_shape = self.__where_shape(sql_dict.get('WHERE_NOT') or {}, params)
+        where_ = " AND ".join(w for w in (self.__where_text(where_shape),
+                                          self.__where_text(where_not_shape, negate=True)) if w)
+        where_ = "WHERE " + where_ if where_ else ""
+        limit_ = "LIMIT " + self.__sql(sql_dict['LIMIT']) if 'LIMIT' in sql_dict else ""
+        cmd =  " ".join( ("DELETE", "FROM " + self.__sql(sql_dict['FROM']), where_, limit_) )
         tries = 2
         while tries:
             try:
                 with self.con:
                     self.cur = self.con.cursor()
-                    self.logger.debug(cmd)
-                    self.cur.execute(cmd)
+                    self._execute(cmd, params)
                     deleted = self.cur.rowcount
                 return deleted
             except (mdb.Error, AttributeError) as e:
@@ -505,9 +717,7 @@ class db_base():
             try:
                 with self.con:
                     self.cur = self.con.cursor(mdb.cursors.DictCursor)
-                    cmd="SELECT * FROM {} where uuid='{}'".format(str(table), str(uuid))
-                    self.logger.debug(cmd)
-                    self.cur.execute(cmd)
+                    self._execute("SELECT * FROM " + self.__sql(table) + " where uuid=%s", (str(uuid),))
                     rows = self.cur.fetchall()
                     return rows
             except (mdb.Error, AttributeError) as e:
@@ -527,23 +737,17 @@ class db_base():
             'ORDER_BY':  list or tuple of fields to order
         Return: a list with dictionaries at each row
         '''
-        #print sql_dict
-        select_= "SELECT " + ("*" if 'SELECT' not in sql_dict else ",".join(map(str,sql_dict['SELECT'])) )
-        #print 'select_', select_
-        from_  = "FROM " + str(sql_dict['FROM'])
-        #print 'from_', from_
-        where_and = ""
-        where_or = ""
-        w=sql_dict.get('WHERE')
-        if w:
-            where_and = " AND ".join(map(self.__tuple2db_format_where, w.iteritems() ))
-        w=sql_dict.get('WHERE_NOT')
-        if w: 
-            if where_and: where_and += " AND "
-            where_and += " AND ".join(map(self.__tuple2db_format_where_not, w.iteritems() ) )
-        w=sql_dict.get('WHERE_OR')
-        if w:
-            where_or =  " OR ".join(map(self.__tuple2db_format_where, w.iteritems() ))
+        params = []
+        where_shape = self.__where_shape(sql_dict.get('WHERE') or {}, params)
+        where_not_shape = self.__where_shape(sql_dict.get('WHERE_NOT') or {}, params)
+        where_or_shape = self.__where_shape(sql_dict.get('WHERE_OR') or {}, params)
+        select = tuple(sql_dict['SELECT']) if 'SELECT' in sql_dict else None
+        order_by = tuple(sql_dict['ORDER_BY']) if 'ORDER_BY' in sql_dict else None
+        select_= "SELECT " + ("*" if not select else self.__sql(",".join(map(str, select))))
+        from_  = "FROM " + self.__sql(sql_dict['FROM'])
+        where_and = " AND ".join(w for w in (self.__where_text(where_shape),
+                                             self.__where_text(where_not_shape, negate=True)) if w)
+        where_or = self.__where_text(where_or_shape, " OR ")
         if where_and and where_or:
             if sql_dict.get("WHERE_AND_OR") == "AND":
                 where_ = "WHERE " + where_and + " AND (" + where_or + ")"
@@ -555,19 +759,15 @@ class db_base():
             where_ = "WHERE " + where_or
         else:
             where_ = ""
-        #print 'where_', where_
-        limit_ = "LIMIT " + str(sql_dict['LIMIT']) if 'LIMIT' in sql_dict else ""
-        order_ = "ORDER BY " + ",".join(map(str,sql_dict['SELECT'])) if 'ORDER_BY' in sql_dict else ""
-        
-        #print 'limit_', limit_
-        cmd =  " ".join( (select_, from_, where_, limit_, order_) )
+        order_ = "ORDER BY " + self.__sql(",".join(map(str, order_by))) if order_by else ""
+        limit_ = "LIMIT " + self.__sql(sql_dict['LIMIT']) if 'LIMIT' in sql_dict else ""
+        cmd =  " ".join( (select_, from_, where_, order_, limit_) )
         tries = 2
         while tries:
             try:
                 with self.con:
                     self.cur = self.con.cursor(mdb.cursors.DictCursor)
-                    self.logger.debug(cmd)
-                    self.cur.execute(cmd)
+                    self._execute(cmd, params)
                     rows = self.cur.fetchall()
                     return rows
             except (mdb.Error, AttributeError) as e:
@@ -590,9 +790,10 @@ class db_base():
         if error_item_text==None:
             error_item_text = table
         what = 'uuid' if af.check_valid_uuid(uuid_name) else 'name'
-        cmd =  " SELECT * FROM {} WHERE {}='{}'".format(table, what, uuid_name)
+        cmd =  "SELECT * FROM {} WHERE {}=%s".format(self.__sql(table), what)
+        params = [self.__db_param(uuid_name)]
         if WHERE_OR:
-            where_or =  " OR ".join(map(self.__tuple2db_format_where, WHERE_OR.iteritems() ))
+            where_or =  self.__where_text(self.__where_shape(WHERE_OR, params), " OR ")
             if WHERE_AND_OR == "AND":
                 cmd += " AND (" + where_or + ")"
             else:
@@ -604,8 +805,7 @@ class db_base():
             try:
                 with self.con:
                     self.cur = self.con.cursor(mdb.cursors.DictCursor)
-                    self.logger.debug(cmd)
-                    self.cur.execute(cmd)
+                    self._execute(cmd, params)
                     number = self.cur.rowcount
                     if number==0:
                         return -HTTP_Not_Found, "No %s found with %s '%s'" %(error_item_text, what, uuid_name)
@@ -626,7 +826,7 @@ class db_base():
             try:
                 with self.con:
                     self.cur = self.con.cursor(mdb.cursors.DictCursor)
-                    self.cur.execute("SELECT * FROM uuids where uuid='" + str(uuid) + "'")
+                    self._execute("SELECT * FROM uuids where uuid=%s", (str(uuid),))
                     rows = self.cur.fetchall()
                     return self.cur.rowcount, rows
             except (mdb.Error, AttributeError) as e:
@@ -642,8 +842,7 @@ class db_base():
             try:
                 with self.con:
                     self.cur = self.con.cursor(mdb.cursors.DictCursor)
-                    where_text = "name='" + name +"'"
-                    self.cur.execute("SELECT * FROM " + table + " WHERE "+ where_text)
+                    self._execute("SELECT * FROM " + self.__sql(table) + " WHERE name=%s", (self.__db_param(name),))
                     rows = self.cur.fetchall()
                     if self.cur.rowcount==0:
                         return 0, "Name %s not found in table %s" %(name, table)
@@ -82,7 +82,7 @@ def convert_datetime2str(var):
     '''
     if type(var) is dict:
         for k,v in var.items():
-            if type(v) is float and k in ("created_at", "modified_at"):
+            if type(v) is float and k in ("created_at", "modified_at", "last_refreshed"):
                 var[k] = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(v) )
             elif type(v) is dict or type(v) is list or type(v) is tuple: 
                 convert_datetime2str(v)
@@ -1182,14 +1182,9 @@ def http_get_instance_id(tenant_id, instance_id):
             nfvo.check_tenant(mydb, tenant_id) 
         if tenant_id == "any":
             tenant_id = None
-        #obtain data (first time is only to check that the instance exists)
-        instance_dict = mydb.get_instance_scenario(instance_id, tenant_id, verbose=True)
-        try:
-            nfvo.refresh_instance(mydb, tenant_id, instance_dict)
-        except (nfvo.NfvoException, db_base_Exception) as e:
-            logger.warn("nfvo.refresh_instance couldn't refresh the status of the instance: %s" % str(e))
-        #obtain data with results upated
-        instance = mydb.get_instance_scenario(instance_id, tenant_id)
+        #obtain data, refreshed now from the VIMs with ?refresh=force
+        instance = nfvo.get_instance_status(mydb, tenant_id, instance_id,
+                                            force_refresh=bottle.request.query.get("refresh") == "force")
         convert_datetime2str(instance)
         #print json.dumps(instance, indent=4)
         return format_out(instance)
@@ -1212,8 +1207,8 @@ def http_delete_instance_id(tenant_id, instance_id):
         if tenant_id == "any":
             tenant_id = None
         #obtain data
-        message = nfvo.delete_instance(mydb, tenant_id,instance_id)
-        return format_out({"result":message})
+        result = nfvo.delete_instance(mydb, tenant_id,instance_id)
+        return format_out(result)
     except (nfvo.NfvoException, db_base_Exception) as e:
         logger.error("http_delete_instance_id error {}: {}".format(e.http_code, str(e)))
         bottle.abort(e.http_code, str(e))
@@ -1222,6 +1217,27 @@ def http_delete_instance_id(tenant_id, instance_id):
         bottle.abort(HTTP_Internal_Server_Error, type(e).__name__ + ": " + str(e))
 
 
+@bottle.route(url_base + '/<tenant_id>/operations/<instance_id>', method='GET')
+@bottle.route(url_base + '/<tenant_id>/instances/<instance_id>/progress', method='GET')
+def http_get_instance_progress(tenant_id, instance_id):
+    '''get the progress of the VIM tasks of the last creation or deletion of an instance, also by its operation_id'''
+    logger.debug('FROM %s %s %s', bottle.request.remote_addr, bottle.request.method, bottle.request.url)
+    try:
+        #check valid tenant_id
+        if tenant_id != "any":
+            nfvo.check_tenant(mydb, tenant_id)
+        if tenant_id == "any":
+            tenant_id = None
+        progress = nfvo.get_instance_progress(mydb, tenant_id, instance_id)
+        return format_out(progress)
+    except (nfvo.NfvoException, db_base_Exception) as e:
+        logger.error("http_get_instance_progress error {}: {}".format(e.http_code, str(e)))
+        bottle.abort(e.http_code, str(e))
+    except Exception as e:
+        logger.error("Unexpected exception: ", exc_info=True)
+        bottle.abort(HTTP_Internal_Server_Error, type(e).__name__ + ": " + str(e))
+
+
 @bottle.route(url_base + '/<tenant_id>/instances/<instance_id>/action', method='POST')
 def http_post_instance_scenario_action(tenant_id, instance_id):
     '''take an action over a scenario instance'''
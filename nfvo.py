@@ -28,10 +28,15 @@ __author__="Alfonso Tierno, Gerardo Garcia, Pablo Montes"
 __date__ ="$16-sep-2014 22:05:01$"
 
 import imp
-#import json
+import copy
+import json
 import yaml
 import utils
 import vim_thread
+import vim_tasks
+import vim_calls
+import vim_caches
+import status_poller
 from db_base import HTTP_Unauthorized, HTTP_Bad_Request, HTTP_Internal_Server_Error, HTTP_Not_Found,\
     HTTP_Conflict, HTTP_Method_Not_Allowed
 import console_proxy_thread as cli
@@ -40,22 +45,32 @@ import logging
 import collections
 from db_base import db_base_Exception
 import nfvo_db
-from threading import Lock
-from time import time
+from threading import Lock, RLock
+from time import time, sleep
 
 global global_config
 global vimconn_imported
 global logger
 global default_volume_size
 default_volume_size = '5' #size in GB
+global_config = {}      # openmanod replaces it by the loaded configuration before start_service
 
 
 vimconn_imported = {}   # dictionary with VIM type as key, loaded module as value
 vim_threads = {"running":{}, "deleting": {}, "names": []}      # threads running for attached-VIMs
 vim_persistent_info = {}
 logger = logging.getLogger('openmano.nfvo')
-task_lock = Lock()
-task_dict = {}
+task_lock = RLock()   # reentrant, new_task is called with it taken
+task_dict = vim_tasks.task_registry()    # task_id: task, and tasks of the last create/delete of each instance
+task_journal = None     # vim_tasks.task_journal, when configured with 'task_journal'
+task_writer = None      # vim_tasks.task_result_writer shared by all the vim_threads
+vim_executor = vim_calls.vim_executor()    # runs concurrent calls to the VIMs, e.g. the status refresh
+refresh_calls = {}      # (datacenter_key, "vms"|"nets"): vim_call of the last status refresh of this datacenter
+refresh_calls_lock = Lock()
+instance_poller = None  # status_poller.status_poller, refreshes the instances in background if 'status_refresh_interval'
+refresh_fingerprints = vim_caches.fingerprint_cache()  # uuid of VMs and nets, (vm uuid, vim_interface_id)
+vim_cache = vim_caches.connector_cache()    # vimconnectors created by get_vim, reused by next calls
+image_cache = None      # vim_caches.image_cache, local copy of the images given by URL if 'image_cache_dir'
 last_task_id = 0.0
 db=None
 db_lock=Lock()
@@ -81,7 +96,8 @@ def new_task(name, params, store=True, depends=None):
     if depends:
         task["depends"] = depends
     if store:
-        task_dict[task_id] = task
+        with task_lock:
+            task_dict.add(task)
     return task
 
 
@@ -89,6 +105,11 @@ def is_task_id(id):
     return True if id[:5] == "TASK." else False
 
 
+def new_operation(name):
+    '''Returns the dictionary of a new operation over an instance, that groups its VIM tasks'''
+    return {"id": "OPERATION." + get_task_id()[5:], "name": name, "created": time()}
+
+
 def get_non_used_vim_name(datacenter_name, datacenter_id, tenant_name, tenant_id):
     name = datacenter_name[:16]
     if name not in vim_threads["names"]:
@@ -103,10 +124,78 @@ def get_non_used_vim_name(datacenter_name, datacenter_id, tenant_name, tenant_id
     return name
 
 
+def resume_journal_tasks(journal_tasks):
+    '''Resumes the tasks of the journal that were not finished when openmanod stopped. Enqueued tasks and deletions
+    are inserted again at their threads. Creations that were processing are set to error, because the element could
+    have been created at VIM or not. Results of creations not written at database are written now.
+    All the tasks are stored at task_dict, because the database can still reference them'''
+    tasks = {}
+    for task_id, record in journal_tasks.items():
+        task = {"status": record["status"], "id": task_id, "name": record["name"], "params": record["params"],
+                "result": record["result"]}
+        if record["depends"]:
+            task["depends"] = {}
+            for depend_id in record["depends"]:
+                task["depends"][depend_id] = tasks.get(depend_id) or \
+                    {"id": depend_id, "status": "error", "result": "task lost at restart"}
+        tasks[task_id] = task
+        with task_lock:
+            task_dict.add(task)
+        table, column = vim_tasks.task_journal.creation_tasks.get(task["name"], (None, None))
+        try:
+            if task["status"] == "done":
+                if table and not record["persisted"]:
+                    with db_lock:
+                        db.update_rows(table, UPDATE={column: task["result"]}, WHERE={column: task_id})
+                    task["persisted"] = True
+                    task_journal.persist(task)
+            elif task["status"] in ("enqueued", "processing"):
+                myvim_thread = vim_threads["running"].get(record["thread"])
+                if not myvim_thread:
+                    error_text = "datacenter not found after restart"
+                elif task["status"] == "processing" and table:
+                    error_text = "interrupted by a restart of openmano; it could be created at VIM or not"
+                else:
+                    error_text = None
+                if error_text:
+                    logger.error("Task %s %s from journal: %s", task_id, task["name"], error_text)
+                    task["status"] = "error"
+                    task["result"] = error_text
+                    if table:
+                        with db_lock:
+                            db.update_rows(table, UPDATE={"status": "VIM_ERROR", "error_msg": error_text},
+                                           WHERE={column: task_id})
+                    task_journal.finish(task)
+                else:
+                    logger.debug("Resuming task %s %s from journal", task_id, task["name"])
+                    task["status"] = "enqueued"
+                    myvim_thread.insert_task(task)
+        except (db_base_Exception, vimconn.vimconnException) as e:
+            logger.error("Cannot resume task %s %s from journal: %s", task_id, task["name"], str(e))
+
+
 def start_service(mydb):
-    global db, global_config
-    db = nfvo_db.nfvo_db()
+    global db, global_config, task_journal, task_writer, instance_poller, image_cache
+    task_dict.ttl = global_config.get('task_retention', task_dict.ttl)
+    task_dict.max_size = global_config.get('task_registry_size', task_dict.max_size)
+    journal_tasks = None
+    if global_config.get('task_journal'):
+        task_journal = vim_tasks.task_journal(global_config['task_journal'])
+        journal_tasks = task_journal.load()
+    db = nfvo_db.nfvo_db(pool_size=global_config.get('db_pool_size', 10))
     db.connect(global_config['db_host'], global_config['db_user'], global_config['db_passwd'], global_config['db_name'])
+    if global_config.get('status_refresh_interval'):
+        instance_poller = status_poller.status_poller(db, refresh_instance, global_config['status_refresh_interval'],
+                                                   global_config.get('status_refresh_build_interval', 5))
+    task_writer = vim_tasks.task_result_writer(db, db_lock, journal=task_journal, poller=instance_poller)
+    task_writer.start()
+    vim_executor.workers = global_config.get('vim_executor_workers', vim_executor.workers)
+    vim_executor.vim_workers = global_config.get('vim_executor_per_vim', vim_executor.vim_workers)
+    vim_cache.idle = global_config.get('vim_cache_idle', vim_cache.idle)
+    refresh_fingerprints.max_size = global_config.get('refresh_cache_size', refresh_fingerprints.max_size)
+    if global_config.get('image_cache_dir'):
+        image_cache = vim_caches.image_cache(global_config['image_cache_dir'],
+                                             global_config.get('image_cache_size', 10240) * 1024 * 1024)
     from_= 'tenants_datacenters as td join datacenters as d on td.datacenter_id=d.uuid join datacenter_tenants as dt on td.datacenter_tenant_id=dt.uuid'
     select_ = ('type','d.config as config','d.uuid as datacenter_id', 'vim_url', 'vim_url_admin', 'd.name as datacenter_name',
                    'dt.uuid as datacenter_tenant_id','dt.vim_tenant_name as vim_tenant_name','dt.vim_tenant_id as vim_tenant_id',
@@ -148,11 +237,22 @@ def start_service(mydb):
                 raise NfvoException("Error at VIM  {}; {}: {}".format(vim["type"], type(e).__name__, str(e)), HTTP_Internal_Server_Error)
             thread_name = get_non_used_vim_name(vim['datacenter_name'], vim['vim_tenant_id'], vim['vim_tenant_name'], vim['vim_tenant_id'])
             new_thread = vim_thread.vim_thread(myvim, task_lock, thread_name, vim['datacenter_name'],
-                                               vim.get('datacenter_tenant_id'), db=db, db_lock=db_lock)
+                                               vim.get('datacenter_tenant_id'), db=db, db_lock=db_lock,
+                                               workers=global_config.get('vim_thread_workers', 1),
+                                               journal=task_journal, thread_id=thread_id,
+                                               result_writer=task_writer,
+                                               delete_retries=global_config.get('delete_retries', 3),
+                                               delete_retry_delay=global_config.get('delete_retry_delay', 5),
+                                               poller=instance_poller)
             new_thread.start()
             vim_threads["running"][thread_id] = new_thread
     except db_base_Exception as e:
         raise NfvoException(str(e) + " at nfvo.get_vim", e.http_code)
+    if task_journal:
+        resume_journal_tasks(journal_tasks)
+        task_journal.start_writer()
+    if instance_poller:
+        instance_poller.start()
 
 
 def stop_service():
@@ -160,6 +260,13 @@ def stop_service():
         thread.insert_task(new_task("exit", None, store=False))
         vim_threads["deleting"][thread_id] = thread
     vim_threads["running"] = {}
+    if task_writer:
+        task_writer.close()
+    if task_journal:
+        task_journal.close()
+    if instance_poller:
+        instance_poller.close()
+    vim_executor.close()
 
 
 def get_flavorlist(mydb, vnf_id, nfvo_tenant=None):
@@ -229,6 +336,12 @@ def get_vim(mydb, nfvo_tenant=None, datacenter_id=None, datacenter_name=None, da
         vims = mydb.get_rows(FROM=from_, SELECT=select_, WHERE=WHERE_dict )
         vim_dict={}
         for vim in vims:
+            cache_key = vim_cache.get_key(vim['datacenter_id'], vim.get('datacenter_tenant_id'), vim, vim_tenant,
+                                          vim_tenant_name, vim_user, vim_passwd)
+            myvim = vim_cache.get(cache_key)
+            if myvim:
+                vim_dict[vim['datacenter_id']] = myvim
+                continue
             extra={'datacenter_tenant_id': vim.get('datacenter_tenant_id')}
             if vim["config"]:
                 extra.update(yaml.load(vim["config"]))
@@ -267,50 +380,153 @@ def get_vim(mydb, nfvo_tenant=None, datacenter_id=None, datacenter_name=None, da
                         )
             except Exception as e:
                 raise NfvoException("Error at VIM  {}; {}: {}".format(vim["type"], type(e).__name__, str(e)), HTTP_Internal_Server_Error)
+            vim_cache.add(cache_key, vim_dict[vim['datacenter_id']])
         return vim_dict
     except db_base_Exception as e:
         raise NfvoException(str(e) + " at nfvo.get_vim", e.http_code)
 
 
 def rollback(mydb,  vims, rollback_list):
-    undeleted_items=[]
-    #delete things by reverse order
-    for i in range(len(rollback_list)-1, -1, -1):
-        item = rollback_list[i]
-        if item["where"]=="vim":
-            if item["vim_id"] not in vims:
+    '''Deletes the elements of rollback_list, see rollback_report. Returns (True, message) if all of them are
+    deleted, or (False, message with the undeleted ones)'''
+    report = rollback_report(mydb, vims, rollback_list)
+    if not report["failed"]:
+        return True," Rollback successful."
+    undeleted_items = []
+    for item in report["failed"]:
+        if item["where"] == "vim":
+            undeleted_items.append("{} {} from VIM {}".format(item['what'], item["uuid"], item["vim_name"]))
+        else:
+            undeleted_items.append("{} '{}'".format(item['what'], item["uuid"]))
+    return False," Rollback fails to delete: " + str(undeleted_items)
+
+
+#order in which the elements are deleted at rollback: VMs before the networks they use, flavors and images at the end
+rollback_vim_order = ("vm", "network", "flavor", "image")
+
+
+def rollback_report(mydb, vims, rollback_list):
+    '''Deletes the elements created so far by an operation that fails, recorded at rollback_list as dictionaries with
+    'where' (vim or mano), 'what' (vm, network, flavor, image), 'uuid' and, for the VIM ones, 'vim_id'.
+    The VIM elements of each kind, in the order of rollback_vim_order, are deleted concurrently at the vim_executor,
+    each one waiting at most the vim timeout; then the database rows are deleted with one command per table.
+    Returns a dictionary with the lists of items 'deleted', 'failed' (with their 'error') and 'skipped' (with the
+    'reason'), and the 'seconds' spent
+    '''
+    start_time = time()
+    report = {"deleted": [], "failed": [], "skipped": []}
+    vim_items = {}      # what: list of items
+    mano_items = {}     # what: list of items
+    for item in reversed(rollback_list):
+        item = dict(item)
+        if item["where"] == "vim":
+            vim = vims.get(item["vim_id"])
+            if not vim:
+                item["reason"] = "datacenter not available"
+                report["skipped"].append(item)
                 continue
-            vim=vims[ item["vim_id"] ]
-            try:
-                if item["what"]=="image":
-                    vim.delete_image(item["uuid"])
-                    mydb.delete_row(FROM="datacenters_images", WHERE={"datacenter_id": vim["id"], "vim_id":item["uuid"]})
-                elif item["what"]=="flavor":
-                    vim.delete_flavor(item["uuid"])
-                    mydb.delete_row(FROM="datacenters_flavors", WHERE={"datacenter_id": vim["id"], "vim_id":item["uuid"]})
-                elif item["what"]=="network":
-                    vim.delete_network(item["uuid"])
-                elif item["what"]=="vm":
-                    vim.delete_vminstance(item["uuid"])
-            except vimconn.vimconnException as e:
-                logger.error("Error in rollback. Not possible to delete VIM %s '%s'. Message: %s", item['what'], item["uuid"], str(e))
-                undeleted_items.append("{} {} from VIM {}".format(item['what'], item["uuid"], vim["name"]))
-            except db_base_Exception as e:
-                logger.error("Error in rollback. Not possible to delete %s '%s' from DB.datacenters Message: %s", item['what'], item["uuid"], str(e))
+            item["vim_name"] = vim["name"]
+            vim_items.setdefault(item["what"], []).append(item)
+        else:
+            mano_items.setdefault(item["what"], []).append(item)
 
-        else: # where==mano
+    #1 VIM elements, by kind
+    vim_deleted = {}    # (what, datacenter_id): list of deleted VIM ids
+    for what in rollback_vim_order + tuple(w for w in vim_items if w not in rollback_vim_order):
+        items = vim_items.get(what)
+        if not items:
+            continue
+        calls = []
+        for item in items:
+            vim = vims[item["vim_id"]]
+            timeout = get_vim_timeout(vim)
+            calls.append((item, vim_executor.submit_at(item["vim_id"], _rollback_vim_item, vim, item, timeout),
+                          time() + timeout))
+        for item, call, deadline in calls:
             try:
-                if item["what"]=="image":
-                    mydb.delete_row(FROM="images", WHERE={"uuid": item["uuid"]})
-                elif item["what"]=="flavor":
-                    mydb.delete_row(FROM="flavors", WHERE={"uuid": item["uuid"]})
-            except db_base_Exception as e:
-                logger.error("Error in rollback. Not possible to delete %s '%s' from DB. Message: %s", item['what'], item["uuid"], str(e))
-                undeleted_items.append("{} '{}'".format(item['what'], item["uuid"]))
-    if len(undeleted_items)==0:
-        return True," Rollback successful."
-    else:
-        return False," Rollback fails to delete: " + str(undeleted_items)
+                result = call.get_result(max(0, deadline - time()))
+            except Exception as e:
+                if not isinstance(e, vimconn.vimconnException):
+                    logger.error("Unexpected exception at rollback: %s", str(e), exc_info=True)
+                logger.error("Error in rollback. Not possible to delete VIM %s '%s'. Message: %s", item['what'],
+                             item["uuid"], str(e))
+                item["error"] = str(e)
+                report["failed"].append(item)
+                continue
+            if result is not None:
+                item["reason"] = result
+                report["skipped"].append(item)
+            else:
+                report["deleted"].append(item)
+                vim_deleted.setdefault((what, item["vim_id"]), []).append(item["uuid"])
+
+    #2 database rows of the deleted VIM images and flavors, and of the MANO elements
+    deletions = []  # table, WHERE, items
+    for (what, datacenter_id), vim_ids in vim_deleted.items():
+        if what in ("image", "flavor"):
+            deletions.append(("datacenters_{}s".format(what), {"datacenter_id": datacenter_id, "vim_id": vim_ids},
+                              None))
+    for what in ("flavor", "image"):
+        if mano_items.get(what):
+            deletions.append(("{}s".format(what), {"uuid": [item["uuid"] for item in mano_items[what]]},
+                              mano_items[what]))
+    for what, items in mano_items.items():
+        if what not in ("flavor", "image"):
+            report["skipped"] += [dict(item, reason="nothing to delete") for item in items]
+    for table, WHERE, items in deletions:
+        try:
+            mydb.delete_row(FROM=table, WHERE=WHERE)
+            if items:
+                report["deleted"] += items
+        except db_base_Exception as e:
+            logger.error("Error in rollback. Not possible to delete from DB.%s %s. Message: %s", table, str(WHERE),
+                         str(e))
+            for item in items or ():
+                item["error"] = str(e)
+                report["failed"].append(item)
+    report["seconds"] = time() - start_time
+    return report
+
+
+def _rollback_vim_item(vim, item, timeout):
+    '''Deletes an element of the rollback list from its VIM. A VM or network still given by the task that creates it
+    is deleted once the task finishes, or not created if it has not started. Returns None if deleted or not found, or
+    the reason if there is nothing to delete'''
+    vim_id = item["uuid"]
+    if item["what"] in ("vm", "network") and is_task_id(vim_id):
+        deadline = time() + timeout
+        while True:
+            with task_lock:
+                task = task_dict.get(vim_id)
+                status = task["status"] if task else None
+                if status == "enqueued":
+                    task["status"] = "deleted"     # the vim_thread worker skips it when dequeued
+                elif status == "done":
+                    vim_id = task["result"]
+            if status != "processing" or time() > deadline:
+                break
+            sleep(0.1)
+        if status is None:
+            return "task not found"
+        elif status in ("enqueued", "deleted"):
+            return "not created"
+        elif status == "error":
+            return "not created: " + str(task["result"])
+        elif status == "processing":
+            raise vimconn.vimconnConnectionException("still being created after {} seconds".format(timeout))
+    try:
+        if item["what"] == "vm":
+            vim.delete_vminstance(vim_id)
+        elif item["what"] == "network":
+            vim.delete_network(vim_id)
+        elif item["what"] == "flavor":
+            vim.delete_flavor(vim_id)
+        elif item["what"] == "image":
+            vim.delete_image(vim_id)
+        else:
+            return "unknown element"
+    except vimconn.vimconnNotFoundException as e:
+        logger.debug("Rollback: VIM %s '%s' already deleted: %s", item["what"], vim_id, str(e))
 
 
 def check_vnf_descriptor(vnf_descriptor, vnf_descriptor_version=1):
@@ -427,6 +643,37 @@ def check_vnf_descriptor(vnf_descriptor, vnf_descriptor_version=1):
                     HTTP_Bad_Request)
 
 
+def _run_at_vims(vims, rollback_list, function, *args):
+    '''Calls function(vim_id, vim, rollback_items, *args) for every VIM of vims concurrently at the vim_executor,
+    waiting for all of them without a deadline, as an image upload can take long. Each call appends its rollback
+    entries to its own rollback_items, that are added to rollback_list in the order of vims once all the calls are
+    done, also when some of them fail; then the first exception, if any, is raised. Errors that must not stop the
+    provisioning, as return_on_error False, are handled by function. Returns the list of results in the order of vims'''
+    vim_items = vims.items()
+    items_list = [[] for _ in vim_items]
+    if len(vim_items) <= 1:
+        try:
+            return [function(vim_id, vim, items_list[index], *args) for index, (vim_id, vim) in enumerate(vim_items)]
+        finally:
+            for items in items_list:
+                rollback_list += items
+    calls = [vim_executor.submit_at(vim_id, function, vim_id, vim, items_list[index], *args)
+             for index, (vim_id, vim) in enumerate(vim_items)]
+    results = []
+    first_exception = None
+    for index, call in enumerate(calls):
+        try:
+            results.append(call.get_result())
+        except Exception as e:
+            results.append(None)
+            if first_exception is None:
+                first_exception = e
+        rollback_list += items_list[index]
+    if first_exception is not None:
+        raise first_exception
+    return results
+
+
 def create_or_use_image(mydb, vims, image_dict, rollback_list, only_create_at_vim=False, return_on_error = None):
     #look if image exist
     if only_create_at_vim:
@@ -449,65 +696,83 @@ def create_or_use_image(mydb, vims, image_dict, rollback_list, only_create_at_vi
             #temp_image_dict['location'] = image_dict.get('new_location') if image_dict['location'] is None
             image_mano_id = mydb.new_row('images', temp_image_dict, add_uuid=True)
             rollback_list.append({"where":"mano", "what":"image","uuid":image_mano_id})
-    #create image at every vim
-    for vim_id,vim in vims.iteritems():
-        image_created="false"
-        #look at database
-        image_db = mydb.get_rows(FROM="datacenters_images", WHERE={'datacenter_id':vim_id, 'image_id':image_mano_id})
-        #look at VIM if this image exist
-        try:
-            if image_dict['location'] is not None:
-                image_vim_id = vim.get_image_id_from_path(image_dict['location'])
+    #create image at every vim, concurrently
+    image_vim_ids = _run_at_vims(vims, rollback_list, _create_or_use_image_at_vim, mydb, image_dict, image_mano_id,
+                                 return_on_error)
+    image_vim_id = image_vim_ids[-1] if image_vim_ids else None
+    return image_vim_id if only_create_at_vim else image_mano_id
+
+
+def _create_or_use_image_at_vim(vim_id, vim, rollback_list, mydb, image_dict, image_mano_id, return_on_error):
+    '''Looks for the image at one VIM, creating it if needed, and stores its vim_id at datacenters_images.
+    Returns the image vim_id, or None if it fails and not return_on_error'''
+    image_created="false"
+    #look at database
+    image_db = mydb.get_rows(FROM="datacenters_images", WHERE={'datacenter_id':vim_id, 'image_id':image_mano_id})
+    #look at VIM if this image exist
+    try:
+        if image_dict['location'] is not None:
+            image_vim_id = vim.get_image_id_from_path(image_dict['location'])
+        else:
+            filter_dict = {}
+            filter_dict['name'] = image_dict['universal_name']
+            if image_dict.get('checksum') != None:
+                filter_dict['checksum'] = image_dict['checksum']
+            #logger.debug('>>>>>>>> Filter dict: %s', str(filter_dict))
+            vim_images = vim.get_image_list(filter_dict)
+            #logger.debug('>>>>>>>> VIM images: %s', str(vim_images))
+            if len(vim_images) > 1:
+                raise vimconn.vimconnException("More than one candidate VIM image found for filter: {}".format(str(filter_dict)), HTTP_Conflict)
+            elif len(vim_images) == 0:
+                raise vimconn.vimconnNotFoundException("Image not found at VIM with filter: '{}'".format(str(filter_dict)))
             else:
-                filter_dict = {}
-                filter_dict['name'] = image_dict['universal_name']
-                if image_dict.get('checksum') != None:
-                    filter_dict['checksum'] = image_dict['checksum']
-                #logger.debug('>>>>>>>> Filter dict: %s', str(filter_dict))
-                vim_images = vim.get_image_list(filter_dict)
-                #logger.debug('>>>>>>>> VIM images: %s', str(vim_images))
-                if len(vim_images) > 1:
-                    raise vimconn.vimconnException("More than one candidate VIM image found for filter: {}".format(str(filter_dict)), HTTP_Conflict)
-                elif len(vim_images) == 0:
-                    raise vimconn.vimconnNotFoundException("Image not found at VIM with filter: '{}'".format(str(filter_dict)))
-                else:
-                    #logger.debug('>>>>>>>> VIM image 0: %s', str(vim_images[0]))
-                    image_vim_id = vim_images[0]['id']
+                #logger.debug('>>>>>>>> VIM image 0: %s', str(vim_images[0]))
+                image_vim_id = vim_images[0]['id']
 
-        except vimconn.vimconnNotFoundException as e:
-            #Create the image in VIM only if image_dict['location'] or image_dict['new_location'] is not None
-            try:
-                #image_dict['location']=image_dict.get('new_location') if image_dict['location'] is None
-                if image_dict['location']:
-                    image_vim_id = vim.new_image(image_dict)
-                    rollback_list.append({"where":"vim", "vim_id": vim_id, "what":"image","uuid":image_vim_id})
-                    image_created="true"
-                else:
-                    #If we reach this point, then the image has image name, and optionally checksum, and could not be found
-                    raise vimconn.vimconnException(str(e))
-            except vimconn.vimconnException as e:
-                if return_on_error:
-                    logger.error("Error creating image at VIM '%s': %s", vim["name"], str(e))
-                    raise
-                image_vim_id = None
-                logger.warn("Error creating image at VIM '%s': %s", vim["name"], str(e))
-                continue
+    except vimconn.vimconnNotFoundException as e:
+        #Create the image in VIM only if image_dict['location'] or image_dict['new_location'] is not None
+        try:
+            #image_dict['location']=image_dict.get('new_location') if image_dict['location'] is None
+            if image_dict['location']:
+                #the connector can add the checksum computed while uploading
+                vim_image_dict = image_dict.copy()
+                if image_cache and image_dict['location'][0:4]=="http":
+                    #downloaded once for all the VIMs
+                    try:
+                        vim_image_dict['local_path'], checksum = image_cache.get(image_dict['location'],
+                                                                                 image_dict.get('checksum'))
+                        vim_image_dict['checksum'] = checksum
+                    except vimconn.vimconnConnectionException as e:
+                        logger.warn("Image '%s' not cached, the VIM gets it: %s", image_dict['location'], str(e))
+                image_vim_id = vim.new_image(vim_image_dict)
+                rollback_list.append({"where":"vim", "vim_id": vim_id, "what":"image","uuid":image_vim_id})
+                image_created="true"
+                if not image_dict.get('checksum') and vim_image_dict.get('checksum'):
+                    mydb.update_rows('images', UPDATE={'checksum': vim_image_dict['checksum']},
+                                     WHERE={'uuid': image_mano_id})
+            else:
+                #If we reach this point, then the image has image name, and optionally checksum, and could not be found
+                raise vimconn.vimconnException(str(e))
         except vimconn.vimconnException as e:
             if return_on_error:
-                logger.error("Error contacting VIM to know if the image exists at VIM: %s", str(e))
+                logger.error("Error creating image at VIM '%s': %s", vim["name"], str(e))
                 raise
-            logger.warn("Error contacting VIM to know if the image exists at VIM: %s", str(e))
-            image_vim_id = None
-            continue
-        #if we reach here, the image has been created or existed
-        if len(image_db)==0:
-            #add new vim_id at datacenters_images
-            mydb.new_row('datacenters_images', {'datacenter_id':vim_id, 'image_id':image_mano_id, 'vim_id': image_vim_id, 'created':image_created})
-        elif image_db[0]["vim_id"]!=image_vim_id:
-            #modify existing vim_id at datacenters_images
-            mydb.update_rows('datacenters_images', UPDATE={'vim_id':image_vim_id}, WHERE={'datacenter_id':vim_id, 'image_id':image_mano_id})
-
-    return image_vim_id if only_create_at_vim else image_mano_id
+            logger.warn("Error creating image at VIM '%s': %s", vim["name"], str(e))
+            return None
+    except vimconn.vimconnException as e:
+        if return_on_error:
+            logger.error("Error contacting VIM to know if the image exists at VIM: %s", str(e))
+            raise
+        logger.warn("Error contacting VIM to know if the image exists at VIM: %s", str(e))
+        return None
+    #if we reach here, the image has been created or existed
+    if len(image_db)==0:
+        #add new vim_id at datacenters_images
+        mydb.new_row('datacenters_images', {'datacenter_id':vim_id, 'image_id':image_mano_id, 'vim_id': image_vim_id, 'created':image_created})
+    elif image_db[0]["vim_id"]!=image_vim_id:
+        #modify existing vim_id at datacenters_images
+        mydb.update_rows('datacenters_images', UPDATE={'vim_id':image_vim_id}, WHERE={'datacenter_id':vim_id, 'image_id':image_mano_id})
+    return image_vim_id
 
 
 def create_or_use_flavor(mydb, vims, flavor_dict, rollback_list, only_create_at_vim=False, return_on_error = None):
@@ -559,108 +824,118 @@ def create_or_use_flavor(mydb, vims, flavor_dict, rollback_list, only_create_at_
             content = mydb.new_row('flavors', temp_flavor_dict, add_uuid=True)
             flavor_mano_id= content
             rollback_list.append({"where":"mano", "what":"flavor","uuid":flavor_mano_id})
-    #create flavor at every vim
     if 'uuid' in flavor_dict:
         del flavor_dict['uuid']
-    flavor_vim_id=None
-    for vim_id,vim in vims.items():
-        flavor_created="false"
-        #look at database
-        flavor_db = mydb.get_rows(FROM="datacenters_flavors", WHERE={'datacenter_id':vim_id, 'flavor_id':flavor_mano_id})
-        #look at VIM if this flavor exist  SKIPPED
-        #res_vim, flavor_vim_id = vim.get_flavor_id_from_path(flavor_dict['location'])
-        #if res_vim < 0:
-        #    print "Error contacting VIM to know if the flavor %s existed previously." %flavor_vim_id
-        #    continue
-        #elif res_vim==0:
-
-        #Create the flavor in VIM
-        #Translate images at devices from MANO id to VIM id
-        disk_list = []
-        if 'extended' in flavor_dict and flavor_dict['extended']!=None and "devices" in flavor_dict['extended']:
-            #make a copy of original devices
-            devices_original=[]
-
-            for device in flavor_dict["extended"].get("devices",[]):
-                dev={}
-                dev.update(device)
-                devices_original.append(dev)
-                if 'image' in device:
-                    del device['image']
-                if 'image metadata' in device:
-                    del device['image metadata']
-            dev_nb=0
-            for index in range(0,len(devices_original)) :
-                device=devices_original[index]
-                if "image" not in device and "image name" not in device:
-                    if 'size' in device:
-                        disk_list.append({'size': device.get('size', default_volume_size)})
-                    continue
-                image_dict={}
-                image_dict['name']=device.get('image name',flavor_dict['name']+str(dev_nb)+"-img")
-                image_dict['universal_name']=device.get('image name')
-                image_dict['description']=flavor_dict['name']+str(dev_nb)+"-img"
-                image_dict['location']=device.get('image')
-                #image_dict['new_location']=device.get('image location')
-                image_dict['checksum']=device.get('image checksum')
-                image_metadata_dict = device.get('image metadata', None)
-                image_metadata_str = None
-                if image_metadata_dict != None:
-                    image_metadata_str = yaml.safe_dump(image_metadata_dict,default_flow_style=True,width=256)
-                image_dict['metadata']=image_metadata_str
-                image_mano_id=create_or_use_image(mydb, vims, image_dict, rollback_list, only_create_at_vim=False, return_on_error=return_on_error )
-                image_dict["uuid"]=image_mano_id
-                image_vim_id=create_or_use_image(mydb, vims, image_dict, rollback_list, only_create_at_vim=True, return_on_error=return_on_error)
-
-                #save disk information (image must be based on and size
-                disk_list.append({'image_id': image_vim_id, 'size': device.get('size', default_volume_size)})
-
-                flavor_dict["extended"]["devices"][index]['imageRef']=image_vim_id
-                dev_nb += 1
-        if len(flavor_db)>0:
-            #check that this vim_id exist in VIM, if not create
-            flavor_vim_id=flavor_db[0]["vim_id"]
-            try:
-                vim.get_flavor(flavor_vim_id)
-                continue #flavor exist
-            except vimconn.vimconnException:
-                pass
-        #create flavor at vim
-        logger.debug("nfvo.create_or_use_flavor() adding flavor to VIM %s", vim["name"])
+    #Look for the images at devices at MANO, before going to the VIMs, so they are not created twice
+    device_images = {}  # index of the device: image_dict with the image mano uuid
+    device_sizes = {}   # index of the device: size of a disk without image
+    if 'extended' in flavor_dict and flavor_dict['extended']!=None and "devices" in flavor_dict['extended']:
+        dev_nb=0
+        for index, device in enumerate(flavor_dict["extended"]["devices"]):
+            if "image" not in device and "image name" not in device:
+                if 'size' in device:
+                    device_sizes[index] = device.get('size', default_volume_size)
+                continue
+            image_dict={}
+            image_dict['name']=device.get('image name',flavor_dict['name']+str(dev_nb)+"-img")
+            image_dict['universal_name']=device.get('image name')
+            image_dict['description']=flavor_dict['name']+str(dev_nb)+"-img"
+            image_dict['location']=device.get('image')
+            #image_dict['new_location']=device.get('image location')
+            image_dict['checksum']=device.get('image checksum')
+            image_metadata_dict = device.get('image metadata', None)
+            image_metadata_str = None
+            if image_metadata_dict != None:
+                image_metadata_str = yaml.safe_dump(image_metadata_dict,default_flow_style=True,width=256)
+            image_dict['metadata']=image_metadata_str
+            image_dict["uuid"]=create_or_use_image(mydb, vims, image_dict, rollback_list, only_create_at_vim=False, return_on_error=return_on_error )
+            device_images[index] = (image_dict, device.get('size', default_volume_size))
+            dev_nb += 1
+            if 'image' in device:
+                del device['image']
+            if 'image metadata' in device:
+                del device['image metadata']
+    #create flavor at every vim, concurrently
+    flavor_vim_ids = _run_at_vims(vims, rollback_list, _create_or_use_flavor_at_vim, mydb, flavor_dict, flavor_mano_id,
+                                  device_images, device_sizes, return_on_error)
+    flavor_vim_id = flavor_vim_ids[-1] if flavor_vim_ids else None
+    return flavor_vim_id if only_create_at_vim else flavor_mano_id
+
+
+def _create_or_use_flavor_at_vim(vim_id, vim, rollback_list, mydb, flavor_dict, flavor_mano_id, device_images,
+                                 device_sizes, return_on_error):
+    '''Looks for the flavor at one VIM, creating it and the images of its devices if needed, and stores its vim_id at
+    datacenters_flavors. Returns the flavor vim_id, or None if it fails and not return_on_error'''
+    flavor_created="false"
+    #the device imageRef are different at each VIM
+    flavor_dict = copy.deepcopy(flavor_dict)
+    #look at database
+    flavor_db = mydb.get_rows(FROM="datacenters_flavors", WHERE={'datacenter_id':vim_id, 'flavor_id':flavor_mano_id})
+    #look at VIM if this flavor exist  SKIPPED
+    #res_vim, flavor_vim_id = vim.get_flavor_id_from_path(flavor_dict['location'])
+    #if res_vim < 0:
+    #    print "Error contacting VIM to know if the flavor %s existed previously." %flavor_vim_id
+    #    continue
+    #elif res_vim==0:
+
+    #Create the flavor in VIM
+    #Translate images at devices from MANO id to VIM id
+    disk_list = []
+    if 'extended' in flavor_dict and flavor_dict['extended']!=None and "devices" in flavor_dict['extended']:
+        for index in range(0, len(flavor_dict["extended"]["devices"])):
+            if index in device_sizes:
+                disk_list.append({'size': device_sizes[index]})
+            if index not in device_images:
+                continue
+            image_dict, size = device_images[index]
+            image_vim_id=create_or_use_image(mydb, {vim_id: vim}, image_dict, rollback_list, only_create_at_vim=True, return_on_error=return_on_error)
+
+            #save disk information (image must be based on and size
+            disk_list.append({'image_id': image_vim_id, 'size': size})
+
+            flavor_dict["extended"]["devices"][index]['imageRef']=image_vim_id
+    if len(flavor_db)>0:
+        #check that this vim_id exist in VIM, if not create
+        flavor_vim_id=flavor_db[0]["vim_id"]
         try:
-            flavor_vim_id = None
-            flavor_vim_id=vim.get_flavor_id_from_data(flavor_dict)
-            flavor_create="false"
-        except vimconn.vimconnException as e:
+            vim.get_flavor(flavor_vim_id)
+            return flavor_vim_id #flavor exist
+        except vimconn.vimconnException:
             pass
-        try:
-            if not flavor_vim_id:
-                flavor_vim_id = vim.new_flavor(flavor_dict)
-                rollback_list.append({"where":"vim", "vim_id": vim_id, "what":"flavor","uuid":flavor_vim_id})
-                flavor_created="true"
-        except vimconn.vimconnException as e:
-            if return_on_error:
-                logger.error("Error creating flavor at VIM %s: %s.", vim["name"], str(e))
-                raise
-            logger.warn("Error creating flavor at VIM %s: %s.", vim["name"], str(e))
-            flavor_vim_id = None
-            continue
-        #if reach here the flavor has been create or exist
-        if len(flavor_db)==0:
-            #add new vim_id at datacenters_flavors
-            extended_devices_yaml = None
-            if len(disk_list) > 0:
-                extended_devices = dict()
-                extended_devices['disks'] = disk_list
-                extended_devices_yaml = yaml.safe_dump(extended_devices,default_flow_style=True,width=256)
-            mydb.new_row('datacenters_flavors',
-                        {'datacenter_id':vim_id, 'flavor_id':flavor_mano_id, 'vim_id': flavor_vim_id,
-                        'created':flavor_created,'extended': extended_devices_yaml})
-        elif flavor_db[0]["vim_id"]!=flavor_vim_id:
-            #modify existing vim_id at datacenters_flavors
-            mydb.update_rows('datacenters_flavors', UPDATE={'vim_id':flavor_vim_id}, WHERE={'datacenter_id':vim_id, 'flavor_id':flavor_mano_id})
-
-    return flavor_vim_id if only_create_at_vim else flavor_mano_id
+    #create flavor at vim
+    logger.debug("nfvo.create_or_use_flavor() adding flavor to VIM %s", vim["name"])
+    try:
+        flavor_vim_id = None
+        flavor_vim_id=vim.get_flavor_id_from_data(flavor_dict)
+        flavor_create="false"
+    except vimconn.vimconnException as e:
+        pass
+    try:
+        if not flavor_vim_id:
+            flavor_vim_id = vim.new_flavor(flavor_dict)
+            rollback_list.append({"where":"vim", "vim_id": vim_id, "what":"flavor","uuid":flavor_vim_id})
+            flavor_created="true"
+    except vimconn.vimconnException as e:
+        if return_on_error:
+            logger.error("Error creating flavor at VIM %s: %s.", vim["name"], str(e))
+            raise
+        logger.warn("Error creating flavor at VIM %s: %s.", vim["name"], str(e))
+        return None
+    #if reach here the flavor has been create or exist
+    if len(flavor_db)==0:
+        #add new vim_id at datacenters_flavors
+        extended_devices_yaml = None
+        if len(disk_list) > 0:
+            extended_devices = dict()
+            extended_devices['disks'] = disk_list
+            extended_devices_yaml = yaml.safe_dump(extended_devices,default_flow_style=True,width=256)
+        mydb.new_row('datacenters_flavors',
+                    {'datacenter_id':vim_id, 'flavor_id':flavor_mano_id, 'vim_id': flavor_vim_id,
+                    'created':flavor_created,'extended': extended_devices_yaml})
+    elif flavor_db[0]["vim_id"]!=flavor_vim_id:
+        #modify existing vim_id at datacenters_flavors
+        mydb.update_rows('datacenters_flavors', UPDATE={'vim_id':flavor_vim_id}, WHERE={'datacenter_id':vim_id, 'flavor_id':flavor_mano_id})
+    return flavor_vim_id
 
 
 def new_vnf(mydb, tenant_id, vnf_descriptor):
@@ -2257,18 +2532,25 @@ def create_instance(mydb, tenant_id, instance_dict):
         logger.debug("create_instance Deployment done scenarioDict: %s",
                     yaml.safe_dump(scenarioDict, indent=4, default_flow_style=False) )
         instance_id = mydb.new_instance_scenario_as_a_whole(tenant_id,instance_name, instance_description, scenarioDict)
+        with task_lock:
+            task_dict.set_instance_tasks(instance_id, instance_tasks, new_operation("create"))
         # Update database with those ended tasks
         for task in instance_tasks.values():
-            if task["status"] == "ok":
+            if task["status"] == "done":
                 if task["name"] == "new-vm":
                     mydb.update_rows("instance_vms", UPDATE={"vim_vm_id": task["result"]},
                                      WHERE={"vim_vm_id": task["id"]})
                 elif task["name"] == "new-net":
                     mydb.update_rows("instance_nets", UPDATE={"vim_net_id": task["result"]},
                                      WHERE={"vim_net_id": task["id"]})
+                task["persisted"] = True
+                if task_journal:
+                    task_journal.persist(task)
+        if instance_poller:
+            instance_poller.wake(myvims.keys())
         return mydb.get_instance_scenario(instance_id)
     except (NfvoException, vimconn.vimconnException,db_base_Exception)  as e:
-        message = rollback(mydb, myvims, rollbackList)
+        _, message = rollback(mydb, myvims, rollbackList)
         if isinstance(e, db_base_Exception):
             error_text = "database Exception"
         elif isinstance(e, vimconn.vimconnException):
@@ -2281,6 +2563,10 @@ def create_instance(mydb, tenant_id, instance_dict):
 
 
 def delete_instance(mydb, tenant_id, instance_id):
+    '''Deletes the instance from database, and launches the VIM tasks that delete its VMs and then its nets, retried
+    if they fail. Returns a dictionary with the 'result' message, the 'instance_id' and the 'operation_id' to follow
+    the VIM deletion with get_instance_progress
+    '''
     #print "Checking that the instance_id exists and getting the instance dictionary"
     instanceDict = mydb.get_instance_scenario(instance_id, tenant_id)
     #print yaml.safe_dump(instanceDict, indent=4, default_flow_style=False)
@@ -2289,11 +2575,22 @@ def delete_instance(mydb, tenant_id, instance_id):
 
     #1. Delete from Database
     message = mydb.delete_instance_scenario(instance_id, tenant_id)
+    if instance_poller:
+        instance_poller.forget(instanceDict["uuid"])
+    fingerprint_keys = [net["uuid"] for net in instanceDict['nets']]
+    for sce_vnf in instanceDict['vnfs']:
+        for vm in sce_vnf['vms']:
+            fingerprint_keys.append(vm["uuid"])
+            fingerprint_keys += [(vm["uuid"], interface.get("vim_interface_id"))
+                                 for interface in vm.get("interfaces", ())]
+    refresh_fingerprints.forget(fingerprint_keys)
 
     #2. delete from VIM
     error_msg = ""
     myvims = {}
     myvim_threads = {}
+    instance_tasks = {}
+    vm_tasks = {}   # datacenter_key: {task_id: del-vm task}. Nets are deleted after the VMs of the same datacenter
 
     #2.1 deleting VMs
     #vm_fail_list=[]
@@ -2324,13 +2621,16 @@ def delete_instance(mydb, tenant_id, instance_id):
                 task=None
                 if is_task_id(vm['vim_vm_id']):
                     task_id = vm['vim_vm_id']
-                    old_task = task_dict.get(task_id)
+                    with task_lock:
+                        old_task = task_dict.get(task_id)
                     if not old_task:
                         error_msg += "\n    VM was scheduled for create, but task {} is not found".format(task_id)
                         continue
                     with task_lock:
                         if old_task["status"] == "enqueued":
                             old_task["status"] = "deleted"
+                            if task_journal:
+                                task_journal.finish(old_task)
                         elif old_task["status"] == "error":
                             continue
                         elif old_task["status"] == "processing":
@@ -2341,6 +2641,8 @@ def delete_instance(mydb, tenant_id, instance_id):
                     task = new_task("del-vm", vm['vim_vm_id'], store=False)
                 if task:
                     myvim_thread.insert_task(task)
+                    instance_tasks[task["id"]] = task
+                    vm_tasks.setdefault(datacenter_key, {})[task["id"]] = task
             except vimconn.vimconnNotFoundException as e:
                 error_msg+="\n    VM VIM_id={} not found at datacenter={}".format(vm['vim_vm_id'], sce_vnf["datacenter_id"])
                 logger.warn("VM instance '%s'uuid '%s', VIM id '%s', from VNF_id '%s' not found",
@@ -2358,7 +2660,7 @@ def delete_instance(mydb, tenant_id, instance_id):
         datacenter_key = (net["datacenter_id"], net["datacenter_tenant_id"])
         if datacenter_key not in myvims:
             try:
-                myvim_thread = get_vim_thread(tenant_id, sce_vnf["datacenter_id"], sce_vnf["datacenter_tenant_id"])
+                myvim_thread = get_vim_thread(tenant_id, net["datacenter_id"], net["datacenter_tenant_id"])
             except NfvoException as e:
                 logger.error(str(e))
                 myvim_thread = None
@@ -2378,25 +2680,31 @@ def delete_instance(mydb, tenant_id, instance_id):
             continue
         try:
             task = None
+            depends = dict(vm_tasks.get(datacenter_key, {}))
             if is_task_id(net['vim_net_id']):
                 task_id = net['vim_net_id']
-                old_task = task_dict.get(task_id)
+                with task_lock:
+                    old_task = task_dict.get(task_id)
                 if not old_task:
                     error_msg += "\n    NET was scheduled for create, but task {} is not found".format(task_id)
                     continue
                 with task_lock:
                     if old_task["status"] == "enqueued":
                         old_task["status"] = "deleted"
+                        if task_journal:
+                            task_journal.finish(old_task)
                     elif old_task["status"] == "error":
                         continue
                     elif old_task["status"] == "processing":
-                        task = new_task("del-net", task_id, depends={task_id: old_task})
+                        depends[task_id] = old_task
+                        task = new_task("del-net", task_id, depends=depends)
                     else:  # ok
-                        task = new_task("del-net", old_task["result"])
+                        task = new_task("del-net", old_task["result"], depends=depends)
             else:
-                task = new_task("del-net", net['vim_net_id'], store=False)
+                task = new_task("del-net", net['vim_net_id'], store=False, depends=depends)
             if task:
                 myvim_thread.insert_task(task)
+                instance_tasks[task["id"]] = task
         except vimconn.vimconnNotFoundException as e:
             error_msg += "\n    NET VIM_id={} not found at datacenter={}".format(net['vim_net_id'], net["datacenter_id"])
             logger.warn("NET '%s', VIM_id '%s', from VNF_net_id '%s' not found",
@@ -2407,10 +2715,121 @@ def delete_instance(mydb, tenant_id, instance_id):
                                                                                     e.http_code, str(e))
             logger.error("Error %d deleting NET '%s', VIM_id '%s', from VNF_net_id '%s': %s",
                          e.http_code, net['uuid'], net['vim_net_id'], str(net['vnf_net_id']), str(e))
+    operation = new_operation("delete")
+    with task_lock:
+        task_dict.set_instance_tasks(instanceDict["uuid"], instance_tasks, operation)
     if len(error_msg) > 0:
-        return 'instance ' + message + ' deleted but some elements could not be deleted, or already deleted (error: 404) from VIM: ' + error_msg
+        message = 'instance ' + message + ' deleted but some elements could not be deleted, or already deleted (error: 404) from VIM: ' + error_msg
     else:
-        return 'instance ' + message + ' deleted'
+        message = 'instance ' + message + ' deleted'
+    return {"result": message, "instance_id": instanceDict["uuid"], "operation_id": operation["id"]}
+
+
+def get_instance_progress(mydb, tenant_id, instance_id):
+    '''Obtain the progress of the VIM tasks launched by the last creation or deletion of an instance
+    Params:
+        instance_id: uuid or name of the instance, or the operation_id of its last creation or deletion. Deleted
+            instances are only found by uuid or operation_id
+    Returns a dictionary with the instance uuid, the 'operation' (id, name, created), 'completed' when none of
+    the tasks is pending or running, and the tasks grouped by 'pending', 'running', 'done', 'failed' and 'deleted'.
+    Pending tasks are enqueued, waiting for the tasks they depend on, or waiting to be retried
+    '''
+    with task_lock:
+        instance_tasks = task_dict.get_instance_tasks(instance_id)
+        found_id, operation = task_dict.get_instance_operation(instance_id)
+    if found_id:
+        instance_id = found_id
+    if instance_tasks is None:
+        WHERE_dict = {}
+        if tenant_id:
+            WHERE_dict["tenant_id"] = tenant_id
+        if utils.check_valid_uuid(instance_id):
+            WHERE_dict["uuid"] = instance_id
+        else:
+            WHERE_dict["name"] = instance_id
+        instances = mydb.get_rows(FROM="instance_scenarios", SELECT=("uuid",), WHERE=WHERE_dict)
+        if len(instances) == 0:
+            raise NfvoException("instance '{}' not found".format(instance_id), HTTP_Not_Found)
+        elif len(instances) > 1:
+            raise NfvoException("More than one instance with name '{}'".format(instance_id), HTTP_Conflict)
+        instance_id = instances[0]["uuid"]
+        with task_lock:
+            instance_tasks = task_dict.get_instance_tasks(instance_id)
+            operation = task_dict.get_instance_operation(instance_id)[1]
+    progress = {"instance_id": instance_id, "operation": operation, "pending": [], "running": [], "done": [],
+                "failed": [], "deleted": []}
+    status2group = {"enqueued": "pending", "processing": "running", "done": "done", "ok": "done", "error": "failed",
+                    "deleted": "deleted"}
+    with task_lock:
+        for task in (instance_tasks or {}).values():
+            task_info = {"id": task["id"], "name": task["name"]}
+            depends = [t["id"] for t in task.get("depends", {}).values()]
+            if depends:
+                task_info["depends"] = depends
+            if task["status"] == "error":
+                task_info["error"] = task["result"]
+            if task.get("retries"):
+                task_info["retries"] = task["retries"]
+                if task["status"] == "enqueued":
+                    task_info["error"] = task["result"]
+            progress[status2group.get(task["status"], "pending")].append(task_info)
+    progress["completed"] = not progress["pending"] and not progress["running"]
+    return progress
+
+
+def get_vim_timeout(myvim):
+    '''Seconds to wait for a VIM answer: the 'vim_timeout' of the datacenter config, or the global one'''
+    return (myvim.config or {}).get('vim_timeout', global_config.get('vim_timeout', 60))
+
+
+def _get_refresh_results(myvims, pending_calls, element_list, kind):
+    '''Collects the results of the status refresh of one kind, "vms" or "nets", of all the datacenters.
+    The elements of a datacenter that is not found, fails or does not answer in time get the VIM_ERROR status,
+    without affecting the other datacenters'''
+    status_dict = {}
+    for datacenter_key, elements in element_list.items():
+        if not elements:
+            continue
+        failed_message = None
+        if not myvims.get(datacenter_key):
+            failed_message = "datacenter '{}' with datacenter_tenant_id '{}' not found".format(*datacenter_key)
+        elif (datacenter_key, kind) not in pending_calls:
+            failed_message = "No response from VIM to the previous status refresh"
+        else:
+            call, deadline = pending_calls[datacenter_key, kind]
+            try:
+                status_dict.update(call.get_result(max(0, deadline - time())))
+            except vimconn.vimconnException as e:
+                logger.error("VIM exception %s %s", type(e).__name__, str(e))
+                failed_message = str(e)
+        if failed_message is not None:
+            for element in elements:
+                status_dict[element] = {'status': "VIM_ERROR", 'error_msg': failed_message}
+    return status_dict
+
+
+def _refresh_fingerprint(element):
+    '''Hash of a refreshed element, as returned by the VIM connector, that uses the fingerprint of its vim_info
+    instead of dumping it'''
+    content = element.copy()
+    if isinstance(content.get('vim_info'), vimconn.lazy_vim_info):
+        content['vim_info'] = content['vim_info'].fingerprint
+    return json.dumps(content, sort_keys=True, default=str)
+
+
+def _interface_stored(vm, interface):
+    '''True if the addresses of the refreshed interface are the ones of the interface of vm loaded from database'''
+    for vm_interface in vm.get("interfaces", ()):
+        if vm_interface.get("vim_interface_id") == interface.get("vim_interface_id"):
+            return all(vm_interface.get(field) == interface[field] for field in ("mac_address", "ip_address")
+                       if field in interface)
+    return False
+
+
+def _dump_vim_info(element):
+    '''Changes the lazy_vim_info of a refreshed element by its text, to be compared and stored'''
+    if isinstance(element.get('vim_info'), vimconn.lazy_vim_info):
+        element['vim_info'] = str(element['vim_info'])
 
 
 def refresh_instance(mydb, nfvo_tenant, instanceDict, datacenter=None, vim_tenant=None):
@@ -2443,6 +2862,8 @@ def refresh_instance(mydb, nfvo_tenant, instanceDict, datacenter=None, vim_tenan
             else:
                 myvims[datacenter_key] = vims.values()[0]
         for vm in sce_vnf['vms']:
+            if vm['vim_vm_id'] and is_task_id(vm['vim_vm_id']):
+                continue    # still being created, the VIM does not know it yet
             vm_list[datacenter_key].append(vm['vim_vm_id'])
             vms_notupdated.append(vm["uuid"])
 
@@ -2462,33 +2883,37 @@ def refresh_instance(mydb, nfvo_tenant, instanceDict, datacenter=None, vim_tenan
             else:
                 myvims[datacenter_key] = vims.values()[0]
 
+        if net['vim_net_id'] and is_task_id(net['vim_net_id']):
+            continue    # still being created, the VIM does not know it yet
         net_list[datacenter_key].append(net['vim_net_id'])
         nets_notupdated.append(net["uuid"])
 
-    # 1. Getting the status of all VMs
-    vm_dict={}
-    for datacenter_key in myvims:
-        if not vm_list.get(datacenter_key):
+    # 1. Getting the status of all VMs and nets. Each datacenter is asked concurrently for its VMs and its nets
+    pending_calls = {}
+    for datacenter_key, myvim in myvims.items():
+        if not myvim:
             continue
-        failed = True
-        failed_message=""
-        if not myvims[datacenter_key]:
-            failed_message = "datacenter '{}' with datacenter_tenant_id '{}' not found".format(net["datacenter_id"], net["datacenter_tenant_id"])
-        else:
-            try:
-                vm_dict.update(myvims[datacenter_key].refresh_vms_status(vm_list[datacenter_key]) )
-                failed = False
-            except vimconn.vimconnException as e:
-                logger.error("VIM exception %s %s", type(e).__name__, str(e))
-                failed_message = str(e)
-        if failed:
-            for vm in vm_list[datacenter_key]:
-                vm_dict[vm] = {'status': "VIM_ERROR", 'error_msg': failed_message}
+        deadline = time() + get_vim_timeout(myvim)
+        for kind, element_list, refresh_function in (("vms", vm_list, myvim.refresh_vms_status),
+                                                     ("nets", net_list, myvim.refresh_nets_status)):
+            if not element_list.get(datacenter_key):
+                continue
+            with refresh_calls_lock:
+                # a datacenter that has not answered the previous refresh in time is not asked again until it does
+                previous_call = refresh_calls.get((datacenter_key, kind))
+                if previous_call and previous_call.abandoned and not previous_call.done():
+                    continue
+                call = vim_executor.submit_at(datacenter_key[0], refresh_function, element_list[datacenter_key])
+                refresh_calls[datacenter_key, kind] = call
+            pending_calls[datacenter_key, kind] = call, deadline
+    vm_dict = _get_refresh_results(myvims, pending_calls, vm_list, "vms")
 
     # 2. Update the status of VMs in the instanceDict, while collects the VMs whose status changed
     for sce_vnf in instanceDict['vnfs']:
         for vm in sce_vnf['vms']:
             vm_id = vm['vim_vm_id']
+            if vm_id and is_task_id(vm_id):
+                continue
             interfaces = vm_dict[vm_id].pop('interfaces', [])
             #2.0 look if contain manamgement interface, and if not change status from ACTIVE:NoMgmtIP to ACTIVE
             has_mgmt_iface = False
@@ -2499,13 +2924,25 @@ def refresh_instance(mydb, nfvo_tenant, instanceDict, datacenter=None, vim_tenan
                 vm_dict[vm_id]['status'] = "ACTIVE"
             if vm_dict[vm_id].get('error_msg') and len(vm_dict[vm_id]['error_msg']) >= 1024:
                 vm_dict[vm_id]['error_msg'] = vm_dict[vm_id]['error_msg'][:516] + " ... " + vm_dict[vm_id]['error_msg'][-500:]
-            if vm['status'] != vm_dict[vm_id]['status'] or vm.get('error_msg')!=vm_dict[vm_id].get('error_msg') or vm.get('vim_info')!=vm_dict[vm_id].get('vim_info'):
+            # skip the VMs equal to the last refresh stored, without dumping their vim_info
+            fingerprint = _refresh_fingerprint(vm_dict[vm_id])
+            if refresh_fingerprints.get(vm["uuid"]) == fingerprint and vm['status'] == vm_dict[vm_id]['status']:
+                vm_changed = False
+            else:
+                _dump_vim_info(vm_dict[vm_id])
+                vm_changed = vm['status'] != vm_dict[vm_id]['status'] or \
+                    vm.get('error_msg') != vm_dict[vm_id].get('error_msg') or \
+                    vm.get('vim_info') != vm_dict[vm_id].get('vim_info')
+                if not vm_changed:
+                    refresh_fingerprints.set(vm["uuid"], fingerprint)
+            if vm_changed:
                 vm['status']    = vm_dict[vm_id]['status']
                 vm['error_msg'] = vm_dict[vm_id].get('error_msg')
                 vm['vim_info']  = vm_dict[vm_id].get('vim_info')
                 # 2.1. Update in openmano DB the VMs whose status changed
                 try:
                     updates = mydb.update_rows('instance_vms', UPDATE=vm_dict[vm_id], WHERE={'uuid':vm["uuid"]})
+                    refresh_fingerprints.set(vm["uuid"], fingerprint)
                     vms_notupdated.remove(vm["uuid"])
                     if updates>0:
                         vms_updated.append(vm["uuid"])
@@ -2521,45 +2958,47 @@ def refresh_instance(mydb, nfvo_tenant, instanceDict, datacenter=None, vim_tenan
                 if not network_id_list:
                     continue
                 del interface["vim_net_id"]
+                fingerprint_key = (vm["uuid"], interface.get("vim_interface_id"))
+                fingerprint = _refresh_fingerprint(interface)
+                if refresh_fingerprints.get(fingerprint_key) == fingerprint and _interface_stored(vm, interface):
+                    continue
+                _dump_vim_info(interface)
                 try:
                     for network_id in network_id_list:
                         mydb.update_rows('instance_interfaces', UPDATE=interface, WHERE={'instance_vm_id':vm["uuid"], "instance_net_id":network_id})
+                    refresh_fingerprints.set(fingerprint_key, fingerprint)
                 except db_base_Exception as e:
                     logger.error( "nfvo.refresh_instance error with vm=%s, interface_net_id=%s", vm["uuid"], network_id)
 
     # 3. Getting the status of all nets
-    net_dict = {}
-    for datacenter_key in myvims:
-        if not net_list.get(datacenter_key):
-            continue
-        failed = True
-        failed_message = ""
-        if not myvims[datacenter_key]:
-            failed_message = "datacenter '{}' with datacenter_tenant_id '{}' not found".format(net["datacenter_id"], net["datacenter_tenant_id"])
-        else:
-            try:
-                net_dict.update(myvims[datacenter_key].refresh_nets_status(net_list[datacenter_key]) )
-                failed = False
-            except vimconn.vimconnException as e:
-                logger.error("VIM exception %s %s", type(e).__name__, str(e))
-                failed_message = str(e)
-        if failed:
-            for net in net_list[datacenter_key]:
-                net_dict[net] = {'status': "VIM_ERROR", 'error_msg': failed_message}
+    net_dict = _get_refresh_results(myvims, pending_calls, net_list, "nets")
 
     # 4. Update the status of nets in the instanceDict, while collects the nets whose status changed
     # TODO: update nets inside a vnf
     for net in instanceDict['nets']:
         net_id = net['vim_net_id']
+        if net_id and is_task_id(net_id):
+            continue
         if net_dict[net_id].get('error_msg') and len(net_dict[net_id]['error_msg']) >= 1024:
-            net_dict[net_id]['error_msg'] = net_dict[net_id]['error_msg'][:516] + " ... " + net_dict[vm_id]['error_msg'][-500:]
-        if net['status'] != net_dict[net_id]['status'] or net.get('error_msg')!=net_dict[net_id].get('error_msg') or net.get('vim_info')!=net_dict[net_id].get('vim_info'):
+            net_dict[net_id]['error_msg'] = net_dict[net_id]["error_msg"][:516] + " ... " + net_dict[net_id]["error_msg"][-500:]
+        fingerprint = _refresh_fingerprint(net_dict[net_id])
+        if refresh_fingerprints.get(net["uuid"]) == fingerprint and net['status'] == net_dict[net_id]['status']:
+            net_changed = False
+        else:
+            _dump_vim_info(net_dict[net_id])
+            net_changed = net['status'] != net_dict[net_id]['status'] or \
+                net.get('error_msg') != net_dict[net_id].get('error_msg') or \
+                net.get('vim_info') != net_dict[net_id].get('vim_info')
+            if not net_changed:
+                refresh_fingerprints.set(net["uuid"], fingerprint)
+        if net_changed:
             net['status']    = net_dict[net_id]['status']
             net['error_msg'] = net_dict[net_id].get('error_msg')
             net['vim_info']  = net_dict[net_id].get('vim_info')
             # 5.1. Update in openmano DB the nets whose status changed
             try:
                 updated = mydb.update_rows('instance_nets', UPDATE=net_dict[net_id], WHERE={'uuid':net["uuid"]})
+                refresh_fingerprints.set(net["uuid"], fingerprint)
                 nets_notupdated.remove(net["uuid"])
                 if updated>0:
                     nets_updated.append(net["uuid"])
@@ -2578,6 +3017,29 @@ def refresh_instance(mydb, nfvo_tenant, instanceDict, datacenter=None, vim_tenan
     return 0, 'Scenario instance ' + instance_id + ' refreshed.'
 
 
+def get_instance_status(mydb, nfvo_tenant, instance_id, force_refresh=False):
+    '''Obtains an instance with the status of its elements and the time of their last refresh, 'last_refreshed'.
+    The status kept at database by the instance_poller is used, unless force_refresh or there is not poller, that
+    the VIMs are asked now'''
+    refresh_time = None
+    if force_refresh or not instance_poller:
+        instance_dict = mydb.get_instance_scenario(instance_id, nfvo_tenant, verbose=True)
+        refresh_time = time()
+        try:
+            refresh_instance(mydb, nfvo_tenant, instance_dict)
+            if instance_poller:
+                instance_poller.set_refreshed(instance_dict["uuid"], refresh_time)
+        except (NfvoException, db_base_Exception) as e:
+            logger.warn("nfvo.refresh_instance couldn't refresh the status of the instance: %s" % str(e))
+            refresh_time = None
+    instance = mydb.get_instance_scenario(instance_id, nfvo_tenant)
+    if instance_poller:
+        instance["last_refreshed"] = instance_poller.get_last_refreshed(instance)
+    else:
+        instance["last_refreshed"] = refresh_time
+    return instance
+
+
 def instance_action(mydb,nfvo_tenant,instance_id, action_dict):
     #print "Checking that the instance_id exists and getting the instance dictionary"
     instanceDict = mydb.get_instance_scenario(instance_id, nfvo_tenant)
@@ -2740,6 +3202,7 @@ def edit_datacenter(mydb, datacenter_id_name, datacenter_descriptor):
                 raise NfvoException("Bad format at datacenter:config " + str(e), HTTP_Bad_Request)
         datacenter_descriptor["config"]= yaml.safe_dump(config_dict,default_flow_style=True,width=256) if len(config_dict)>0 else None
     mydb.update_rows('datacenters', datacenter_descriptor, where)
+    vim_cache.invalidate(datacenter_id)
     return datacenter_id
 
 
@@ -2747,6 +3210,7 @@ def delete_datacenter(mydb, datacenter):
     #get nfvo_tenant info
     datacenter_dict = mydb.get_table_by_uuid_name('datacenters', datacenter, 'datacenter')
     mydb.delete_row_by_id("datacenters", datacenter_dict['uuid'])
+    vim_cache.invalidate(datacenter_dict['uuid'])
     return datacenter_dict['uuid'] + " " + datacenter_dict['name']
 
 
@@ -2808,12 +3272,18 @@ def associate_datacenter_to_tenant(mydb, nfvo_tenant, datacenter, vim_tenant_id=
     #fill tenants_datacenters table
     tenants_datacenter_dict["datacenter_tenant_id"]=datacenter_tenants_dict["uuid"]
     mydb.new_row('tenants_datacenters', tenants_datacenter_dict)
+    vim_cache.invalidate(datacenter_id)
     # create thread
     datacenter_id, myvim = get_datacenter_by_name_uuid(mydb, tenant_dict['uuid'], datacenter_id)  # reload data
     thread_name = get_non_used_vim_name(datacenter_name, datacenter_id, tenant_dict['name'], tenant_dict['uuid'])
-    new_thread = vim_thread.vim_thread(myvim, task_lock, thread_name, datacenter_name, db=db, db_lock=db_lock)
-    new_thread.start()
     thread_id = datacenter_id + "." + tenant_dict['uuid']
+    new_thread = vim_thread.vim_thread(myvim, task_lock, thread_name, datacenter_name, db=db, db_lock=db_lock,
+                                       workers=global_config.get('vim_thread_workers', 1), journal=task_journal,
+                                       thread_id=thread_id, result_writer=task_writer,
+                                       delete_retries=global_config.get('delete_retries', 3),
+                                       delete_retry_delay=global_config.get('delete_retry_delay', 5),
+                                       poller=instance_poller)
+    new_thread.start()
     vim_threads["running"][thread_id] = new_thread
     return datacenter_id
 
@@ -2839,6 +3309,7 @@ def deassociate_datacenter_to_tenant(mydb, tenant_id, datacenter, vim_tenant_id=
 
     #delete this association
     mydb.delete_row(FROM='tenants_datacenters', WHERE=tenants_datacenter_dict)
+    vim_cache.invalidate(datacenter_id)
 
     #get vim_tenant info and deletes
     warning=''
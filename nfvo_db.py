@@ -32,6 +32,7 @@ import MySQLdb as mdb
 import json
 import yaml
 import time
+import copy
 #import sys, os
 
 tables_with_createdat_field=["datacenters","instance_nets","instance_scenarios","instance_vms","instance_vnfs",
@@ -39,8 +40,9 @@ tables_with_createdat_field=["datacenters","instance_nets","instance_scenarios",
                            "sce_vnfs","tenants_datacenters","datacenter_tenants","vms","vnfs", "datacenter_nets"]
 
 class nfvo_db(db_base.db_base):
-    def __init__(self, host=None, user=None, passwd=None, database=None, log_name='openmano.db', log_level=None):
-        db_base.db_base.__init__(self, host, user, passwd, database, log_name, log_level)
+    def __init__(self, host=None, user=None, passwd=None, database=None, log_name='openmano.db', log_level=None,
+                 pool_size=10):
+        db_base.db_base.__init__(self, host, user, passwd, database, log_name, log_level, pool_size)
         db_base.db_base.tables_with_created_field=tables_with_createdat_field
         return
 
@@ -51,6 +53,8 @@ class nfvo_db(db_base.db_base):
             created_time = time.time()
             try:
                 with self.con:
+                    self.cur = self.con.cursor()
+                    bulk = db_base.db_bulk_insert()
             
                     myVNFDict = {}
                     myVNFDict["name"] = vnf_name
@@ -60,7 +64,7 @@ class nfvo_db(db_base.db_base):
                     myVNFDict["class"] = vnf_descriptor['vnf'].get('class',"MISC")
                     myVNFDict["tenant_id"] = vnf_descriptor['vnf'].get("tenant_id")
                     
-                    vnf_id = self._new_row_internal('vnfs', myVNFDict, add_uuid=True, root_uuid=None, created_time=created_time)
+                    vnf_id = self._new_row_bulk(bulk, 'vnfs', myVNFDict, add_uuid=True, root_uuid=None, created_time=created_time)
                     #print "Adding new vms to the NFVO database"
                     #For each vm, we must create the appropriate vm in the NFVO database.
                     vmDict = {}
@@ -71,7 +75,7 @@ class nfvo_db(db_base.db_base):
                         #print "VM name: %s. Description: %s" % (vm['name'], vm['description'])
                         vm["vnf_id"] = vnf_id
                         created_time += 0.00001
-                        vm_id = self._new_row_internal('vms', vm, add_uuid=True, root_uuid=vnf_id, created_time=created_time) 
+                        vm_id = self._new_row_bulk(bulk, 'vms', vm, add_uuid=True, root_uuid=vnf_id, created_time=created_time) 
                         #print "Internal vm id in NFVO DB: %s" % vm_id
                         vmDict[vm['name']] = vm_id
                 
@@ -128,7 +132,7 @@ class nfvo_db(db_base.db_base):
                             myNetDict["vnf_id"] = vnf_id
                             
                             created_time += 0.00001
-                            net_id = self._new_row_internal('nets', myNetDict, add_uuid=True, root_uuid=vnf_id, created_time=created_time)
+                            net_id = self._new_row_bulk(bulk, 'nets', myNetDict, add_uuid=True, root_uuid=vnf_id, created_time=created_time)
                                 
                             for element in net['elements']:
                                 ifaceItem = {}
@@ -159,7 +163,7 @@ class nfvo_db(db_base.db_base):
                     #print "Adding internal interfaces to the NFVO database (if any)"
                     for iface in internalconnList:
                         #print "Iface name: %s" % iface['internal_name']
-                        iface_id = self._new_row_internal('interfaces', iface, add_uuid=True, root_uuid=vnf_id, created_time = created_time_iface)
+                        iface_id = self._new_row_bulk(bulk, 'interfaces', iface, add_uuid=True, root_uuid=vnf_id, created_time = created_time_iface)
                         #print "Iface id in NFVO DB: %s" % iface_id
                     
                     #print "Adding external interfaces to the NFVO database"
@@ -187,9 +191,10 @@ class nfvo_db(db_base.db_base):
                             myIfaceDict["floating_ip"]  = bridgeiface['floating_ip']
                             created_time_iface = bridgeiface['created_time']
                         #print "Iface name: %s" % iface['name']
-                        iface_id = self._new_row_internal('interfaces', myIfaceDict, add_uuid=True, root_uuid=vnf_id, created_time = created_time_iface)
+                        iface_id = self._new_row_bulk(bulk, 'interfaces', myIfaceDict, add_uuid=True, root_uuid=vnf_id, created_time = created_time_iface)
                         #print "Iface id in NFVO DB: %s" % iface_id
                     
+                    self._insert_bulk(bulk)
                     return vnf_id
                 
             except (mdb.Error, AttributeError) as e:
@@ -203,6 +208,8 @@ class nfvo_db(db_base.db_base):
             created_time = time.time()
             try:
                 with self.con:
+                    self.cur = self.con.cursor()
+                    bulk = db_base.db_bulk_insert()
                      
                     myVNFDict = {}
                     myVNFDict["name"] = vnf_name
@@ -212,7 +219,7 @@ class nfvo_db(db_base.db_base):
                     myVNFDict["class"] = vnf_descriptor['vnf'].get('class',"MISC")
                     myVNFDict["tenant_id"] = vnf_descriptor['vnf'].get("tenant_id")
                     
-                    vnf_id = self._new_row_internal('vnfs', myVNFDict, add_uuid=True, root_uuid=None, created_time=created_time)
+                    vnf_id = self._new_row_bulk(bulk, 'vnfs', myVNFDict, add_uuid=True, root_uuid=None, created_time=created_time)
                     #print "Adding new vms to the NFVO database"
                     #For each vm, we must create the appropriate vm in the NFVO database.
                     vmDict = {}
@@ -223,7 +230,7 @@ class nfvo_db(db_base.db_base):
                         #print "VM name: %s. Description: %s" % (vm['name'], vm['description'])
                         vm["vnf_id"] = vnf_id
                         created_time += 0.00001
-                        vm_id = self._new_row_internal('vms', vm, add_uuid=True, root_uuid=vnf_id, created_time=created_time) 
+                        vm_id = self._new_row_bulk(bulk, 'vms', vm, add_uuid=True, root_uuid=vnf_id, created_time=created_time) 
                         #print "Internal vm id in NFVO DB: %s" % vm_id
                         vmDict[vm['name']] = vm_id
                      
@@ -287,7 +294,7 @@ class nfvo_db(db_base.db_base):
                             myNetDict["vnf_id"] = vnf_id
                             
                             created_time += 0.00001
-                            net_id = self._new_row_internal('nets', myNetDict, add_uuid=True, root_uuid=vnf_id, created_time=created_time)
+                            net_id = self._new_row_bulk(bulk, 'nets', myNetDict, add_uuid=True, root_uuid=vnf_id, created_time=created_time)
                             
                             if "ip-profile" in net:
                                 ip_profile = net["ip-profile"]
@@ -303,7 +310,7 @@ class nfvo_db(db_base.db_base):
                                     myIPProfileDict["dhcp_count"] = ip_profile["dhcp"].get('count',None)
                                 
                                 created_time += 0.00001
-                                ip_profile_id = self._new_row_internal('ip_profiles', myIPProfileDict)
+                                ip_profile_id = self._new_row_bulk(bulk, 'ip_profiles', myIPProfileDict)
                                 
                             for element in net['elements']:
                                 ifaceItem = {}
@@ -329,7 +336,7 @@ class nfvo_db(db_base.db_base):
                                     ifaceItem["floating_ip"] = ifaceDict['floating_ip']
                                 created_time_iface = ifaceDict["created_time"]
                                 #print "Iface name: %s" % iface['internal_name']
-                                iface_id = self._new_row_internal('interfaces', ifaceItem, add_uuid=True, root_uuid=vnf_id, created_time=created_time_iface)
+                                iface_id = self._new_row_bulk(bulk, 'interfaces', ifaceItem, add_uuid=True, root_uuid=vnf_id, created_time=created_time_iface)
                                 #print "Iface id in NFVO DB: %s" % iface_id
                     
                     #print "Adding external interfaces to the NFVO database"
@@ -357,9 +364,10 @@ class nfvo_db(db_base.db_base):
                                 bridgeInterfacesDict[iface['VNFC']][iface['local_iface_name']]['floating_ip']
                             created_time_iface = bridgeInterfacesDict[iface['VNFC']][iface['local_iface_name']]['created_time']
                         #print "Iface name: %s" % iface['name']
-                        iface_id = self._new_row_internal('interfaces', myIfaceDict, add_uuid=True, root_uuid=vnf_id, created_time=created_time_iface)
+                        iface_id = self._new_row_bulk(bulk, 'interfaces', myIfaceDict, add_uuid=True, root_uuid=vnf_id, created_time=created_time_iface)
                         #print "Iface id in NFVO DB: %s" % iface_id
                     
+                    self._insert_bulk(bulk)
                     return vnf_id
                 
             except (mdb.Error, AttributeError) as e:
@@ -378,6 +386,7 @@ class nfvo_db(db_base.db_base):
             try:
                 with self.con:
                     self.cur = self.con.cursor()
+                    bulk = db_base.db_bulk_insert()
                     tenant_id = scenario_dict.get('tenant_id')
                     #scenario
                     INSERT_={'tenant_id': tenant_id,
@@ -385,7 +394,7 @@ class nfvo_db(db_base.db_base):
                              'description': scenario_dict['description'],
                              'public': scenario_dict.get('public', "false")}
                     
-                    scenario_uuid =  self._new_row_internal('scenarios', INSERT_, add_uuid=True, root_uuid=None, created_time=created_time)
+                    scenario_uuid =  self._new_row_bulk(bulk, 'scenarios', INSERT_, add_uuid=True, root_uuid=None, created_time=created_time)
                     #sce_nets
                     for net in scenario_dict['nets'].values():
                         net_dict={'scenario_id': scenario_uuid}
@@ -398,7 +407,7 @@ class nfvo_db(db_base.db_base):
                             #TODO, must be json because of the GUI, change to yaml
                             net_dict["graph"]=json.dumps(net["graph"])
                         created_time += 0.00001
-                        net_uuid =  self._new_row_internal('sce_nets', net_dict, add_uuid=True, root_uuid=scenario_uuid, created_time=created_time)
+                        net_uuid =  self._new_row_bulk(bulk, 'sce_nets', net_dict, add_uuid=True, root_uuid=scenario_uuid, created_time=created_time)
                         net['uuid']=net_uuid
 
                         if net.get("ip-profile"):
@@ -413,7 +422,7 @@ class nfvo_db(db_base.db_base):
                                 myIPProfileDict["dhcp_enabled"] = ip_profile["dhcp"].get('enabled', "true")
                                 myIPProfileDict["dhcp_start_address"] = ip_profile["dhcp"].get('start-address')
                                 myIPProfileDict["dhcp_count"] = ip_profile["dhcp"].get('count')
-                            self._new_row_internal('ip_profiles', myIPProfileDict)
+                            self._new_row_bulk(bulk, 'ip_profiles', myIPProfileDict)
 
                     # sce_vnfs
                     for k, vnf in scenario_dict['vnfs'].items():
@@ -427,7 +436,7 @@ class nfvo_db(db_base.db_base):
                             # TODO, must be json because of the GUI, change to yaml
                             INSERT_["graph"] = json.dumps(vnf["graph"])
                         created_time += 0.00001
-                        scn_vnf_uuid = self._new_row_internal('sce_vnfs', INSERT_, add_uuid=True,
+                        scn_vnf_uuid = self._new_row_bulk(bulk, 'sce_vnfs', INSERT_, add_uuid=True,
                                                               root_uuid=scenario_uuid, created_time=created_time)
                         vnf['scn_vnf_uuid']=scn_vnf_uuid
                         # sce_interfaces
@@ -441,9 +450,10 @@ class nfvo_db(db_base.db_base):
                                      'interface_id':  iface['uuid'],
                                      'ip_address': iface.get('ip_address')}
                             created_time += 0.00001
-                            iface_uuid = self._new_row_internal('sce_interfaces', INSERT_, add_uuid=True,
+                            iface_uuid = self._new_row_bulk(bulk, 'sce_interfaces', INSERT_, add_uuid=True,
                                                                  root_uuid=scenario_uuid, created_time=created_time)
                             
+                    self._insert_bulk(bulk)
                     return scenario_uuid
                     
             except (mdb.Error, AttributeError) as e:
@@ -552,6 +562,23 @@ class nfvo_db(db_base.db_base):
 #             print "nfvo_db.get_instance_scenario DB Exception %d: %s" % (e.args[0], e.args[1])
 #             return self._format_error(e)
 
+    def _get_rows_grouped(self, cmd, key, values, params=()):
+        '''Obtain with one query the rows related to several elements, and group them by element.
+        cmd is a SELECT with a '{}' in place of the IN list, where 'key' is selected and matched with 'values'.
+        params are the parameters of the statement placed before the IN list.
+        Returns a dictionary with a tuple of rows for each value of 'key', keeping the order of the query, as
+        fetchall does. The 'key' field is removed from the rows. It DOES NOT begin or end the transaction, so self.cur must be created
+        '''
+        grouped = {}
+        if not values:
+            return grouped
+        self._execute(cmd.format(",".join(("%s",) * len(values))), tuple(params) + tuple(values))
+        for row in self.cur.fetchall():
+            grouped.setdefault(row.pop(key), []).append(row)
+        for value, rows in grouped.iteritems():
+            grouped[value] = tuple(rows)
+        return grouped
+
     def get_scenario(self, scenario_id, tenant_id=None, datacenter_id=None):
         '''Obtain the scenario information, filtering by one or serveral of the tenant, uuid or name
         scenario_id is the uuid or the name if it is not a valid uuid format
@@ -564,11 +591,13 @@ class nfvo_db(db_base.db_base):
                 with self.con:
                     self.cur = self.con.cursor(mdb.cursors.DictCursor)
                     where_text = "uuid='{}'".format(scenario_id)
+                    where_ = "uuid=%s"
+                    params = [scenario_id]
                     if not tenant_id and tenant_id != "any":
                         where_text += " AND (tenant_id='{}' OR public='True')".format(tenant_id)
-                    cmd = "SELECT * FROM scenarios WHERE " + where_text
-                    self.logger.debug(cmd)
-                    self.cur.execute(cmd)
+                        where_ += " AND (tenant_id=%s OR public='True')"
+                        params.append(tenant_id)
+                    self._execute("SELECT * FROM scenarios WHERE " + where_, params)
                     rows = self.cur.fetchall()
                     if self.cur.rowcount==0:
                         raise db_base.db_base_Exception("No scenario found with this criteria " + where_text, db_base.HTTP_Bad_Request)
@@ -579,103 +608,100 @@ class nfvo_db(db_base.db_base):
                         scenario_dict["cloud-config"] = yaml.load(scenario_dict["cloud_config"])
                     del scenario_dict["cloud_config"]
                     #sce_vnfs
-                    cmd = "SELECT uuid,name,vnf_id,description FROM sce_vnfs WHERE scenario_id='{}' ORDER BY created_at".format(scenario_dict['uuid'])
-                    self.logger.debug(cmd)
-                    self.cur.execute(cmd)
+                    self._execute("SELECT uuid,name,vnf_id,description FROM sce_vnfs WHERE scenario_id=%s "
+                                  "ORDER BY created_at", (scenario_dict['uuid'],))
                     scenario_dict['vnfs'] = self.cur.fetchall()
+                    vnf_ids = list(set(vnf['vnf_id'] for vnf in scenario_dict['vnfs']))
+                    #sce_interfaces of all the sce_vnfs
+                    sce_interfaces = self._get_rows_grouped(
+                        "SELECT scei.sce_vnf_id as sce_vnf_id,scei.uuid,scei.sce_net_id,scei.interface_id,"
+                        "i.external_name,scei.ip_address FROM sce_interfaces as scei join interfaces as i "
+                        "on scei.interface_id=i.uuid WHERE scei.sce_vnf_id IN ({}) ORDER BY scei.created_at",
+                        "sce_vnf_id", [vnf['uuid'] for vnf in scenario_dict['vnfs']])
+                    #vms of all the vnfs
+                    vnf_vms = self._get_rows_grouped(
+                        "SELECT vnf_id, uuid, flavor_id, image_id, name, description, boot_data FROM vms "
+                        "WHERE vnf_id IN ({}) ORDER BY created_at", "vnf_id", vnf_ids)
+                    vms = [vm for vnf_id in vnf_ids for vm in vnf_vms.get(vnf_id, ())]
+                    for vm in vms:
+                        if vm["boot_data"]:
+                            vm["boot_data"] = yaml.safe_load(vm["boot_data"])
+                        else:
+                            del vm["boot_data"]
+                    if datacenter_id!=None:
+                        #the vim id is only provided when there is exactly one entry for the datacenter
+                        vim_images = self._get_rows_grouped(
+                            "SELECT image_id,vim_id FROM datacenters_images WHERE datacenter_id=%s AND image_id IN ({})",
+                            "image_id", list(set(vm['image_id'] for vm in vms)), (datacenter_id,))
+                        vim_flavors = self._get_rows_grouped(
+                            "SELECT flavor_id,vim_id FROM datacenters_flavors WHERE datacenter_id=%s AND flavor_id IN ({})",
+                            "flavor_id", list(set(vm['flavor_id'] for vm in vms)), (datacenter_id,))
+                        for vm in vms:
+                            if len(vim_images.get(vm['image_id'], ())) == 1:
+                                vm['vim_image_id'] = vim_images[vm['image_id']][0]['vim_id']
+                            if len(vim_flavors.get(vm['flavor_id'], ())) == 1:
+                                vm['vim_flavor_id'] = vim_flavors[vm['flavor_id']][0]['vim_id']
+                    #interfaces of all the vms
+                    vm_interfaces = self._get_rows_grouped(
+                        "SELECT vm_id,uuid,internal_name,external_name,net_id,type,vpci,mac,bw,model,ip_address,"
+                        "floating_ip, port_security FROM interfaces WHERE vm_id IN ({}) ORDER BY created_at",
+                        "vm_id", [vm['uuid'] for vm in vms])
+                    for vm in vms:
+                        vm['interfaces'] = vm_interfaces.get(vm['uuid'], ())
+                        for interface in vm['interfaces']:
+                            interface['port-security'] = interface.pop("port_security")
+                            interface['floating-ip'] = interface.pop("floating_ip")
+                    #nets of all the vnfs, and their ip_profiles
+                    vnf_nets = self._get_rows_grouped("SELECT vnf_id,uuid,name,type,description FROM nets "
+                                                      "WHERE vnf_id IN ({})", "vnf_id", vnf_ids)
+                    nets = [net for vnf_id in vnf_ids for net in vnf_nets.get(vnf_id, ())]
+                    SELECT_ = "ip_version,subnet_address,gateway_address,dns_address,dhcp_enabled,dhcp_start_address,dhcp_count"
+                    ip_profiles = self._get_rows_grouped("SELECT net_id," + SELECT_ + " FROM ip_profiles WHERE net_id IN ({})",
+                                                         "net_id", [net['uuid'] for net in nets])
+                    for vnf_net in nets:
+                        ipprofiles = ip_profiles.get(vnf_net['uuid'], ())
+                        if len(ipprofiles)==1:
+                            vnf_net["ip_profile"] = ipprofiles[0]
+                        elif len(ipprofiles)>1:
+                            raise db_base.db_base_Exception("More than one ip-profile found with this criteria: net_id='{}'".format(vnf_net['uuid']), db_base.HTTP_Bad_Request)
+                    #several sce_vnfs can use the same vnf, each one receives its own copy
+                    used_vnf_ids = set()
                     for vnf in scenario_dict['vnfs']:
-                        #sce_interfaces
-                        cmd = "SELECT scei.uuid,scei.sce_net_id,scei.interface_id,i.external_name,scei.ip_address FROM sce_interfaces as scei join interfaces as i on scei.interface_id=i.uuid WHERE scei.sce_vnf_id='{}' ORDER BY scei.created_at".format(vnf['uuid'])
-                        self.logger.debug(cmd)
-                        self.cur.execute(cmd)
-                        vnf['interfaces'] = self.cur.fetchall()
-                        #vms
-                        cmd = "SELECT vms.uuid as uuid, flavor_id, image_id, vms.name as name, vms.description as description, vms.boot_data as boot_data " \
-                                " FROM vnfs join vms on vnfs.uuid=vms.vnf_id " \
-                                " WHERE vnfs.uuid='" + vnf['vnf_id'] +"'"  \
-                                " ORDER BY vms.created_at"
-                        self.logger.debug(cmd)
-                        self.cur.execute(cmd)
-                        vnf['vms'] = self.cur.fetchall()
-                        for vm in vnf['vms']:
-                            if vm["boot_data"]:
-                                vm["boot_data"] = yaml.safe_load(vm["boot_data"])
-                            else:
-                                del vm["boot_data"]
-                            if datacenter_id!=None:
-                                cmd = "SELECT vim_id FROM datacenters_images WHERE image_id='{}' AND datacenter_id='{}'".format(vm['image_id'],datacenter_id)
-                                self.logger.debug(cmd)
-                                self.cur.execute(cmd) 
-                                if self.cur.rowcount==1:
-                                    vim_image_dict = self.cur.fetchone()
-                                    vm['vim_image_id']=vim_image_dict['vim_id']
-                                cmd = "SELECT vim_id FROM datacenters_flavors WHERE flavor_id='{}' AND datacenter_id='{}'".format(vm['flavor_id'],datacenter_id)
-                                self.logger.debug(cmd)
-                                self.cur.execute(cmd) 
-                                if self.cur.rowcount==1:
-                                    vim_flavor_dict = self.cur.fetchone()
-                                    vm['vim_flavor_id']=vim_flavor_dict['vim_id']
-                                
-                            #interfaces
-                            cmd = "SELECT uuid,internal_name,external_name,net_id,type,vpci,mac,bw,model,ip_address," \
-                                  "floating_ip, port_security" \
-                                    " FROM interfaces" \
-                                    " WHERE vm_id='{}'" \
-                                    " ORDER BY created_at".format(vm['uuid'])
-                            self.logger.debug(cmd)
-                            self.cur.execute(cmd)
-                            vm['interfaces'] = self.cur.fetchall()
-                            for index in range(0,len(vm['interfaces'])):
-                                vm['interfaces'][index]['port-security'] = vm['interfaces'][index].pop("port_security")
-                                vm['interfaces'][index]['floating-ip'] = vm['interfaces'][index].pop("floating_ip")
-                        #nets    every net of a vms
-                        cmd = "SELECT uuid,name,type,description FROM nets WHERE vnf_id='{}'".format(vnf['vnf_id'])  
-                        self.logger.debug(cmd)
-                        self.cur.execute(cmd)
-                        vnf['nets'] = self.cur.fetchall()
-                        for vnf_net in vnf['nets']:
-                            SELECT_ = "ip_version,subnet_address,gateway_address,dns_address,dhcp_enabled,dhcp_start_address,dhcp_count"
-                            cmd = "SELECT {} FROM ip_profiles WHERE net_id='{}'".format(SELECT_,vnf_net['uuid'])  
-                            self.logger.debug(cmd)
-                            self.cur.execute(cmd)
-                            ipprofiles = self.cur.fetchall()
-                            if self.cur.rowcount==1:
-                                vnf_net["ip_profile"] = ipprofiles[0]
-                            elif self.cur.rowcount>1:
-                                raise db_base.db_base_Exception("More than one ip-profile found with this criteria: net_id='{}'".format(vnf_net['uuid']), db_base.HTTP_Bad_Request)
-                            
+                        vnf['interfaces'] = sce_interfaces.get(vnf['uuid'], ())
+                        vnf['vms'] = vnf_vms.get(vnf['vnf_id'], ())
+                        vnf['nets'] = vnf_nets.get(vnf['vnf_id'], ())
+                        if vnf['vnf_id'] in used_vnf_ids:
+                            vnf['vms'] = copy.deepcopy(vnf['vms'])
+                            vnf['nets'] = copy.deepcopy(vnf['nets'])
+                        used_vnf_ids.add(vnf['vnf_id'])
+
                     #sce_nets
-                    cmd = "SELECT uuid,name,type,external,description" \
-                          " FROM sce_nets  WHERE scenario_id='{}'" \
-                          " ORDER BY created_at ".format(scenario_dict['uuid'])
-                    self.logger.debug(cmd)
-                    self.cur.execute(cmd)
+                    self._execute("SELECT uuid,name,type,external,description FROM sce_nets WHERE scenario_id=%s "
+                                  "ORDER BY created_at", (scenario_dict['uuid'],))
                     scenario_dict['nets'] = self.cur.fetchall()
+                    internal_nets = [net for net in scenario_dict['nets'] if str(net['external']) == 'false']
+                    external_nets = [net for net in scenario_dict['nets'] if str(net['external']) != 'false']
+                    ip_profiles = self._get_rows_grouped("SELECT sce_net_id," + SELECT_ + " FROM ip_profiles WHERE sce_net_id IN ({})",
+                                                         "sce_net_id", [net['uuid'] for net in internal_nets])
+                    for net in internal_nets:
+                        ipprofiles = ip_profiles.get(net['uuid'], ())
+                        if len(ipprofiles)==1:
+                            net["ip_profile"] = ipprofiles[0]
+                        elif len(ipprofiles)>1:
+                            raise db_base.db_base_Exception("More than one ip-profile found with this criteria: sce_net_id='{}'".format(net['uuid']), db_base.HTTP_Bad_Request)
                     #datacenter_nets
-                    for net in scenario_dict['nets']:
-                        if str(net['external']) == 'false':
-                            SELECT_ = "ip_version,subnet_address,gateway_address,dns_address,dhcp_enabled,dhcp_start_address,dhcp_count"
-                            cmd = "SELECT {} FROM ip_profiles WHERE sce_net_id='{}'".format(SELECT_,net['uuid'])  
-                            self.logger.debug(cmd)
-                            self.cur.execute(cmd)
-                            ipprofiles = self.cur.fetchall()
-                            if self.cur.rowcount==1:
-                                net["ip_profile"] = ipprofiles[0]
-                            elif self.cur.rowcount>1:
-                                raise db_base.db_base_Exception("More than one ip-profile found with this criteria: sce_net_id='{}'".format(net['uuid']), db_base.HTTP_Bad_Request)
-                            continue
-                        WHERE_=" WHERE name='{}'".format(net['name'])
-                        if datacenter_id!=None:
-                            WHERE_ += " AND datacenter_id='{}'".format(datacenter_id)
-                        cmd = "SELECT vim_net_id FROM datacenter_nets" + WHERE_
-                        self.logger.debug(cmd)
-                        self.cur.execute(cmd) 
-                        d_net = self.cur.fetchone()
-                        if d_net==None or datacenter_id==None:
+                    d_nets = {}
+                    if datacenter_id!=None:
+                        d_nets = self._get_rows_grouped("SELECT name,vim_net_id FROM datacenter_nets "
+                                                        "WHERE datacenter_id=%s AND name IN ({})", "name",
+                                                        list(set(net['name'] for net in external_nets)), (datacenter_id,))
+                    for net in external_nets:
+                        d_net = d_nets.get(net['name'])
+                        if not d_net:
                             #print "nfvo_db.get_scenario() WARNING external net %s not found"  % net['name']
                             net['vim_id']=None
                         else:
-                            net['vim_id']=d_net['vim_net_id']
+                            net['vim_id']=d_net[0]['vim_net_id']
                     
                     db_base._convert_datetime2str(scenario_dict)
                     db_base._convert_str2boolean(scenario_dict, ('public','shared','external','port-security','floating-ip') )
@@ -727,6 +753,7 @@ class nfvo_db(db_base.db_base):
             try:
                 with self.con:
                     self.cur = self.con.cursor()
+                    bulk = db_base.db_bulk_insert()
                     #instance_scenarios
                     datacenter_id = scenarioDict['datacenter_id']
                     INSERT_={'tenant_id': tenant_id,
@@ -739,7 +766,7 @@ class nfvo_db(db_base.db_base):
                     if scenarioDict.get("cloud-config"):
                         INSERT_["cloud_config"] = yaml.safe_dump(scenarioDict["cloud-config"], default_flow_style=True, width=256)
 
-                    instance_uuid = self._new_row_internal('instance_scenarios', INSERT_, add_uuid=True, root_uuid=None, created_time=created_time)
+                    instance_uuid = self._new_row_bulk(bulk, 'instance_scenarios', INSERT_, add_uuid=True, root_uuid=None, created_time=created_time)
                     
                     net_scene2instance={}
                     #instance_nets   #nets interVNF
@@ -758,7 +785,7 @@ class nfvo_db(db_base.db_base):
                             if sce_net_id:
                                 INSERT_['sce_net_id'] = sce_net_id
                             created_time += 0.00001
-                            instance_net_uuid =  self._new_row_internal('instance_nets', INSERT_, True, instance_uuid, created_time)
+                            instance_net_uuid =  self._new_row_bulk(bulk, 'instance_nets', INSERT_, True, instance_uuid, created_time)
                             net_scene2instance[ sce_net_id ][datacenter_site_id] = instance_net_uuid
                             net['uuid'] = instance_net_uuid  #overwrite scnario uuid by instance uuid
                         
@@ -767,7 +794,7 @@ class nfvo_db(db_base.db_base):
                             net['ip_profile']['sce_net_id'] = None
                             net['ip_profile']['instance_net_id'] = instance_net_uuid
                             created_time += 0.00001
-                            ip_profile_id = self._new_row_internal('ip_profiles', net['ip_profile'])
+                            ip_profile_id = self._new_row_bulk(bulk, 'ip_profiles', net['ip_profile'])
                     
                     #instance_vnfs
                     for vnf in scenarioDict['vnfs']:
@@ -778,7 +805,7 @@ class nfvo_db(db_base.db_base):
                         if vnf.get("uuid"):
                             INSERT_['sce_vnf_id'] = vnf['uuid']
                         created_time += 0.00001
-                        instance_vnf_uuid =  self._new_row_internal('instance_vnfs', INSERT_, True, instance_uuid, created_time)
+                        instance_vnf_uuid =  self._new_row_bulk(bulk, 'instance_vnfs', INSERT_, True, instance_uuid, created_time)
                         vnf['uuid'] = instance_vnf_uuid  #overwrite scnario uuid by instance uuid
                         
                         #instance_nets   #nets intraVNF
@@ -790,7 +817,7 @@ class nfvo_db(db_base.db_base):
                             if net.get("uuid"):
                                 INSERT_['net_id'] = net['uuid']
                             created_time += 0.00001
-                            instance_net_uuid =  self._new_row_internal('instance_nets', INSERT_, True, instance_uuid, created_time)
+                            instance_net_uuid =  self._new_row_bulk(bulk, 'instance_nets', INSERT_, True, instance_uuid, created_time)
                             net_scene2instance[ net['uuid'] ][datacenter_site_id] = instance_net_uuid
                             net['uuid'] = instance_net_uuid  #overwrite scnario uuid by instance uuid
                             
@@ -799,13 +826,13 @@ class nfvo_db(db_base.db_base):
                                 net['ip_profile']['sce_net_id'] = None
                                 net['ip_profile']['instance_net_id'] = instance_net_uuid
                                 created_time += 0.00001
-                                ip_profile_id = self._new_row_internal('ip_profiles', net['ip_profile'])
+                                ip_profile_id = self._new_row_bulk(bulk, 'ip_profiles', net['ip_profile'])
 
                         #instance_vms
                         for vm in vnf['vms']:
                             INSERT_={'instance_vnf_id': instance_vnf_uuid,  'vm_id': vm['uuid'], 'vim_vm_id': vm['vim_id']  }
                             created_time += 0.00001
-                            instance_vm_uuid =  self._new_row_internal('instance_vms', INSERT_, True, instance_uuid, created_time)
+                            instance_vm_uuid =  self._new_row_bulk(bulk, 'instance_vms', INSERT_, True, instance_uuid, created_time)
                             vm['uuid'] = instance_vm_uuid  #overwrite scnario uuid by instance uuid
                             
                             #instance_interfaces
@@ -827,13 +854,99 @@ class nfvo_db(db_base.db_base):
                                     'ip_address': interface.get('ip_address'), 'floating_ip': int(interface.get('floating-ip',False)),
                                     'port_security': int(interface.get('port-security',True))}
                                 #created_time += 0.00001
-                                interface_uuid =  self._new_row_internal('instance_interfaces', INSERT_, True, instance_uuid) #, created_time)
+                                interface_uuid =  self._new_row_bulk(bulk, 'instance_interfaces', INSERT_, True, instance_uuid) #, created_time)
                                 interface['uuid'] = interface_uuid  #overwrite scnario uuid by instance uuid
+                    self._insert_bulk(bulk)
                 return instance_uuid
             except (mdb.Error, AttributeError) as e:
                 self._format_error(e, tries)
             tries -= 1
 
+    instance_select = "SELECT inst.uuid as uuid,inst.name as name,inst.scenario_id as scenario_id, datacenter_id" +\
+                      " ,datacenter_tenant_id, s.name as scenario_name,inst.tenant_id as tenant_id" + \
+                      " ,inst.description as description,inst.created_at as created_at" +\
+                      " ,inst.cloud_config as 'cloud_config'" +\
+                      " FROM instance_scenarios as inst join scenarios as s on inst.scenario_id=s.uuid"
+
+    def _get_instances_content(self, instance_dicts, verbose=False, datacenter_ids=None):
+        '''Fill the vnfs, vms, interfaces and nets of several instances with a fixed number of queries, whatever
+        the number and size of the instances. 'instance_dicts' are rows of the instance_select query.
+        If datacenter_ids is provided, only the vnfs and nets at these datacenters are loaded.
+        It DOES NOT begin or end the transaction, so self.cur must be created
+        '''
+        for instance_dict in instance_dicts:
+            if instance_dict["cloud_config"]:
+                instance_dict["cloud-config"] = yaml.load(instance_dict["cloud_config"])
+            del instance_dict["cloud_config"]
+        instance_ids = [instance_dict['uuid'] for instance_dict in instance_dicts]
+        datacenter_where = ""
+        datacenter_params = ()
+        if datacenter_ids is not None:
+            datacenter_where = "datacenter_id IN (" + ",".join(("%s",) * len(datacenter_ids)) + ") AND "
+            datacenter_params = tuple(datacenter_ids)
+
+        #instance_vnfs
+        instance_vnfs = self._get_rows_grouped(
+            "SELECT iv.instance_scenario_id as instance_scenario_id,iv.uuid as uuid,sv.vnf_id as vnf_id,"
+            "sv.name as vnf_name, sce_vnf_id, datacenter_id, datacenter_tenant_id"
+            " FROM instance_vnfs as iv join sce_vnfs as sv on iv.sce_vnf_id=sv.uuid"
+            " WHERE " + datacenter_where.replace("datacenter_id", "iv.datacenter_id") +
+            "iv.instance_scenario_id IN ({}) ORDER BY iv.created_at", "instance_scenario_id", instance_ids,
+            datacenter_params)
+        vnfs = [vnf for instance_id in instance_ids for vnf in instance_vnfs.get(instance_id, ())]
+        #instance vms
+        vnf_vms = self._get_rows_grouped(
+            "SELECT instance_vnf_id, iv.uuid as uuid, vim_vm_id, status, error_msg, vim_info, iv.created_at as created_at,"
+            " name FROM instance_vms as iv join vms on iv.vm_id=vms.uuid"
+            " WHERE instance_vnf_id IN ({}) ORDER BY iv.created_at", "instance_vnf_id", [vnf['uuid'] for vnf in vnfs])
+        vms = [vm for vnf in vnfs for vm in vnf_vms.get(vnf['uuid'], ())]
+        #instance_interfaces
+        vm_interfaces = self._get_rows_grouped(
+            "SELECT instance_vm_id, vim_interface_id, instance_net_id, internal_name,external_name, mac_address,"
+            " ii.ip_address as ip_address, vim_info, i.type as type"
+            " FROM instance_interfaces as ii join interfaces as i on ii.interface_id=i.uuid"
+            " WHERE instance_vm_id IN ({}) ORDER BY created_at", "instance_vm_id", [vm['uuid'] for vm in vms])
+        for vnf in vnfs:
+            vnf_manage_iface_list=[]
+            vnf['vms'] = vnf_vms.get(vnf['uuid'], ())
+            for vm in vnf['vms']:
+                vm_manage_iface_list=[]
+                vm['interfaces'] = vm_interfaces.get(vm['uuid'], ())
+                for iface in vm['interfaces']:
+                    if iface["type"] == "mgmt" and iface["ip_address"]:
+                        vnf_manage_iface_list.append(iface["ip_address"])
+                        vm_manage_iface_list.append(iface["ip_address"])
+                    if not verbose:
+                        del iface["type"]
+                if vm_manage_iface_list: vm["ip_address"] = ",".join(vm_manage_iface_list)
+            if vnf_manage_iface_list: vnf["ip_address"] = ",".join(vnf_manage_iface_list)
+
+        #instance_nets
+        instance_nets = self._get_rows_grouped(
+            "SELECT instance_scenario_id,uuid,vim_net_id,status,error_msg,vim_info,created, sce_net_id,"
+            " net_id as vnf_net_id, datacenter_id, datacenter_tenant_id"
+            " FROM instance_nets WHERE " + datacenter_where + "instance_scenario_id IN ({}) ORDER BY created_at",
+            "instance_scenario_id", instance_ids, datacenter_params)
+        for instance_dict in instance_dicts:
+            instance_dict['vnfs'] = instance_vnfs.get(instance_dict['uuid'], ())
+            instance_dict['nets'] = instance_nets.get(instance_dict['uuid'], ())
+            db_base._convert_datetime2str(instance_dict)
+            db_base._convert_str2boolean(instance_dict, ('public','shared','created') )
+
+    @staticmethod
+    def _instance_where(instance_id, tenant_id=None, prefix=""):
+        '''Compose the parameterized WHERE that selects an instance by uuid, or by name if instance_id is not a valid
+        uuid, and by tenant if provided. 'prefix' is the table alias of the columns, e.g. 'inst.'
+        Returns the WHERE text with %s placeholders, the list of parameters, and the text with the values, to be
+        used at error messages
+        '''
+        conditions = []
+        if tenant_id is not None:
+            conditions.append((prefix + "tenant_id", tenant_id))
+        conditions.append((prefix + ("uuid" if db_base._check_valid_uuid(instance_id) else "name"), instance_id))
+        return (" AND ".join(column + "=%s" for column, _ in conditions), [value for _, value in conditions],
+                " AND ".join("{}='{}'".format(column, value) for column, value in conditions))
+
     def get_instance_scenario(self, instance_id, tenant_id=None, verbose=False):
         '''Obtain the instance information, filtering by one or several of the tenant, uuid or name
         instance_id is the uuid or the name if it is not a valid uuid format
@@ -845,83 +958,70 @@ class nfvo_db(db_base.db_base):
                 with self.con:
                     self.cur = self.con.cursor(mdb.cursors.DictCursor)
                     #instance table
-                    where_list=[]
-                    if tenant_id is not None: where_list.append( "inst.tenant_id='" + tenant_id +"'" )
-                    if db_base._check_valid_uuid(instance_id):
-                        where_list.append( "inst.uuid='" + instance_id +"'" )
-                    else:
-                        where_list.append( "inst.name='" + instance_id +"'" )
-                    where_text = " AND ".join(where_list)
-                    cmd = "SELECT inst.uuid as uuid,inst.name as name,inst.scenario_id as scenario_id, datacenter_id" +\
-                                " ,datacenter_tenant_id, s.name as scenario_name,inst.tenant_id as tenant_id" + \
-                                " ,inst.description as description,inst.created_at as created_at" +\
-                                " ,inst.cloud_config as 'cloud_config'" +\
-                            " FROM instance_scenarios as inst join scenarios as s on inst.scenario_id=s.uuid"+\
-                            " WHERE " + where_text
-                    self.logger.debug(cmd)
-                    self.cur.execute(cmd)
+                    where_, params, where_text = self._instance_where(instance_id, tenant_id, "inst.")
+                    self._execute(self.instance_select.replace("%", "%%") + " WHERE " + where_, params)
                     rows = self.cur.fetchall()
                     
                     if self.cur.rowcount==0:
                         raise db_base.db_base_Exception("No instance found where " + where_text, db_base.HTTP_Not_Found)
                     elif self.cur.rowcount>1:
                         raise db_base.db_base_Exception("More than one instance found where " + where_text, db_base.HTTP_Bad_Request)
-                    instance_dict = rows[0]
-                    if instance_dict["cloud_config"]:
-                        instance_dict["cloud-config"] = yaml.load(instance_dict["cloud_config"])
-                    del instance_dict["cloud_config"]
-                    
-                    #instance_vnfs
-                    cmd = "SELECT iv.uuid as uuid,sv.vnf_id as vnf_id,sv.name as vnf_name, sce_vnf_id, datacenter_id, datacenter_tenant_id"\
-                            " FROM instance_vnfs as iv join sce_vnfs as sv on iv.sce_vnf_id=sv.uuid" \
-                            " WHERE iv.instance_scenario_id='{}'" \
-                            " ORDER BY iv.created_at ".format(instance_dict['uuid'])
-                    self.logger.debug(cmd)
-                    self.cur.execute(cmd)
-                    instance_dict['vnfs'] = self.cur.fetchall()
-                    for vnf in instance_dict['vnfs']:
-                        vnf_manage_iface_list=[]
-                        #instance vms
-                        cmd = "SELECT iv.uuid as uuid, vim_vm_id, status, error_msg, vim_info, iv.created_at as created_at, name "\
-                                " FROM instance_vms as iv join vms on iv.vm_id=vms.uuid "\
-                                " WHERE instance_vnf_id='{}' ORDER BY iv.created_at".format(vnf['uuid'])
-                        self.logger.debug(cmd)
-                        self.cur.execute(cmd)
-                        vnf['vms'] = self.cur.fetchall()
-                        for vm in vnf['vms']:
-                            vm_manage_iface_list=[]
-                            #instance_interfaces
-                            cmd = "SELECT vim_interface_id, instance_net_id, internal_name,external_name, mac_address,"\
-                                  " ii.ip_address as ip_address, vim_info, i.type as type"\
-                                  " FROM instance_interfaces as ii join interfaces as i on ii.interface_id=i.uuid"\
-                                  " WHERE instance_vm_id='{}' ORDER BY created_at".format(vm['uuid'])
-                            self.logger.debug(cmd)
-                            self.cur.execute(cmd )
-                            vm['interfaces'] = self.cur.fetchall()
-                            for iface in vm['interfaces']:
-                                if iface["type"] == "mgmt" and iface["ip_address"]:
-                                    vnf_manage_iface_list.append(iface["ip_address"])
-                                    vm_manage_iface_list.append(iface["ip_address"])
-                                if not verbose:
-                                    del iface["type"]
-                            if vm_manage_iface_list: vm["ip_address"] = ",".join(vm_manage_iface_list)
-                        if vnf_manage_iface_list: vnf["ip_address"] = ",".join(vnf_manage_iface_list)
-                        
-                    #instance_nets
-                    #select_text = "instance_nets.uuid as uuid,sce_nets.name as net_name,instance_nets.vim_net_id as net_id,instance_nets.status as status,instance_nets.external as external" 
-                    #from_text = "instance_nets join instance_scenarios on instance_nets.instance_scenario_id=instance_scenarios.uuid " + \
-                    #            "join sce_nets on instance_scenarios.scenario_id=sce_nets.scenario_id"
-                    #where_text = "instance_nets.instance_scenario_id='"+ instance_dict['uuid'] + "'"
-                    cmd = "SELECT uuid,vim_net_id,status,error_msg,vim_info,created, sce_net_id, net_id as vnf_net_id, datacenter_id, datacenter_tenant_id"\
-                            " FROM instance_nets" \
-                            " WHERE instance_scenario_id='{}' ORDER BY created_at".format(instance_dict['uuid'])
-                    self.logger.debug(cmd)
-                    self.cur.execute(cmd)
-                    instance_dict['nets'] = self.cur.fetchall()
-                    
-                    db_base._convert_datetime2str(instance_dict)
-                    db_base._convert_str2boolean(instance_dict, ('public','shared','created') )
-                    return instance_dict
+                    self._get_instances_content(rows, verbose)
+                    return rows[0]
+            except (mdb.Error, AttributeError) as e:
+                self._format_error(e, tries)
+            tries -= 1
+
+    def get_instance_scenarios(self, instance_ids=None, tenant_id=None, verbose=False, datacenter_ids=None):
+        '''Obtain the information of several instances in one pass, with the same content than get_instance_scenario.
+        instance_ids is a list of instance uuids. If None, all the instances (of the tenant if provided) are loaded.
+        If datacenter_ids is a list of datacenter uuids, only the instances with elements at these datacenters are
+        loaded, and only with their vnfs and nets at these datacenters.
+        Returns a list of instances ordered by creation. Unknown uuids are ignored
+        '''
+        if instance_ids is not None and not instance_ids or datacenter_ids is not None and not datacenter_ids:
+            return []
+        params = []
+        where_list = []
+        if tenant_id is not None:
+            where_list.append("inst.tenant_id=%s")
+            params.append(tenant_id)
+        if instance_ids is not None:
+            where_list.append("inst.uuid IN (" + ",".join(("%s",) * len(instance_ids)) + ")")
+            params += instance_ids
+        if datacenter_ids is not None:
+            datacenter_in = ",".join(("%s",) * len(datacenter_ids))
+            where_list.append("inst.uuid IN (SELECT instance_scenario_id FROM instance_vnfs WHERE datacenter_id IN ("
+                              + datacenter_in + ") UNION SELECT instance_scenario_id FROM instance_nets WHERE "
+                              "datacenter_id IN (" + datacenter_in + "))")
+            params += list(datacenter_ids) * 2
+        cmd = self.instance_select.replace("%", "%%")
+        if where_list:
+            cmd += " WHERE " + " AND ".join(where_list)
+        cmd += " ORDER BY inst.created_at"
+        tries = 2
+        while tries:
+            try:
+                with self.con:
+                    self.cur = self.con.cursor(mdb.cursors.DictCursor)
+                    self._execute(cmd, params)
+                    rows = self.cur.fetchall()
+                    self._get_instances_content(rows, verbose, datacenter_ids)
+                    return list(rows)
+            except (mdb.Error, AttributeError) as e:
+                self._format_error(e, tries)
+            tries -= 1
+
+    def get_instance_datacenters(self):
+        '''Obtain the uuids of the datacenters where there are instance vnfs or nets'''
+        tries = 2
+        while tries:
+            try:
+                with self.con:
+                    self.cur = self.con.cursor(mdb.cursors.DictCursor)
+                    self._execute("SELECT DISTINCT datacenter_id FROM instance_vnfs UNION "
+                                  "SELECT DISTINCT datacenter_id FROM instance_nets", ())
+                    return [row["datacenter_id"] for row in self.cur.fetchall() if row["datacenter_id"]]
             except (mdb.Error, AttributeError) as e:
                 self._format_error(e, tries)
             tries -= 1
@@ -938,16 +1038,8 @@ class nfvo_db(db_base.db_base):
                     self.cur = self.con.cursor(mdb.cursors.DictCursor)
     
                     #instance table
-                    where_list=[]
-                    if tenant_id is not None: where_list.append( "tenant_id='" + tenant_id +"'" )
-                    if db_base._check_valid_uuid(instance_id):
-                        where_list.append( "uuid='" + instance_id +"'" )
-                    else:
-                        where_list.append( "name='" + instance_id +"'" )
-                    where_text = " AND ".join(where_list)
-                    cmd = "SELECT * FROM instance_scenarios WHERE "+ where_text
-                    self.logger.debug(cmd)
-                    self.cur.execute(cmd)
+                    where_, params, where_text = self._instance_where(instance_id, tenant_id)
+                    self._execute("SELECT * FROM instance_scenarios WHERE " + where_, params)
                     rows = self.cur.fetchall()
                     
                     if self.cur.rowcount==0:
@@ -958,9 +1050,7 @@ class nfvo_db(db_base.db_base):
                     instance_name = rows[0]["name"]
                     
                     #sce_vnfs
-                    cmd = "DELETE FROM instance_scenarios WHERE uuid='{}'".format(instance_uuid)
-                    self.logger.debug(cmd)
-                    self.cur.execute(cmd)
+                    self._execute("DELETE FROM instance_scenarios WHERE uuid=%s", (instance_uuid,))
     
                     return instance_uuid + " " + instance_name
             except (mdb.Error, AttributeError) as e:
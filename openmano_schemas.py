@@ -81,11 +81,27 @@ config_schema = {
         "http_admin_port": port_schema,
         "http_host": nameshort_schema,
         "auto_push_VNF_to_VIMs": {"type":"boolean"},
+        "vim_thread_workers": integer1_schema,
+        "task_retention": integer0_schema,
+        "task_registry_size": integer1_schema,
+        "task_journal": path_schema,
+        "vim_executor_workers": integer1_schema,
+        "vim_executor_per_vim": integer1_schema,
+        "vim_timeout": integer1_schema,
+        "vim_cache_idle": integer0_schema,
+        "refresh_cache_size": integer1_schema,
+        "delete_retries": integer0_schema,
+        "delete_retry_delay": integer1_schema,
+        "image_cache_dir": path_schema,
+        "image_cache_size": integer1_schema,
+        "status_refresh_interval": integer0_schema,
+        "status_refresh_build_interval": integer1_schema,
         "vnf_repository": path_schema,
         "db_host": nameshort_schema,
         "db_user": nameshort_schema,
         "db_passwd": {"type":"string"},
         "db_name": nameshort_schema,
+        "db_pool_size": integer1_schema,
         # Next fields will disappear once the MANO API includes appropriate primitives
         "vim_url": http_schema,
         "vim_url_admin": http_schema,
@@ -64,7 +64,21 @@ def load_configuration(configuration_file):
                      'http_console_host': None,
                      'log_level': 'DEBUG',
                      'log_socket_port': 9022,
-                     'auto_push_VNF_to_VIMs': True
+                     'auto_push_VNF_to_VIMs': True,
+                     'vim_thread_workers': 1,
+                     'db_pool_size': 10,
+                     'task_retention': 3600,
+                     'task_registry_size': 10000,
+                     'vim_executor_workers': 10,
+                     'vim_executor_per_vim': 4,
+                     'vim_timeout': 60,
+                     'vim_cache_idle': 600,
+                     'refresh_cache_size': 100000,
+                     'delete_retries': 3,
+                     'delete_retry_delay': 5,
+                     'image_cache_size': 10240,
+                     'status_refresh_interval': 0,
+                     'status_refresh_build_interval': 5,
                     }
     try:
         #Check config file exists
@@ -260,7 +274,7 @@ if __name__=="__main__":
         #nfvo.logger = global_config["logger_nfvo"]
         
         # Initialize DB connection
-        mydb = nfvo_db.nfvo_db();
+        mydb = nfvo_db.nfvo_db(pool_size=global_config['db_pool_size'])
         mydb.connect(global_config['db_host'], global_config['db_user'], global_config['db_passwd'], global_config['db_name'])
         try:
             r = mydb.get_db_version()
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+##
+# Copyright 2015 Telefónica Investigación y Desarrollo, S.A.U.
+# This file is part of openvim
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# For those usages not covered by the Apache License, Version 2.0 please
+# contact with: nfvlabs@tid.es
+##
+
+'''
+Thread that refreshes in background the status of the instances at the VIMs
+'''
+__author__ = "Alfonso Tierno"
+__date__ = "$10-feb-2017 12:07:15$"
+
+import threading
+import logging
+from time import time
+import vimconn
+from db_base import db_base_Exception
+
+
+class status_poller(object):
+    '''Refreshes periodically the status of the VMs and nets of all the instances, so that reading an instance does
+    not need to ask the VIMs. Each datacenter is refreshed every 'interval' seconds, or every 'build_interval' seconds
+    while any of its elements is being built. All the due datacenters are refreshed in one pass with
+    refresh(db, None, instance_dict), where instance_dict merges the elements of all the instances at those datacenters;
+    no nfvo tenant is needed, as each element gives its datacenter_tenant_id. It returns (result, message), where a
+    result other than 0 means that some elements could not be updated at database; then they are refreshed again in
+    'build_interval' seconds.
+    Keeps the time of the last refresh of each datacenter, and of each instance refreshed on demand (set_refreshed)
+    '''
+    building_status = ("BUILD",)
+
+    def __init__(self, db, refresh, interval=60, build_interval=5):
+        self.db = db
+        self.refresh = refresh
+        self.interval = interval
+        self.build_interval = min(build_interval, interval)
+        self.logger = logging.getLogger('openmano.vim.poller')
+        self.next_refresh = {}          # datacenter_id: time of its next refresh
+        self.refreshed = {}             # datacenter_id: time of its last refresh
+        self.instance_refreshed = {}    # instance_id: time of its last refresh on demand
+        self.refreshes = 0
+        self.closing = False
+        self.poller = None
+        self.lock = threading.Condition()
+
+    def start(self):
+        self.poller = threading.Thread(target=self._run_poller, name="status_poller")
+        self.poller.daemon = True
+        self.poller.start()
+
+    def close(self):
+        with self.lock:
+            self.closing = True
+            self.lock.notify()
+
+    def wake(self, datacenter_ids, delay=None):
+        '''Brings forward the refresh of these datacenters, e.g. when new elements are being created there. By
+        default they are refreshed in 'build_interval' seconds'''
+        if delay is None:
+            delay = self.build_interval
+        with self.lock:
+            for datacenter_id in datacenter_ids:
+                self.next_refresh[datacenter_id] = min(self.next_refresh.get(datacenter_id, 0), time() + delay)
+            self.lock.notify()
+
+    def set_refreshed(self, instance_id, refresh_time=None):
+        with self.lock:
+            self.instance_refreshed[instance_id] = refresh_time or time()
+
+    def forget(self, instance_id):
+        with self.lock:
+            self.instance_refreshed.pop(instance_id, None)
+
+    def get_last_refreshed(self, instance):
+        '''Returns the time of the oldest status of the elements of this instance, or None if any of them has not
+        been refreshed yet'''
+        datacenter_ids = set(element["datacenter_id"] for element in instance["vnfs"] + instance["nets"])
+        with self.lock:
+            last_refreshed = self.instance_refreshed.get(instance["uuid"])
+            if datacenter_ids and all(datacenter_id in self.refreshed for datacenter_id in datacenter_ids):
+                last_refreshed = max(last_refreshed, min(self.refreshed[datacenter_id]
+                                                         for datacenter_id in datacenter_ids))
+        return last_refreshed
+
+    def _is_building(self, element, vim_id):
+        return element["status"] in self.building_status or (element[vim_id] or "").startswith("TASK.")
+
+    def refresh_due(self):
+        '''Refreshes the datacenters whose refresh time has come. Returns the seconds until the next one.
+        Only the elements of these datacenters are loaded from database'''
+        now = time()
+        datacenter_ids = set(self.db.get_instance_datacenters())
+        with self.lock:
+            for datacenter_id in self.next_refresh.keys():
+                if datacenter_id not in datacenter_ids:
+                    del self.next_refresh[datacenter_id]
+                    self.refreshed.pop(datacenter_id, None)
+            due = [datacenter_id for datacenter_id in datacenter_ids
+                   if self.next_refresh.get(datacenter_id, 0) <= now]
+        elements = {datacenter_id: {"vnfs": [], "nets": []} for datacenter_id in due}
+        if due:
+            for instance in self.db.get_instance_scenarios(verbose=True, datacenter_ids=due):
+                for sce_vnf in instance["vnfs"]:
+                    if sce_vnf["datacenter_id"] in elements:
+                        elements[sce_vnf["datacenter_id"]]["vnfs"].append(sce_vnf)
+                for net in instance["nets"]:
+                    if net["datacenter_id"] in elements:
+                        elements[net["datacenter_id"]]["nets"].append(net)
+            # the elements still given by a task id are being created; refresh_instance does not ask the VIM for them
+            instance_dict = {"uuid": "status_poller", "vnfs": [], "nets": []}
+            for datacenter_id in due:
+                instance_dict["vnfs"] += elements[datacenter_id]["vnfs"]
+                instance_dict["nets"] += elements[datacenter_id]["nets"]
+            try:
+                result, message = self.refresh(self.db, None, instance_dict)
+                refresh_ok = result == 0
+                if not refresh_ok:
+                    self.logger.error("Cannot refresh the status of datacenters %s: %s", ", ".join(due), message)
+            except Exception as e:
+                self.logger.error("Cannot refresh the status of datacenters %s: %s", ", ".join(due), str(e))
+                refresh_ok = False
+            self.refreshes += 1
+        with self.lock:
+            for datacenter_id in due:
+                if not refresh_ok:
+                    self.next_refresh[datacenter_id] = now + self.build_interval
+                    continue
+                self.refreshed[datacenter_id] = now
+                building = any(self._is_building(vm, "vim_vm_id") for sce_vnf in elements[datacenter_id]["vnfs"]
+                               for vm in sce_vnf["vms"]) or \
+                    any(self._is_building(net, "vim_net_id") for net in elements[datacenter_id]["nets"])
+                self.next_refresh[datacenter_id] = now + (self.build_interval if building else self.interval)
+            if self.refreshed:
+                # on demand refreshes older than any datacenter refresh are not needed any more
+                oldest = min(self.refreshed.values())
+                for instance_id, refresh_time in self.instance_refreshed.items():
+                    if refresh_time < oldest:
+                        del self.instance_refreshed[instance_id]
+            if not self.next_refresh:
+                return self.interval
+            return max(0, min(self.next_refresh.values()) - time())
+
+    def _run_poller(self):
+        while True:
+            with self.lock:
+                if self.closing:
+                    return
+            try:
+                wait = self.refresh_due()
+            except (db_base_Exception, vimconn.vimconnException) as e:
+                self.logger.error("Cannot load the instances to refresh: %s", str(e))
+                wait = self.build_interval
+            except Exception as e:
+                self.logger.error("Unexpected exception at status_poller: %s", str(e), exc_info=True)
+                wait = self.interval
+            with self.lock:
+                if self.closing:
+                    return
+                if wait > 0:
+                    self.lock.wait(wait)
@@ -0,0 +1,443 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+##
+# Copyright 2015 Telefónica Investigación y Desarrollo, S.A.U.
+# This file is part of openmano
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# For those usages not covered by the Apache License, Version 2.0 please
+# contact with: nfvlabs@tid.es
+##
+
+'''
+Benchmarks and regression tests (--test) of the openmano database layer. The tests and the get_rows and
+get_scenario benchmarks need a MySQL/MariaDB server with the openmano database created
+(see database_utils/init_mano_db.sh). Database parameters are the same than at openmanod.cfg.
+The query builder benchmark does not need any database
+'''
+__version__="0.0.1"
+version_date="Oct 2026"
+
+import os
+import sys
+import time
+import json
+import uuid
+import logging
+import threading
+import unittest
+import yaml
+from optparse import OptionParser
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import nfvo_db
+import db_base
+import MySQLdb as mdb
+
+
+class fake_cursor(object):
+    '''Cursor that discards the commands, used to measure the cost of building them'''
+    rowcount = 1
+
+    def execute(self, cmd, params=None):
+        pass
+
+
+def old_update_command(table, UPDATE, WHERE, modified_time=0):
+    '''Composes an UPDATE the way db_base did it before the statements were parameterized: concatenating the values
+    escaped with json'''
+    def format_set(data):
+        if data[1] == None:
+            return str(data[0]) + "=Null"
+        return str(data[0]) + '=' + json.dumps(str(data[1]))
+
+    def format_where(data):
+        if data[1] == None:
+            return str(data[0]) + " is Null"
+        return str(data[0]) + '=' + json.dumps(str(data[1]))
+
+    values = ",".join(map(format_set, UPDATE.iteritems()))
+    if modified_time:
+        values += ",modified_at={:f}".format(modified_time)
+    return "UPDATE " + table + " SET " + values + " WHERE " + " and ".join(map(format_where, WHERE.iteritems()))
+
+
+def benchmark_builder(options):
+    '''Measures the time to compose, log and execute at a fake cursor an update_rows command, with the old
+    concatenated text and with the parameterized statement. The escaping of the parameters done by the database
+    driver is not included. Returns a tuple with the microseconds per command of both of them'''
+    mydb = nfvo_db.nfvo_db()
+    mydb.cur = fake_cursor()
+    UPDATE = {"vim_vm_id": "3e2f1a4c-6b1d-4f0e-9b7a-2c1d5e6f7a8b", "status": "ACTIVE", "error_msg": None}
+    WHERE = {"uuid": "8c3b6a50-1e5f-11e6-9c5b-52540030594e"}
+
+    init_time = time.time()
+    for _ in range(0, options.number):
+        cmd = old_update_command("instance_vms", UPDATE, WHERE, time.time())
+        mydb.logger.debug(cmd)
+        mydb.cur.execute(cmd)
+    old = (time.time() - init_time) * 1000000 / options.number
+
+    init_time = time.time()
+    for _ in range(0, options.number):
+        mydb._update_rows("instance_vms", UPDATE, WHERE, time.time())
+    new = (time.time() - init_time) * 1000000 / options.number
+    return old, new
+
+
+def benchmark_get_rows(options, threads, pool_size):
+    '''Launches 'threads' threads, each one calling get_rows options.number times over the same nfvo_db object.
+    Returns the number of queries per second'''
+    mydb = nfvo_db.nfvo_db(pool_size=pool_size)
+    mydb.connect(options.host, options.user, options.password, options.database)
+    errors = []
+
+    def run():
+        try:
+            for _ in range(0, options.number):
+                mydb.get_rows(FROM="nfvo_tenants", SELECT=("uuid", "name"), LIMIT=10)
+        except Exception as e:
+            errors.append(e)
+
+    thread_list = [threading.Thread(target=run) for _ in range(0, threads)]
+    init_time = time.time()
+    for thread in thread_list:
+        thread.start()
+    for thread in thread_list:
+        thread.join()
+    elapsed = time.time() - init_time
+    mydb.disconnect()
+    if errors:
+        raise errors[0]
+    return threads * options.number / elapsed
+
+
+class query_counter(logging.Handler):
+    '''Counts the commands logged by the database layer, one per query'''
+    def __init__(self):
+        logging.Handler.__init__(self, logging.DEBUG)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+
+def count_queries(function, *args, **kwargs):
+    '''Calls function. Returns its result, the number of commands it sends to the database and the elapsed seconds'''
+    counter = query_counter()
+    logger = logging.getLogger("openmano.db")
+    level, propagate = logger.level, logger.propagate
+    logger.addHandler(counter)
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    try:
+        init_time = time.time()
+        result = function(*args, **kwargs)
+        return result, counter.count, time.time() - init_time
+    finally:
+        logger.removeHandler(counter)
+        logger.setLevel(level)
+        logger.propagate = propagate
+
+
+def create_scenario(mydb, vms, vms_per_vnf=10):
+    '''Stores at database a scenario with 'vms' VMs, grouped in vnfs of 'vms_per_vnf' VMs. Each VM has two bridge
+    interfaces, one connected to the vnf internal net and the other one to an external scenario net.
+    Returns the uuids of the scenario, vnfs, image and flavor'''
+    suffix = str(uuid.uuid4())
+    image_id = mydb.new_row("images", {"name": "bench-" + suffix, "location": "/bench/" + suffix + ".qcow2"},
+                            add_uuid=True)
+    flavor_id = mydb.new_row("flavors", {"name": "bench-" + suffix, "ram": 1024, "vcpus": 1, "disk": 10},
+                             add_uuid=True)
+    scenario_dict = {"name": "bench-" + suffix, "description": "get_scenario benchmark", "public": "false",
+                     "nets": {"mgmt": {"name": "bench-mgmt", "type": "bridge", "external": True}}, "vnfs": {}}
+    vnf_ids = []
+    for vnf_index in range(0, (vms + vms_per_vnf - 1) // vms_per_vnf):
+        vnfcs = ["vm{}".format(vm_index) for vm_index in range(0, min(vms_per_vnf, vms - vnf_index * vms_per_vnf))]
+        vnf_descriptor = {"vnf": {
+            "description": "get_scenario benchmark",
+            "VNFC": [{"name": vnfc, "bridge-ifaces": [{"name": "eth0"}, {"name": "eth1"}]} for vnfc in vnfcs],
+            "internal-connections": [{"name": "inner", "description": "internal net", "type": "bridge",
+                                      "elements": [{"VNFC": vnfc, "local_iface_name": "eth1"} for vnfc in vnfcs]}],
+            "external-connections": [{"name": vnfc + "-mgmt", "VNFC": vnfc, "local_iface_name": "eth0",
+                                      "type": "bridge"} for vnfc in vnfcs]}}
+        VNFCDict = {vnfc: {"name": vnfc, "description": vnfc, "image_id": image_id, "flavor_id": flavor_id,
+                           "image_path": "/bench/" + suffix + ".qcow2"} for vnfc in vnfcs}
+        vnf_id = mydb.new_vnf_as_a_whole(None, "bench-{}-{}".format(vnf_index, suffix), vnf_descriptor, VNFCDict)
+        vnf_ids.append(vnf_id)
+        interfaces = mydb.get_rows(FROM="interfaces join vms on interfaces.vm_id=vms.uuid",
+                                   SELECT=("interfaces.uuid as uuid", "external_name"),
+                                   WHERE={"vms.vnf_id": vnf_id}, WHERE_NOT={"external_name": None})
+        scenario_dict["vnfs"]["vnf{}".format(vnf_index)] = {
+            "uuid": vnf_id, "description": "get_scenario benchmark",
+            "ifaces": {iface["external_name"]: {"net_key": "mgmt", "uuid": iface["uuid"]} for iface in interfaces}}
+    scenario_id = mydb.new_scenario(scenario_dict)
+    return scenario_id, vnf_ids, image_id, flavor_id
+
+
+def benchmark_get_scenario(options, vms):
+    '''Creates a scenario of 'vms' VMs and loads it with get_scenario. Returns the number of queries and the
+    mean latency in milliseconds of options.repeat loads'''
+    mydb = nfvo_db.nfvo_db()
+    mydb.connect(options.host, options.user, options.password, options.database)
+    scenario_id, vnf_ids, image_id, flavor_id = create_scenario(mydb, vms)
+    try:
+        _, queries, _ = count_queries(mydb.get_scenario, scenario_id, "any")
+        init_time = time.time()
+        for _ in range(0, options.repeat):
+            mydb.get_scenario(scenario_id, "any")
+        latency = (time.time() - init_time) * 1000 / options.repeat
+    finally:
+        mydb.delete_scenario(scenario_id, "any")
+        for vnf_id in vnf_ids:
+            mydb.delete_row_by_id("vnfs", vnf_id)
+        mydb.delete_row_by_id("images", image_id)
+        mydb.delete_row_by_id("flavors", flavor_id)
+        mydb.disconnect()
+    return queries, latency
+
+
+def prepare_instance(mydb, scenario_id):
+    '''Creates a fake datacenter and fills the scenario with the vim ids, as create_instance does after the VIM has
+    created the nets and VMs. Returns the scenario ready for new_instance_scenario_as_a_whole and the datacenter uuid'''
+    suffix = str(uuid.uuid4())
+    datacenter_id = mydb.new_row("datacenters", {"name": "bench-" + suffix, "vim_url": "http://localhost:9080"},
+                                 add_uuid=True)
+    datacenter_tenant_id = mydb.new_row("datacenter_tenants", {"datacenter_id": datacenter_id}, add_uuid=True)
+    scenarioDict = mydb.get_scenario(scenario_id, "any", datacenter_id)
+    scenarioDict["datacenter_id"] = datacenter_id
+    scenarioDict["datacenter2tenant"] = {datacenter_id: datacenter_tenant_id}
+    for net in scenarioDict["nets"]:
+        net["vim_id_sites"] = {datacenter_id: "vim-" + net["uuid"]}
+    for vnf in scenarioDict["vnfs"]:
+        for net in vnf["nets"]:
+            net["vim_id"] = "vim-" + net["uuid"]
+        for vm in vnf["vms"]:
+            vm["vim_id"] = "vim-" + vm["uuid"]
+            for interface in vm["interfaces"]:
+                interface["vim_id"] = "vim-" + interface["uuid"]
+                interface["ip_address"] = "10.0.0.1" if interface["external_name"] else None
+    return scenarioDict, datacenter_id
+
+
+def create_instance(mydb, scenario_id):
+    '''Stores at database an instance of the scenario at a new fake datacenter.
+    Returns the uuids of the instance and datacenter'''
+    scenarioDict, datacenter_id = prepare_instance(mydb, scenario_id)
+    instance_id = mydb.new_instance_scenario_as_a_whole(None, "bench-" + str(uuid.uuid4()), "test", scenarioDict)
+    return instance_id, datacenter_id
+
+
+def benchmark_instantiate(options, vms):
+    '''Stores a scenario of 'vms' VMs with its vnfs and an instance of it. Returns a list of (operation, number of
+    statements, elapsed seconds)'''
+    mydb = nfvo_db.nfvo_db()
+    mydb.connect(options.host, options.user, options.password, options.database)
+    result = []
+    (scenario_id, vnf_ids, image_id, flavor_id), statements, elapsed = count_queries(create_scenario, mydb, vms)
+    result.append(("new_vnf_as_a_whole + new_scenario", statements, elapsed))
+    try:
+        scenarioDict, datacenter_id = prepare_instance(mydb, scenario_id)
+        instance_id, statements, elapsed = count_queries(mydb.new_instance_scenario_as_a_whole, None,
+                                                         "bench-" + str(uuid.uuid4()), "benchmark", scenarioDict)
+        result.append(("new_instance_scenario_as_a_whole", statements, elapsed))
+        mydb.delete_instance_scenario(instance_id)
+        mydb.delete_row_by_id("datacenters", datacenter_id)
+    finally:
+        mydb.delete_scenario(scenario_id, "any")
+        for vnf_id in vnf_ids:
+            mydb.delete_row_by_id("vnfs", vnf_id)
+        mydb.delete_row_by_id("images", image_id)
+        mydb.delete_row_by_id("flavors", flavor_id)
+        mydb.disconnect()
+    return result
+
+
+def reference_get_instance_scenario(mydb, instance_id, tenant_id=None, verbose=False):
+    '''get_instance_scenario as it was before the batched loader: with a query per instance_vnf and per instance_vm.
+    Used as reference of the expected output'''
+    with mydb.con:
+        cur = mydb.con.cursor(mdb.cursors.DictCursor)
+        where_list=[]
+        if tenant_id is not None: where_list.append( "inst.tenant_id='" + tenant_id +"'" )
+        if db_base._check_valid_uuid(instance_id):
+            where_list.append( "inst.uuid='" + instance_id +"'" )
+        else:
+            where_list.append( "inst.name='" + instance_id +"'" )
+        cur.execute(nfvo_db.nfvo_db.instance_select + " WHERE " + " AND ".join(where_list))
+        instance_dict = cur.fetchall()[0]
+        if instance_dict["cloud_config"]:
+            instance_dict["cloud-config"] = yaml.load(instance_dict["cloud_config"])
+        del instance_dict["cloud_config"]
+        cur.execute("SELECT iv.uuid as uuid,sv.vnf_id as vnf_id,sv.name as vnf_name, sce_vnf_id, datacenter_id, "
+                    "datacenter_tenant_id FROM instance_vnfs as iv join sce_vnfs as sv on iv.sce_vnf_id=sv.uuid"
+                    " WHERE iv.instance_scenario_id='{}' ORDER BY iv.created_at ".format(instance_dict['uuid']))
+        instance_dict['vnfs'] = cur.fetchall()
+        for vnf in instance_dict['vnfs']:
+            vnf_manage_iface_list=[]
+            cur.execute("SELECT iv.uuid as uuid, vim_vm_id, status, error_msg, vim_info, iv.created_at as created_at, "
+                        "name FROM instance_vms as iv join vms on iv.vm_id=vms.uuid "
+                        " WHERE instance_vnf_id='{}' ORDER BY iv.created_at".format(vnf['uuid']))
+            vnf['vms'] = cur.fetchall()
+            for vm in vnf['vms']:
+                vm_manage_iface_list=[]
+                cur.execute("SELECT vim_interface_id, instance_net_id, internal_name,external_name, mac_address,"
+                            " ii.ip_address as ip_address, vim_info, i.type as type"
+                            " FROM instance_interfaces as ii join interfaces as i on ii.interface_id=i.uuid"
+                            " WHERE instance_vm_id='{}' ORDER BY created_at".format(vm['uuid']))
+                vm['interfaces'] = cur.fetchall()
+                for iface in vm['interfaces']:
+                    if iface["type"] == "mgmt" and iface["ip_address"]:
+                        vnf_manage_iface_list.append(iface["ip_address"])
+                        vm_manage_iface_list.append(iface["ip_address"])
+                    if not verbose:
+                        del iface["type"]
+                if vm_manage_iface_list: vm["ip_address"] = ",".join(vm_manage_iface_list)
+            if vnf_manage_iface_list: vnf["ip_address"] = ",".join(vnf_manage_iface_list)
+        cur.execute("SELECT uuid,vim_net_id,status,error_msg,vim_info,created, sce_net_id, net_id as vnf_net_id, "
+                    "datacenter_id, datacenter_tenant_id FROM instance_nets"
+                    " WHERE instance_scenario_id='{}' ORDER BY created_at".format(instance_dict['uuid']))
+        instance_dict['nets'] = cur.fetchall()
+        db_base._convert_datetime2str(instance_dict)
+        db_base._convert_str2boolean(instance_dict, ('public','shared','created') )
+        return instance_dict
+
+
+class test_instance_loader(unittest.TestCase):
+    options = None      # database options, the command line ones or the defaults of new_option_parser
+
+    @classmethod
+    def setUpClass(cls):
+        options = cls.options or new_option_parser().parse_args([])[0]
+        cls.mydb = nfvo_db.nfvo_db()
+        try:
+            cls.mydb.connect(options.host, options.user, options.password, options.database)
+        except db_base.db_base_Exception as e:
+            raise unittest.SkipTest("database not reachable: " + str(e))
+        cls.scenario_id, cls.vnf_ids, cls.image_id, cls.flavor_id = create_scenario(cls.mydb, 25, vms_per_vnf=5)
+        cls.instances = [create_instance(cls.mydb, cls.scenario_id) for _ in range(0, 3)]
+
+    @classmethod
+    def tearDownClass(cls):
+        for instance_id, datacenter_id in cls.instances:
+            cls.mydb.delete_instance_scenario(instance_id)
+            cls.mydb.delete_row_by_id("datacenters", datacenter_id)
+        cls.mydb.delete_scenario(cls.scenario_id, "any")
+        for vnf_id in cls.vnf_ids:
+            cls.mydb.delete_row_by_id("vnfs", vnf_id)
+        cls.mydb.delete_row_by_id("images", cls.image_id)
+        cls.mydb.delete_row_by_id("flavors", cls.flavor_id)
+        cls.mydb.disconnect()
+
+    def test_000_same_output(self):
+        for instance_id, _ in self.instances:
+            for verbose in (False, True):
+                self.assertEqual(self.mydb.get_instance_scenario(instance_id, verbose=verbose),
+                                 reference_get_instance_scenario(self.mydb, instance_id, verbose=verbose))
+
+    def test_010_bulk_same_output(self):
+        instance_ids = [instance_id for instance_id, _ in self.instances]
+        expected = [reference_get_instance_scenario(self.mydb, instance_id, verbose=True)
+                    for instance_id in instance_ids]
+        self.assertEqual(self.mydb.get_instance_scenarios(instance_ids, verbose=True), expected)
+        self.assertEqual(self.mydb.get_instance_scenarios(instance_ids[1:2], verbose=True), expected[1:2])
+        self.assertEqual(self.mydb.get_instance_scenarios([]), [])
+
+    def test_020_fixed_number_of_queries(self):
+        _, single, _ = count_queries(self.mydb.get_instance_scenario, self.instances[0][0])
+        _, bulk, _ = count_queries(self.mydb.get_instance_scenarios,
+                                   [instance_id for instance_id, _ in self.instances])
+        self.assertEqual(single, 5)
+        self.assertEqual(bulk, 5)
+
+    def test_030_values_are_parameters(self):
+        # a name with quotes is compared as a value, not as part of the statement
+        with self.assertRaises(db_base.db_base_Exception) as context:
+            self.mydb.get_instance_scenario("x' OR '1'='1")
+        self.assertEqual(context.exception.http_code, db_base.HTTP_Not_Found)
+        with self.assertRaises(db_base.db_base_Exception):
+            self.mydb.delete_instance_scenario("x' OR '1'='1")
+        self.assertEqual(len(self.mydb.get_instance_scenarios([instance_id for instance_id, _ in self.instances])),
+                         len(self.instances))
+
+
+def new_option_parser():
+    '''Returns the parser of the command line options. Its defaults are also used by the tests run by other runners'''
+    parser = OptionParser()
+    parser.add_option("-v", '--version', help='Show current version', dest='version', action="store_true",
+                      default=False)
+    parser.add_option('--debug', help='Set logs to debug level', dest='debug', action="store_true", default=False)
+    parser.add_option('--host', dest='host', default="localhost", help='database host. By default localhost')
+    parser.add_option('-u', '--user', dest='user', default="mano", help='database user. By default mano')
+    parser.add_option('-p', '--password', dest='password', default="manopw",
+                      help='database password. By default manopw')
+    parser.add_option('-d', '--database', dest='database', default="mano_db",
+                      help='database name. By default mano_db')
+    parser.add_option('-n', '--number', dest='number', type="int", default=1000,
+                      help='Number of operations per thread. By default 1000')
+    parser.add_option('--threads', dest='threads', default="1,2,4,8",
+                      help='Comma separated list of number of threads. By default 1,2,4,8')
+    parser.add_option('--scenario-vms', dest='scenario_vms', default="10,100,1000",
+                      help='Comma separated list of number of VMs of the get_scenario scenarios. By default 10,100,1000')
+    parser.add_option('--instance-vms', dest='instance_vms', type="int", default=500,
+                      help='Number of VMs of the instantiate scenario. By default 500')
+    parser.add_option('-r', '--repeat', dest='repeat', type="int", default=10,
+                      help='Number of get_scenario loads of each scenario. By default 10')
+    parser.add_option('-t', '--test', help='Run the regression tests instead of the benchmarks', dest='test',
+                      action="store_true", default=False)
+    parser.add_option('-b', '--benchmarks', dest='benchmarks', default="builder,get_rows,get_scenario,instantiate",
+                      help='Comma separated list of benchmarks to run, among builder, get_rows, get_scenario, '
+                           'instantiate. Only builder does not need a database. By default all of them')
+    return parser
+
+
+if __name__=="__main__":
+    parser = new_option_parser()
+    (options, args) = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s %(name)s %(levelname)s: %(message)s",
+                        level=logging.DEBUG if options.debug else logging.WARNING)
+    if options.version:
+        print sys.argv[0], __version__ + " version", version_date
+        sys.exit(0)
+
+    if options.test:
+        test_instance_loader.options = options
+        suite = unittest.TestLoader().loadTestsFromTestCase(test_instance_loader)
+        result = unittest.TextTestRunner(verbosity=2).run(suite)
+        sys.exit(0 if result.wasSuccessful() else 1)
+
+    benchmarks = options.benchmarks.split(",")
+    if "builder" in benchmarks:
+        old, new = benchmark_builder(options)
+        print "update_rows command: {:.1f} us concatenated, {:.1f} us parameterized".format(old, new)
+
+    if "get_rows" in benchmarks:
+        for threads in options.threads.split(","):
+            threads = int(threads)
+            single = benchmark_get_rows(options, threads, 1)
+            pooled = benchmark_get_rows(options, threads, threads)
+            print "get_rows with {} threads: {:.0f} queries/s with one connection, {:.0f} queries/s with a pool of " \
+                  "{}".format(threads, single, pooled, threads)
+
+    if "get_scenario" in benchmarks:
+        for vms in options.scenario_vms.split(","):
+            queries, latency = benchmark_get_scenario(options, int(vms))
+            print "get_scenario of {} VMs: {} queries, {:.1f} ms".format(vms, queries, latency)
+
+    if "instantiate" in benchmarks:
+        for operation, statements, elapsed in benchmark_instantiate(options, options.instance_vms):
+            print "{} of {} VMs: {} statements, {:.2f} s".format(operation, options.instance_vms, statements, elapsed)
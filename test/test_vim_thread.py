@@ -0,0 +1,1287 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+##
+# Copyright 2015 Telefónica Investigación y Desarrollo, S.A.U.
+# This file is part of openmano
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# For those usages not covered by the Apache License, Version 2.0 please
+# contact with: nfvlabs@tid.es
+##
+
+'''
+Module for testing vim_thread task processing. It does not need a VIM nor a database: tasks are created with
+nfvo.new_task and inserted in a vim_thread that uses a fake vimconnector, which only records the time each task is
+started by the thread.
+'''
+__version__="0.0.1"
+version_date="Oct 2026"
+
+import os
+import sys
+import time
+import logging
+import collections
+import yaml
+import resource
+import shutil
+import tempfile
+import unittest
+import hashlib
+import threading
+import SimpleHTTPServer
+import SocketServer
+from threading import Lock
+from optparse import OptionParser
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import vimconn
+import vim_thread
+import vim_tasks
+import vim_calls
+import vim_caches
+import status_poller
+import nfvo
+
+global logger
+logger = logging.getLogger("test_vim_thread")
+
+
+class fake_db():
+    '''Replaces nfvo_db at vim_thread. It just counts and stores the updates'''
+    def __init__(self):
+        self.updates = 0
+        self.rows_updated = []
+        self.instances = []
+        self.loaded_datacenters = []    # datacenter_ids of each get_instance_scenarios
+        self.datacenters = []   # rows of the get_vim query
+
+    def get_instance_scenarios(self, instance_ids=None, tenant_id=None, verbose=False, datacenter_ids=None):
+        if datacenter_ids is None:
+            return self.instances
+        self.loaded_datacenters.append(sorted(datacenter_ids))
+        instances = []
+        for instance in self.instances:
+            instance = dict(instance, vnfs=[sce_vnf for sce_vnf in instance["vnfs"]
+                                            if sce_vnf["datacenter_id"] in datacenter_ids],
+                            nets=[net for net in instance["nets"] if net["datacenter_id"] in datacenter_ids])
+            if instance["vnfs"] or instance["nets"]:
+                instances.append(instance)
+        return instances
+
+    def get_instance_datacenters(self):
+        return list(set(element["datacenter_id"] for instance in self.instances
+                        for element in instance["vnfs"] + instance["nets"]))
+
+    def get_rows(self, FROM=None, SELECT=None, WHERE=None):
+        return [dict(row) for row in self.datacenters if WHERE.get('d.uuid') in (None, row['datacenter_id'])]
+
+    def update_rows(self, table, UPDATE, WHERE, modified_time=0):
+        self.updates += 1
+        self.rows_updated.append((table, UPDATE, WHERE))
+        return 1
+
+    def update_rows_case(self, table, column, values, modified_time=0):
+        self.updates += 1
+        for old_value, new_value in values.items():
+            self.rows_updated.append((table, {column: new_value}, {column: old_value}))
+        return len(values)
+
+
+class vimconnector(vimconn.vimconnector):
+    '''Fake VIM connector. It stores at self.started the time when a task reaches the VIM, with the element name as
+    key. 'delay' is the time in seconds each operation takes'''
+    def __init__(self, delay=0, config=None, **kwargs):
+        vim_config = {"datacenter_tenant_id": "fake-dt"}
+        vim_config.update(config or {})
+        vimconn.vimconnector.__init__(self, "fake-uuid", "fake", "fake-tenant-id", "fake-tenant", "http://fake",
+                                      config=vim_config)
+        self.delay = delay
+        self.started = {}
+        self.lock = Lock()
+        self.index = 0
+
+    def _operation(self, name):
+        with self.lock:
+            self.started[name] = time.time()
+            self.index += 1
+            vim_id = "vim-{}".format(self.index)
+        if self.delay:
+            time.sleep(self.delay)
+        return vim_id
+
+    def new_network(self, net_name, net_type, ip_profile=None, shared=False, vlan=None):
+        return self._operation(net_name)
+
+    def new_vminstance(self, name, description, start, image_id, flavor_id, net_list, cloud_config=None,
+                       disk_list=None):
+        return self._operation(name)
+
+    def delete_network(self, net_id):
+        self._operation(net_id)
+        return net_id
+
+    def delete_vminstance(self, vm_id):
+        self._operation(vm_id)
+        return vm_id
+
+    def refresh_vms_status(self, vm_list):
+        self._operation("refresh_vms_status")
+        return {vm_id: {"status": "ACTIVE", "vim_info": vimconn.lazy_vim_info({"id": vm_id, "status": "ACTIVE"}),
+                        "interfaces": [{"vim_net_id": "vim-net-" + self.name, "vim_interface_id": "port-" + vm_id,
+                                        "mac_address": "fa:16:3e:00:00:01",
+                                        "vim_info": vimconn.lazy_vim_info({"id": "port-" + vm_id})}]}
+                for vm_id in vm_list}
+
+    def refresh_nets_status(self, net_list):
+        self._operation("refresh_nets_status")
+        return {net_id: {"status": "ACTIVE", "vim_info": vimconn.lazy_vim_info({"id": net_id, "status": "ACTIVE"})}
+                for net_id in net_list}
+
+
+class deleting_vimconnector(vimconnector):
+    '''Fake VIM connector that, as the OpenStack one, reports DELETED the VMs it does not know. 'known' are the ids
+    it knows, and the VMs created are added to it. The lists of ids asked are stored at self.refreshed'''
+    def __init__(self, known=()):
+        vimconnector.__init__(self)
+        self.known = list(known)
+        self.refreshed = []
+
+    def new_vminstance(self, *args, **kwargs):
+        vm_id = vimconnector.new_vminstance(self, *args, **kwargs)
+        self.known.append(vm_id)
+        return vm_id
+
+    def refresh_vms_status(self, vm_list):
+        self.refreshed.append(list(vm_list))
+        return {vm_id: {"status": "ACTIVE" if vm_id in self.known else "DELETED", "interfaces": []}
+                for vm_id in vm_list}
+
+
+class failing_vimconnector(vimconnector):
+    '''Fake VIM connector whose deletions fail. 'failures' is a dictionary id: number of times its deletion fails
+    before succeeding; the ids at 'missing' are not found'''
+    def __init__(self, failures=None, missing=()):
+        vimconnector.__init__(self)
+        self.failures = failures or {}
+        self.missing = missing
+
+    def _delete(self, element_id):
+        if element_id in self.missing:
+            raise vimconn.vimconnNotFoundException("'{}' not found".format(element_id))
+        if self.failures.get(element_id):
+            self.failures[element_id] -= 1
+            raise vimconn.vimconnConnectionException("fake error deleting " + element_id)
+        self._operation(element_id)
+        return element_id
+
+    def delete_vminstance(self, vm_id):
+        return self._delete(vm_id)
+
+    def delete_network(self, net_id):
+        return self._delete(net_id)
+
+    def delete_flavor(self, flavor_id):
+        return self._delete(flavor_id)
+
+    def delete_image(self, image_id):
+        return self._delete(image_id)
+
+
+class provisioning_vimconnector(vimconnector):
+    '''Fake VIM connector for the image and flavor provisioning. new_image fails if 'fail' is True'''
+    def __init__(self, delay=0, fail=False):
+        vimconnector.__init__(self, delay=delay)
+        self.fail = fail
+        self.images = {}    # location: vim_id
+        self.flavors = {}   # vim_id: flavor_dict
+        self.deleted = []
+
+    def get_image_id_from_path(self, path):
+        if path not in self.images:
+            raise vimconn.vimconnNotFoundException("image with location '{}' not found".format(path))
+        return self.images[path]
+
+    def new_image(self, image_dict):
+        if self.fail:
+            raise vimconn.vimconnConnectionException("fake error")
+        self.images[image_dict["location"]] = self._operation(image_dict["name"])
+        self.local_path = image_dict.get("local_path")
+        if not image_dict.get("checksum"):
+            image_dict["checksum"] = "md5-" + image_dict["location"]
+        return self.images[image_dict["location"]]
+
+    def delete_image(self, image_id):
+        self.deleted.append(image_id)
+        return image_id
+
+    def get_flavor_id_from_data(self, flavor_dict):
+        raise vimconn.vimconnNotFoundException("flavor not found")
+
+    def new_flavor(self, flavor_data, change_name_if_used=True):
+        vim_id = self._operation(flavor_data["name"])
+        self.flavors[vim_id] = flavor_data
+        return vim_id
+
+    def delete_flavor(self, flavor_id):
+        self.deleted.append(flavor_id)
+        return flavor_id
+
+
+class provisioning_db(object):
+    '''Replaces nfvo_db at the image and flavor provisioning, with in memory tables'''
+    def __init__(self):
+        self.tables = {}
+        self.lock = Lock()
+        self.index = 0
+
+    def get_rows(self, FROM=None, SELECT=None, WHERE=None):
+        with self.lock:
+            return [dict(row) for row in self.tables.get(FROM, ())
+                    if all(row.get(k) == v for k, v in (WHERE or {}).items())]
+
+    def new_row(self, table, INSERT, add_uuid=False):
+        with self.lock:
+            row = dict(INSERT)
+            if add_uuid:
+                self.index += 1
+                row["uuid"] = "{}-{}".format(table, self.index)
+            self.tables.setdefault(table, []).append(row)
+            return row.get("uuid")
+
+    def update_rows(self, table, UPDATE, WHERE, modified_time=0):
+        for row in self.tables.get(table, ()):
+            if all(row.get(k) == v for k, v in WHERE.items()):
+                row.update(UPDATE)
+
+    def delete_row(self, FROM, WHERE):
+        '''As nfvo_db, a list value at WHERE is an IN condition. The commands are counted at self.deletions'''
+        def match(row):
+            return all(row.get(k) in v if isinstance(v, (list, tuple)) else row.get(k) == v for k, v in WHERE.items())
+        with self.lock:
+            self.deletions = getattr(self, "deletions", 0) + 1
+            rows = self.tables.get(FROM, [])
+            self.tables[FROM] = [row for row in rows if not match(row)]
+            return len(rows) - len(self.tables[FROM])
+
+
+class counting_vimconnector(vimconnector):
+    '''Fake VIM connector created by nfvo.get_vim. It counts the logins, that the real connectors make when created
+    or at their first operation'''
+    logins = 0
+
+    def __init__(self, uuid, name, tenant_id, tenant_name, url, url_admin=None, user=None, passwd=None,
+                 log_level=None, config={}, persistent_info={}):
+        counting_vimconnector.logins += 1
+        vimconnector.__init__(self, config=config)
+
+
+class counting_vimconn_module(object):
+    '''Replaces the vimconn_<type> module loaded by nfvo.get_vim'''
+    vimconnector = counting_vimconnector
+
+
+def new_fake_datacenter_db(datacenter_id="fake-dc"):
+    '''Returns a fake_db with a datacenter of type "counting" for nfvo.get_vim'''
+    nfvo.vimconn_imported["counting"] = counting_vimconn_module
+    db = fake_db()
+    db.datacenters.append({"type": "counting", "config": "{vim_timeout: 5}", "datacenter_id": datacenter_id,
+                           "vim_url": "http://fake", "vim_url_admin": None, "datacenter_name": "fake",
+                           "datacenter_tenant_id": "fake-dt", "vim_tenant_name": "fake-tenant",
+                           "vim_tenant_id": "fake-tenant-id", "user": "fake", "passwd": "fake", "dt_config": None})
+    return db
+
+
+def benchmark_get_vim(number, idle):
+    '''Calls nfvo.get_vim number times with a vim_cache_idle of 'idle' seconds, as the API requests do.
+    Returns the number of VIM logins and the seconds taken'''
+    db = new_fake_datacenter_db()
+    old_vim_cache = nfvo.vim_cache
+    nfvo.vim_cache = vim_caches.connector_cache(idle=idle)
+    logins = counting_vimconnector.logins
+    init_time = time.time()
+    try:
+        for _ in range(0, number):
+            nfvo.get_vim(db, "fake-tenant", datacenter_id="fake-dc")
+    finally:
+        nfvo.vim_cache = old_vim_cache
+    return counting_vimconnector.logins - logins, time.time() - init_time
+
+
+class image_server(object):
+    '''HTTP server of the files of a temporal directory, at a background thread. It counts the GET requests'''
+    def __init__(self):
+        self.directory = tempfile.mkdtemp()
+        self.requests = 0
+        server = self
+
+        class handler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+            def translate_path(self, path):
+                return os.path.join(server.directory, path.lstrip("/"))
+
+            def do_GET(self):
+                server.requests += 1
+                SimpleHTTPServer.SimpleHTTPRequestHandler.do_GET(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = SocketServer.ThreadingTCPServer(("127.0.0.1", 0), handler)
+        self.httpd.daemon_threads = True
+        self.url = "http://127.0.0.1:{}/".format(self.httpd.server_address[1])
+        thread = threading.Thread(target=self.httpd.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def add_image(self, name, size):
+        content = os.urandom(size)
+        with open(os.path.join(self.directory, name), "wb") as f:
+            f.write(content)
+        return self.url + name, hashlib.md5(content).hexdigest()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        shutil.rmtree(self.directory)
+
+
+def new_fake_thread(delay=0, workers=1, journal=None, result_writer=None):
+    myvim = vimconnector(delay=delay)
+    thread = vim_thread.vim_thread(myvim, nfvo.task_lock, "fake-thread", "fake", "fake-dt", db=fake_db(),
+                                   db_lock=Lock(), workers=workers, journal=journal, thread_id="fake-dc.fake-tenant",
+                                   result_writer=result_writer)
+    thread.daemon = True
+    thread.start()
+    return thread, myvim
+
+
+def wait_tasks(tasks, timeout=60):
+    '''wait until all tasks are done or error. Returns True if finished before timeout'''
+    elapsed = 0
+    while elapsed < timeout:
+        if all(t["status"] in ("done", "error") for t in tasks):
+            return True
+        time.sleep(0.001)
+        elapsed += 0.001
+    return False
+
+
+def percentile(values, p):
+    values = sorted(values)
+    index = int(round(p / 100.0 * (len(values) - 1)))
+    return values[index]
+
+
+def benchmark_dispatch_latency(number_tasks):
+    '''Inserts number_tasks new-net tasks, one by one, and measures the time between the insertion and the
+    moment the fake VIM is called. Returns a dictionary with the percentiles in microseconds'''
+    thread, myvim = new_fake_thread()
+    enqueued = {}
+    tasks = []
+    for index in range(0, number_tasks):
+        name = "net-{}".format(index)
+        task = nfvo.new_task("new-net", (name, "bridge", None), store=False)
+        enqueued[name] = time.time()
+        thread.insert_task(task)
+        tasks.append(task)
+        # let the thread become idle again, so that each task measures a wake up
+        wait_tasks((task,))
+    thread.insert_task(nfvo.new_task("exit", None, store=False))
+    thread.join()
+    latency = [(myvim.started[name] - enqueued[name]) * 1e6 for name in enqueued]
+    return {"p50": percentile(latency, 50), "p90": percentile(latency, 90), "p99": percentile(latency, 99),
+            "max": max(latency)}
+
+
+def insert_instance_tasks(thread, number_vms, nets_per_vm=1):
+    """Inserts, as create_instance does, the new-net tasks followed by the new-vm tasks that depend on them.
+    Returns the list of tasks"""
+    tasks = []
+    vm_nets = []
+    for index in range(0, number_vms):
+        depends = {}
+        net_list = []
+        for net_index in range(0, nets_per_vm):
+            task = nfvo.new_task("new-net", ("net-{}-{}".format(index, net_index), "bridge", None), store=False)
+            thread.insert_task(task)
+            tasks.append(task)
+            depends[task["id"]] = task
+            net_list.append({"net_id": task["id"]})
+        vm_nets.append((depends, net_list))
+    for index in range(0, number_vms):
+        depends, net_list = vm_nets[index]
+        task = nfvo.new_task("new-vm", ("vm-{}".format(index), None, True, "image", "flavor", net_list, None, None),
+                             store=False, depends=depends)
+        thread.insert_task(task)
+        tasks.append(task)
+    return tasks
+
+
+def benchmark_throughput(number_vms, workers, delay):
+    """Creates number_vms VMs and nets against a fake VIM that needs 'delay' seconds per operation.
+    Returns the number of tasks processed per second"""
+    thread, myvim = new_fake_thread(delay=delay, workers=workers)
+    init_time = time.time()
+    tasks = insert_instance_tasks(thread, number_vms)
+    wait_tasks(tasks)
+    elapsed = time.time() - init_time
+    thread.insert_task(nfvo.new_task("exit", None, store=False))
+    thread.join()
+    errors = [t for t in tasks if t["status"] != "done"]
+    if errors:
+        raise Exception("{} tasks failed, first: {}".format(len(errors), errors[0]["result"]))
+    return len(tasks) / elapsed
+
+
+def soak_task_registry(number_tasks, ttl=0, max_size=1000):
+    """Creates and deletes number_tasks nets, storing the tasks at nfvo.task_dict. Returns a list of tuples
+    (tasks processed, tasks stored, max resident memory in KB), taken each 10% of the tasks"""
+    old_ttl, old_max_size = nfvo.task_dict.ttl, nfvo.task_dict.max_size
+    nfvo.task_dict.ttl, nfvo.task_dict.max_size = ttl, max_size
+    thread, myvim = new_fake_thread()
+    samples = []
+    try:
+        block = 500
+        for index in range(0, number_tasks / 2, block):
+            tasks = []
+            for net_index in range(index, index + block):
+                create_task = nfvo.new_task("new-net", ("net-{}".format(net_index), "bridge", None))
+                thread.insert_task(create_task)
+                delete_task = nfvo.new_task("del-net", create_task["id"], depends={create_task["id"]: create_task})
+                thread.insert_task(delete_task)
+                tasks += [create_task, delete_task]
+            wait_tasks(tasks)
+            myvim.started.clear()
+            del thread.db.rows_updated[:]
+            if (index + block) % (number_tasks / 20) == 0:
+                samples.append(((index + block) * 2, len(nfvo.task_dict),
+                                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+    finally:
+        thread.insert_task(nfvo.new_task("exit", None, store=False))
+        thread.join()
+        nfvo.task_dict.ttl, nfvo.task_dict.max_size = old_ttl, old_max_size
+    return samples
+
+
+class test_vim_thread_dispatch(unittest.TestCase):
+
+    def test_000_task_is_processed(self):
+        thread, myvim = new_fake_thread()
+        task = nfvo.new_task("new-net", ("net-a", "bridge", None), store=False)
+        thread.insert_task(task)
+        self.assertTrue(wait_tasks((task,), timeout=5))
+        self.assertEqual(task["status"], "done")
+        thread.insert_task(nfvo.new_task("exit", None, store=False))
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+
+    def test_010_deleted_task_is_skipped(self):
+        thread, myvim = new_fake_thread(delay=0.2)
+        task1 = nfvo.new_task("new-net", ("net-a", "bridge", None), store=False)
+        task2 = nfvo.new_task("new-net", ("net-b", "bridge", None), store=False)
+        thread.insert_task(task1)
+        thread.insert_task(task2)
+        with nfvo.task_lock:
+            task2["status"] = "deleted"
+        self.assertTrue(wait_tasks((task1,), timeout=5))
+        thread.insert_task(nfvo.new_task("exit", None, store=False))
+        thread.join(5)
+        self.assertNotIn("net-b", myvim.started)
+
+    def test_020_dispatch_latency(self):
+        result = benchmark_dispatch_latency(50)
+        # the former implementation polled each second
+        self.assertLess(result["p99"], 100000)
+
+    def test_030_workers_respect_depends(self):
+        thread, myvim = new_fake_thread(delay=0.01, workers=4)
+        tasks = insert_instance_tasks(thread, 20, nets_per_vm=2)
+        self.assertTrue(wait_tasks(tasks, timeout=10))
+        for task in tasks:
+            self.assertEqual(task["status"], "done", str(task["result"]))
+            if task["name"] == "new-vm":
+                for depend in task["depends"].values():
+                    self.assertLessEqual(myvim.started[depend["params"][0]], myvim.started[task["params"][0]])
+        thread.insert_task(nfvo.new_task("exit", None, store=False))
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+
+    def test_035_waiting_task_does_not_block_workers(self):
+        thread, myvim = new_fake_thread(delay=0.2, workers=2)
+        net_task = nfvo.new_task("new-net", ("net-a", "bridge", None), store=False)
+        vm_task = nfvo.new_task("new-vm", ("vm-a", None, True, "image", "flavor", [{"net_id": net_task["id"]}],
+                                           None, None), store=False, depends={net_task["id"]: net_task})
+        other_task = nfvo.new_task("new-net", ("net-b", "bridge", None), store=False)
+        for task in (net_task, vm_task, other_task):
+            thread.insert_task(task)
+        self.assertTrue(wait_tasks((net_task, vm_task, other_task), timeout=5))
+        self.assertEqual(vm_task["status"], "done")
+        # net-b runs at the same time than net-a, while vm-a waits for net-a to finish
+        self.assertLess(myvim.started["net-b"] - myvim.started["net-a"], 0.1)
+        self.assertGreaterEqual(myvim.started["vm-a"] - myvim.started["net-a"], 0.2)
+        thread.insert_task(nfvo.new_task("exit", None, store=False))
+        thread.join(5)
+
+    def test_036_deleted_and_foreign_dependencies(self):
+        thread, myvim = new_fake_thread(delay=0.2)
+        busy_task = nfvo.new_task("new-net", ("net-busy", "bridge", None), store=False)
+        net_task = nfvo.new_task("new-net", ("net-a", "bridge", None), store=False)
+        thread.insert_task(busy_task)
+        thread.insert_task(net_task)
+        self.assertTrue(thread.del_task(net_task))
+        self.assertEqual(net_task["status"], "deleted")
+        vm_task = nfvo.new_task("new-vm", ("vm-a", None, True, "image", "flavor", [{"net_id": net_task["id"]}],
+                                           None, None), store=False, depends={net_task["id"]: net_task})
+        del_task = nfvo.new_task("del-net", net_task["id"], store=False, depends={net_task["id"]: net_task})
+        thread.insert_task(vm_task)
+        thread.insert_task(del_task)
+        self.assertTrue(wait_tasks((busy_task, vm_task, del_task), timeout=5))
+        self.assertEqual(vm_task["status"], "error")
+        self.assertEqual(del_task["status"], "done")
+        self.assertNotIn("vm-a", myvim.started)
+        self.assertNotIn(None, myvim.started)
+        self.assertFalse(thread.del_task(busy_task))
+        # a dependency on an unfinished task of other thread is refused instead of waiting forever
+        other_thread, other_vim = new_fake_thread(delay=0.2)
+        other_task = nfvo.new_task("new-net", ("net-other", "bridge", None), store=False)
+        other_thread.insert_task(other_task)
+        with self.assertRaises(vimconn.vimconnException):
+            thread.insert_task(nfvo.new_task("new-vm", ("vm-b", None, True, "image", "flavor",
+                                                        [{"net_id": other_task["id"]}], None, None),
+                                             store=False, depends={other_task["id"]: other_task}))
+        for fake_thread in (thread, other_thread):
+            fake_thread.insert_task(nfvo.new_task("exit", None, store=False))
+            fake_thread.join(5)
+
+    def test_040_workers_run_in_parallel(self):
+        thread, myvim = new_fake_thread(delay=0.2, workers=4)
+        tasks = [nfvo.new_task("new-net", ("net-{}".format(index), "bridge", None), store=False)
+                 for index in range(0, 4)]
+        init_time = time.time()
+        for task in tasks:
+            thread.insert_task(task)
+        self.assertTrue(wait_tasks(tasks, timeout=5))
+        self.assertLess(time.time() - init_time, 0.6)
+        thread.insert_task(nfvo.new_task("exit", None, store=False))
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+
+
+class test_task_registry(unittest.TestCase):
+
+    def test_037_instance_progress(self):
+        thread, myvim = new_fake_thread(delay=0.2)
+        tasks = insert_instance_tasks(thread, 1)
+        nfvo.task_dict.set_instance_tasks("fake-instance", {t["id"]: t for t in tasks})
+        progress = nfvo.get_instance_progress(None, None, "fake-instance")
+        self.assertEqual(len(progress["running"]) + len(progress["pending"]), 2)
+        self.assertTrue(wait_tasks(tasks, timeout=5))
+        progress = nfvo.get_instance_progress(None, None, "fake-instance")
+        self.assertEqual(len(progress["done"]), 2)
+        thread.insert_task(nfvo.new_task("exit", None, store=False))
+        thread.join(5)
+
+    def test_038_task_registry_eviction(self):
+        registry = vim_tasks.task_registry(ttl=3600, max_size=2)
+        tasks = [nfvo.new_task("del-net", "net-{}".format(index), store=False) for index in range(0, 3)]
+        for task in tasks:
+            registry.add(task)
+        registry.get(tasks[0]["id"])
+        tasks[0]["status"] = tasks[1]["status"] = "done"
+        registry.purge()
+        # tasks[1] is the least recently used finished one; unfinished tasks are kept
+        self.assertIn(tasks[0]["id"], registry)
+        self.assertNotIn(tasks[1]["id"], registry)
+        self.assertIn(tasks[2]["id"], registry)
+        # a created element is kept until its result is written at database
+        registry.ttl = 0
+        create_task = nfvo.new_task("new-vm", ("vm",), store=False)
+        create_task["status"] = "done"
+        registry.add(create_task)
+        registry.purge()
+        self.assertIn(create_task["id"], registry)
+        create_task["persisted"] = True
+        registry.purge()
+        self.assertNotIn(create_task["id"], registry)
+
+    def test_039_task_registry_soak(self):
+        samples = soak_task_registry(100000)
+        for processed, stored, memory in samples:
+            self.assertLessEqual(stored, 1000 + vim_tasks.task_registry.purge_interval)
+        # memory is taken in the first 10% of the tasks; it does not grow afterwards more than a small margin
+        self.assertLess(samples[-1][2] - samples[1][2], 10240, str(samples))
+
+
+class test_task_results(unittest.TestCase):
+
+    def test_050_batched_result_writer(self):
+        db = fake_db()
+        writer = vim_tasks.task_result_writer(db, Lock(), window=0.05)
+        writer.start()
+        thread, myvim = new_fake_thread(workers=4, result_writer=writer)
+        tasks = insert_instance_tasks(thread, 100)
+        self.assertTrue(wait_tasks(tasks, timeout=5))
+        writer.close()
+        self.assertTrue(all(t.get("persisted") for t in tasks))
+        self.assertEqual(len(db.rows_updated), 200)
+        # results of 200 tasks are written with much less database commands
+        self.assertLess(db.updates, 20)
+        stats = writer.get_stats()
+        self.assertEqual(stats["rows"], 200)
+        self.assertGreater(stats["max_batch_size"], 10)
+        thread.insert_task(nfvo.new_task("exit", None, store=False))
+        thread.join(5)
+
+    def test_060_journal_crash_recovery(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            journal_file = os.path.join(temp_dir, "tasks.journal")
+            journal = vim_tasks.task_journal(journal_file, sync_interval=0.01)
+            journal.start_writer()
+            thread, myvim = new_fake_thread(delay=0.1, journal=journal)
+            tasks = insert_instance_tasks(thread, 3)
+            # crash while the second net is processing: copy the journal as it is at this moment
+            while tasks[1]["status"] != "processing":
+                time.sleep(0.01)
+            time.sleep(0.05)
+            shutil.copy(journal_file, journal_file + ".crash")
+            wait_tasks(tasks)
+            thread.insert_task(nfvo.new_task("exit", None, store=False))
+            thread.join()
+            journal.close()
+
+            # restart from the copied journal
+            os.rename(journal_file + ".crash", journal_file)
+            journal = vim_tasks.task_journal(journal_file, sync_interval=0.01)
+            journal_tasks = journal.load()
+            self.assertEqual([t["status"] for t in journal_tasks.values()],
+                             ["done", "processing", "enqueued", "enqueued", "enqueued", "enqueued"])
+            thread, myvim = new_fake_thread(journal=journal)
+            old_db, old_journal, old_threads = nfvo.db, nfvo.task_journal, nfvo.vim_threads["running"]
+            nfvo.db, nfvo.task_journal, nfvo.vim_threads["running"] = fake_db(), journal, {thread.thread_id: thread}
+            try:
+                nfvo.resume_journal_tasks(journal_tasks)
+                journal.start_writer()
+                with nfvo.task_lock:
+                    resumed = [nfvo.task_dict.get(task_id) for task_id in journal_tasks]
+                self.assertTrue(wait_tasks(resumed, timeout=5))
+                # the net being created is set to error, as well as the VM that uses it
+                self.assertEqual([t["status"] for t in resumed], ["done", "error", "done", "done", "error", "done"])
+                self.assertIn(("instance_nets", {"status": "VIM_ERROR", "error_msg": resumed[1]["result"]},
+                               {"vim_net_id": resumed[1]["id"]}), nfvo.db.rows_updated)
+                # the first VM is created at the net created before the crash
+                self.assertEqual(resumed[3]["params"][5][0]["net_id"], resumed[0]["result"])
+                thread.insert_task(nfvo.new_task("exit", None, store=False))
+                thread.join()
+                journal.close()
+            finally:
+                nfvo.db, nfvo.task_journal, nfvo.vim_threads["running"] = old_db, old_journal, old_threads
+            # after a new restart there is nothing to resume
+            journal = vim_tasks.task_journal(journal_file)
+            journal.start_writer()
+            journal.close()
+            self.assertFalse([t for t in journal.load().values() if t["status"] in ("enqueued", "processing")])
+        finally:
+            shutil.rmtree(temp_dir)
+
+
+class test_vim_executor(unittest.TestCase):
+
+    def test_070_vim_executor(self):
+        executor = vim_calls.vim_executor(workers=2)
+        init_time = time.time()
+        calls = [executor.submit(time.sleep, 0.2) for _ in range(0, 4)]
+        for call in calls:
+            call.get_result(5)
+        # at most 2 calls at the same time
+        self.assertGreater(time.time() - init_time, 0.35)
+        self.assertLessEqual(len(executor.threads), 2)
+        # a call that does not answer in time raises a timeout, the rest are not affected
+        slow = executor.submit(time.sleep, 1)
+        with self.assertRaises(vimconn.vimconnConnectionException) as context:
+            slow.get_result(0.1)
+        self.assertEqual(context.exception.http_code, vimconn.HTTP_Request_Timeout)
+        self.assertEqual(executor.map(lambda x: x * 2, (1, 2, 3), timeout=5), [(2, None), (4, None), (6, None)])
+        executor.close()
+
+    def test_075_vim_executor_per_vim(self):
+        executor = vim_calls.vim_executor(workers=4, vim_workers=2)
+        hung = threading.Event()
+        dead_calls = [executor.submit_at("dead", hung.wait, 10) for _ in range(0, 5)]
+        for call in dead_calls:
+            with self.assertRaises(vimconn.vimconnConnectionException):
+                call.get_result(0.1)
+        # the dead VIM takes only 2 threads; the healthy one is not delayed by it
+        init_time = time.time()
+        calls = [executor.submit_at("alive", time.sleep, 0.2) for _ in range(0, 2)]
+        for call in calls:
+            call.get_result(1)
+        self.assertLess(time.time() - init_time, 0.35)
+        self.assertEqual(executor.running["dead"], 2)
+        # the calls abandoned before starting are not run once the VIM answers
+        hung.set()
+        time.sleep(0.1)
+        self.assertNotIn("dead", executor.running)
+        self.assertEqual(sum(1 for call in dead_calls if call.result), 2)
+        executor.close()
+
+
+class test_status_refresh(unittest.TestCase):
+
+    def setUp(self):
+        self.old_global_config = nfvo.global_config
+        nfvo.global_config = {}
+
+    def tearDown(self):
+        nfvo.global_config = self.old_global_config
+
+    def test_080_refresh_instance_in_parallel(self):
+        vims = {"dc1": vimconnector(delay=0.3), "dc2": vimconnector(delay=0.3),
+                "dead": vimconnector(delay=3, config={"vim_timeout": 0.5})}
+        instance = {"uuid": "fake-instance", "vnfs": [], "nets": []}
+        for datacenter_id in vims:
+            instance["vnfs"].append({"datacenter_id": datacenter_id, "datacenter_tenant_id": "dt", "vms": [
+                {"uuid": "vm-" + datacenter_id, "vim_vm_id": "vim-vm-" + datacenter_id, "status": "BUILD",
+                 "interfaces": []}]})
+            instance["nets"].append({"uuid": "net-" + datacenter_id, "vim_net_id": "vim-net-" + datacenter_id,
+                                     "datacenter_id": datacenter_id, "datacenter_tenant_id": "dt",
+                                     "status": "BUILD"})
+        old_get_vim = nfvo.get_vim
+        nfvo.get_vim = lambda mydb, nfvo_tenant, datacenter_id=None, datacenter_tenant_id=None, **kwargs: \
+            {datacenter_id: vims[datacenter_id]}
+        try:
+            init_time = time.time()
+            nfvo.refresh_instance(fake_db(), "fake-tenant", instance)
+            elapsed = time.time() - init_time
+        finally:
+            nfvo.get_vim = old_get_vim
+        # the VMs and nets of all the datacenters are refreshed at the same time, and the dead one does not wait
+        # more than its vim_timeout
+        self.assertLess(elapsed, 1)
+        for element in instance["vnfs"][0]["vms"] + instance["vnfs"][1]["vms"] + instance["vnfs"][2]["vms"] + \
+                instance["nets"]:
+            if element["uuid"].endswith("dead"):
+                self.assertEqual(element["status"], "VIM_ERROR")
+            else:
+                self.assertEqual(element["status"], "ACTIVE")
+
+    def test_085_refresh_not_resent_to_hung_vim(self):
+        myvim = vimconnector(delay=1, config={"vim_timeout": 0.2})
+        instance = {"uuid": "fake-instance", "nets": [], "vnfs": [
+            {"datacenter_id": "hung", "datacenter_tenant_id": "dt", "vms": [
+                {"uuid": "vm-hung", "vim_vm_id": "vim-vm-hung", "status": "ACTIVE", "interfaces": []}]}]}
+        old_get_vim = nfvo.get_vim
+        nfvo.get_vim = lambda mydb, nfvo_tenant, datacenter_id=None, datacenter_tenant_id=None, **kwargs: \
+            {datacenter_id: myvim}
+        try:
+            for _ in range(0, 3):
+                nfvo.refresh_instance(fake_db(), "fake-tenant", instance)
+                self.assertEqual(instance["vnfs"][0]["vms"][0]["status"], "VIM_ERROR")
+            # the VIM is asked once while it does not answer
+            self.assertEqual(myvim.index, 1)
+            time.sleep(1)
+            nfvo.refresh_instance(fake_db(), "fake-tenant", instance)
+            self.assertEqual(myvim.index, 2)
+        finally:
+            nfvo.get_vim = old_get_vim
+
+    def test_090_status_poller(self):
+        db = fake_db()
+        for datacenter_id, status in (("dc1", "ACTIVE"), ("dc2", "BUILD")):
+            db.instances.append({"uuid": "instance-" + datacenter_id, "nets": [], "vnfs": [
+                {"datacenter_id": datacenter_id, "datacenter_tenant_id": "dt", "vms": [
+                    {"uuid": "vm-" + datacenter_id, "vim_vm_id": "vim-vm-" + datacenter_id, "status": status}]}]})
+        refreshed = []
+        results = []    # (result, message) to return by the next refreshes, by default (0, "refreshed")
+
+        def refresh(mydb, nfvo_tenant, instance_dict):
+            refreshed.append(instance_dict)
+            return results.pop(0) if results else (0, "refreshed")
+        poller = status_poller.status_poller(db, refresh, interval=60, build_interval=5)
+        # first pass refreshes all the datacenters at once
+        wait = poller.refresh_due()
+        self.assertEqual(len(refreshed), 1)
+        self.assertEqual(len(refreshed[0]["vnfs"]), 2)
+        # the datacenter with elements being built is refreshed sooner
+        self.assertLessEqual(wait, 5)
+        self.assertGreater(poller.next_refresh["dc1"] - poller.next_refresh["dc2"], 50)
+        last_refreshed = poller.get_last_refreshed(db.instances[0])
+        self.assertIsNotNone(last_refreshed)
+        # nothing is due now
+        poller.refresh_due()
+        self.assertEqual(len(refreshed), 1)
+        poller.next_refresh["dc2"] = 0
+        poller.refresh_due()
+        self.assertEqual(len(refreshed), 2)
+        self.assertEqual([sce_vnf["datacenter_id"] for sce_vnf in refreshed[1]["vnfs"]], ["dc2"])
+        # only the elements of the due datacenters are loaded from database
+        self.assertEqual(db.loaded_datacenters, [["dc1", "dc2"], ["dc2"]])
+        # a refresh on demand is newer than the background one
+        poller.set_refreshed("instance-dc1", last_refreshed + 10)
+        self.assertEqual(poller.get_last_refreshed(db.instances[0]), last_refreshed + 10)
+        # an instance at a datacenter not refreshed yet has not a last_refreshed time
+        instance = {"uuid": "instance-dc3", "nets": [{"datacenter_id": "dc3"}], "vnfs": []}
+        self.assertIsNone(poller.get_last_refreshed(instance))
+        # elements not updated at database are refreshed again soon, keeping the last good refresh time
+        results.append((1, "Scenario instance status_poller refreshed but some elements could not be updated"))
+        poller.next_refresh["dc1"] = 0
+        dc1_refreshed = poller.refreshed["dc1"]
+        poller.refresh_due()
+        self.assertEqual(len(refreshed), 3)
+        self.assertEqual(poller.refreshed["dc1"], dc1_refreshed)
+        self.assertLessEqual(poller.next_refresh["dc1"], time.time() + 5)
+        # the background thread refreshes the woken datacenters
+        poller.build_interval = 0.1
+        poller.start()
+        poller.wake(["dc1"])
+        time.sleep(0.5)
+        poller.close()
+        self.assertIn("dc1", [sce_vnf["datacenter_id"] for sce_vnf in refreshed[-1]["vnfs"]])
+
+    def test_095_poller_skips_elements_being_created(self):
+        myvim = deleting_vimconnector(known=("vim-vm-1",))
+        myvim.id = "dc1"
+        db = fake_db()
+        db.instances.append({"uuid": "instance-1", "nets": [], "vnfs": [
+            {"datacenter_id": "dc1", "datacenter_tenant_id": "dt", "vms": []}]})
+        vms = db.instances[0]["vnfs"][0]["vms"]
+        vms.append({"uuid": "vm-1", "vim_vm_id": "vim-vm-1", "status": "BUILD", "interfaces": []})
+        old_get_vim = nfvo.get_vim
+        nfvo.get_vim = lambda mydb, nfvo_tenant, datacenter_id=None, datacenter_tenant_id=None, **kwargs: \
+            {datacenter_id: myvim}
+        poller = status_poller.status_poller(db, nfvo.refresh_instance, interval=60, build_interval=5)
+        thread = vim_thread.vim_thread(myvim, nfvo.task_lock, "fake-thread", "fake", "fake-dt", db=db,
+                                       db_lock=Lock(), poller=poller)
+        thread.daemon = True
+        thread.start()
+        try:
+            task = nfvo.new_task("new-vm", ("vm-2", None, True, "image", "flavor", [], None, None), store=False)
+            vms.append({"uuid": "vm-2", "vim_vm_id": task["id"], "status": "BUILD", "interfaces": []})
+            poller.refresh_due()
+            # the VM still given by its task id is not asked to the VIM, nor reported as DELETED
+            self.assertEqual(myvim.refreshed, [["vim-vm-1"]])
+            self.assertEqual(vms[1]["status"], "BUILD")
+            self.assertNotIn("DELETED", [update.get("status") for table, update, where in db.rows_updated])
+            self.assertGreater(poller.next_refresh["dc1"], time.time())
+            # once created, its VIM id is written and the datacenter is refreshed right away
+            thread.insert_task(task)
+            self.assertTrue(wait_tasks((task,), timeout=5))
+            self.assertLessEqual(poller.next_refresh["dc1"], time.time())
+            vms[1]["vim_vm_id"] = task["result"]
+            poller.refresh_due()
+            self.assertEqual(myvim.refreshed[-1], ["vim-vm-1", task["result"]])
+            self.assertEqual(vms[1]["status"], "ACTIVE")
+        finally:
+            nfvo.get_vim = old_get_vim
+            thread.insert_task(nfvo.new_task("exit", None, store=False))
+            thread.join(5)
+
+    def test_100_refresh_unchanged_elements(self):
+        myvim = vimconnector()
+        myvim.name = "dc1"
+        instance = {"uuid": "fake-instance", "vnfs": [{"datacenter_id": "dc1", "datacenter_tenant_id": "dt", "vms": [
+            {"uuid": "vm-1", "vim_vm_id": "vim-vm-1", "status": "BUILD", "interfaces": []}]}],
+            "nets": [{"uuid": "net-1", "vim_net_id": "vim-net-dc1", "datacenter_id": "dc1",
+                      "datacenter_tenant_id": "dt", "status": "BUILD"}]}
+        old_get_vim = nfvo.get_vim
+        nfvo.get_vim = lambda mydb, nfvo_tenant, **kwargs: {"dc1": myvim}
+        try:
+            db = fake_db()
+            nfvo.refresh_instance(db, "fake-tenant", instance)
+            # VM, its interface and net are written, with the vim_info text
+            self.assertEqual(db.updates, 3)
+            self.assertIn("status: ACTIVE", instance["vnfs"][0]["vms"][0]["vim_info"])
+            self.assertIn("port-vim-vm-1", db.rows_updated[1][1]["vim_info"])
+            # the interface as loaded from database next time
+            instance["vnfs"][0]["vms"][0]["interfaces"] = [{"vim_interface_id": "port-vim-vm-1",
+                                                            "mac_address": "fa:16:3e:00:00:01", "ip_address": None,
+                                                            "type": "bridge"}]
+            # the same status again is neither dumped nor written
+            vim_infos = []
+            original_refresh = myvim.refresh_vms_status
+
+            def refresh_vms_status(vm_list):
+                vm_dict = original_refresh(vm_list)
+                vim_infos.append(vm_dict["vim-vm-1"]["vim_info"])
+                return vm_dict
+            myvim.refresh_vms_status = refresh_vms_status
+            db = fake_db()
+            nfvo.refresh_instance(db, "fake-tenant", instance)
+            self.assertEqual(db.updates, 0)
+            self.assertIsNone(vim_infos[0]._text)
+            # an interface that differs at database is written again, although the VIM gives the same
+            instance["vnfs"][0]["vms"][0]["interfaces"][0]["mac_address"] = None
+            db = fake_db()
+            nfvo.refresh_instance(db, "fake-tenant", instance)
+            self.assertEqual(db.updates, 1)
+            self.assertEqual(db.rows_updated[0][0], "instance_interfaces")
+        finally:
+            nfvo.get_vim = old_get_vim
+            nfvo.refresh_fingerprints.forget(("vm-1", "net-1", ("vm-1", "port-vim-vm-1")))
+
+    def test_105_fingerprint_cache(self):
+        cache = vim_caches.fingerprint_cache(max_size=100)
+        for index in range(0, 150):
+            cache.set("vm-{}".format(index), "fingerprint-{}".format(index))
+            cache.get("vm-0")
+        # bounded, evicting the least recently used
+        self.assertEqual(len(cache), 100)
+        self.assertEqual(cache.evictions, 50)
+        self.assertEqual(cache.get("vm-0"), "fingerprint-0")
+        self.assertIsNone(cache.get("vm-1"))
+        self.assertEqual(cache.get("vm-149"), "fingerprint-149")
+        cache.forget(("vm-0", "vm-149", "unknown"))
+        self.assertEqual(len(cache), 98)
+        # used by several threads at the same time
+        cache = vim_caches.fingerprint_cache(max_size=1000)
+
+        def refresh(thread_index):
+            for index in range(0, 2000):
+                key = "vm-{}".format(index % 1500)
+                if cache.get(key) is None:
+                    cache.set(key, str(thread_index))
+        threads = [threading.Thread(target=refresh, args=(thread_index,)) for thread_index in range(0, 8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(cache), 1000)
+        self.assertEqual(len(cache.fingerprints), 1000)
+
+
+class test_connector_cache(unittest.TestCase):
+
+    def test_110_get_vim_connector_cache(self):
+        db = new_fake_datacenter_db()
+        old_vim_cache = nfvo.vim_cache
+        nfvo.vim_cache = vim_caches.connector_cache(idle=600)
+        try:
+            logins = counting_vimconnector.logins
+            myvim = nfvo.get_vim(db, "fake-tenant", datacenter_id="fake-dc")["fake-dc"]
+            self.assertEqual(myvim.config["vim_timeout"], 5)
+            for _ in range(0, 1000):
+                self.assertIs(nfvo.get_vim(db, "fake-tenant", datacenter_id="fake-dc")["fake-dc"], myvim)
+            self.assertEqual(counting_vimconnector.logins - logins, 1)
+            # new credentials at database gives a new connector
+            db.datacenters[0]["passwd"] = "new-passwd"
+            self.assertIsNot(nfvo.get_vim(db, "fake-tenant", datacenter_id="fake-dc")["fake-dc"], myvim)
+            self.assertEqual(counting_vimconnector.logins - logins, 2)
+            # invalidated, as when the datacenter is edited
+            nfvo.vim_cache.invalidate("fake-dc")
+            nfvo.get_vim(db, "fake-tenant", datacenter_id="fake-dc")
+            self.assertEqual(counting_vimconnector.logins - logins, 3)
+            # idle entries are evicted
+            nfvo.vim_cache.idle = 0.01
+            time.sleep(0.02)
+            nfvo.vim_cache.last_eviction = 0
+            nfvo.get_vim(db, "fake-tenant", datacenter_id="fake-dc")
+            self.assertEqual(counting_vimconnector.logins - logins, 4)
+            self.assertEqual(nfvo.vim_cache.get_stats()["evictions"], 1)
+        finally:
+            nfvo.vim_cache = old_vim_cache
+
+
+class test_provisioning(unittest.TestCase):
+
+    def setUp(self):
+        self.old_global_config = nfvo.global_config
+        nfvo.global_config = {}
+
+    def tearDown(self):
+        nfvo.global_config = self.old_global_config
+
+    def test_120_provisioning_in_parallel(self):
+        vims = collections.OrderedDict(("dc{}".format(index), provisioning_vimconnector(delay=0.2))
+                                       for index in range(0, 5))
+        db = provisioning_db()
+        image_dict = {"name": "image", "location": "/images/image.qcow2", "metadata": None, "universal_name": None,
+                      "checksum": None}
+        rollback_list = []
+        init_time = time.time()
+        image_id = nfvo.create_or_use_image(db, vims, image_dict, rollback_list)
+        # the datacenters are provisioned at the same time, not one after the other
+        self.assertLess(time.time() - init_time, 0.6)
+        self.assertEqual(rollback_list[0], {"where": "mano", "what": "image", "uuid": image_id})
+        self.assertEqual([(item["vim_id"], item["uuid"]) for item in rollback_list[1:]],
+                         [(datacenter_id, vim.images[image_dict["location"]]) for datacenter_id, vim in vims.items()])
+        self.assertEqual(len(db.get_rows(FROM="datacenters_images", WHERE={"image_id": image_id})), 5)
+        # the checksum computed while uploading is stored
+        self.assertEqual(db.get_rows(FROM="images", WHERE={"uuid": image_id})[0]["checksum"],
+                         "md5-/images/image.qcow2")
+        self.assertIsNone(image_dict["checksum"])
+
+        # a flavor with an image at a device uses at each VIM its own image
+        flavor_dict = {"name": "flavor", "ram": 1024, "vcpus": 1, "extended": {"devices": [
+            {"type": "disk", "image": "/images/disk.qcow2", "size": 2}, {"type": "disk", "size": 1}]}}
+        rollback_list = []
+        flavor_id = nfvo.create_or_use_flavor(db, vims, flavor_dict, rollback_list)
+        self.assertEqual(len(db.get_rows(FROM="images")), 2)
+        for datacenter_id, vim in vims.items():
+            flavor_data = vim.flavors.values()[0]
+            self.assertEqual(flavor_data["extended"]["devices"][0]["imageRef"], vim.images["/images/disk.qcow2"])
+            self.assertNotIn("image", flavor_data["extended"]["devices"][0])
+            flavor_row = db.get_rows(FROM="datacenters_flavors", WHERE={"datacenter_id": datacenter_id,
+                                                                         "flavor_id": flavor_id})[0]
+            self.assertEqual(yaml.load(flavor_row["extended"])["disks"],
+                             [{"image_id": vim.images["/images/disk.qcow2"], "size": 2}, {"size": 1}])
+        self.assertEqual(len(rollback_list), 1 + 5 + 1 + 5)   # mano image, vim images, mano flavor, vim flavors
+
+        # a failing VIM raises, but the rollback entries of the others are kept
+        vims["dc2"].fail = True
+        rollback_list = []
+        image_dict = dict(image_dict, location="/images/other.qcow2", name="other")
+        with self.assertRaises(vimconn.vimconnException):
+            nfvo.create_or_use_image(db, vims, dict(image_dict, uuid="other-uuid"), rollback_list,
+                                     only_create_at_vim=True)
+        self.assertEqual([item["vim_id"] for item in rollback_list], ["dc0", "dc1", "dc3", "dc4"])
+        self.assertEqual(nfvo.rollback(db, vims, rollback_list)[0], True)
+        for datacenter_id in ("dc0", "dc1", "dc3", "dc4"):
+            self.assertEqual(vims[datacenter_id].deleted, [vims[datacenter_id].images["/images/other.qcow2"]])
+
+    def test_125_provisioning_slower_than_vim_timeout(self):
+        # the status refresh timeout does not cut the provisioning, e.g. a long image upload
+        nfvo.global_config = {"vim_timeout": 0.05}
+        vims = collections.OrderedDict(("dc{}".format(index), provisioning_vimconnector(delay=0.2))
+                                       for index in range(0, 3))
+        db = provisioning_db()
+        image_dict = {"name": "image", "location": "/images/image.qcow2", "metadata": None, "universal_name": None,
+                      "checksum": None, "uuid": "image-uuid"}
+        rollback_list = []
+        nfvo.create_or_use_image(db, vims, image_dict, rollback_list, only_create_at_vim=True)
+        self.assertEqual([item["vim_id"] for item in rollback_list], ["dc0", "dc1", "dc2"])
+        self.assertEqual(len(db.get_rows(FROM="datacenters_images", WHERE={"image_id": "image-uuid"})), 3)
+        # without return_on_error a failing VIM is logged and skipped, as the other ones are provisioned
+        vims["dc1"].fail = True
+        rollback_list = []
+        image_dict = dict(image_dict, location="/images/other.qcow2", name="other", uuid="other-uuid")
+        self.assertIsNotNone(nfvo.create_or_use_image(db, vims, image_dict, rollback_list, only_create_at_vim=True,
+                                                      return_on_error=False))
+        self.assertEqual([item["vim_id"] for item in rollback_list], ["dc0", "dc2"])
+
+    def test_130_image_cache(self):
+        server = image_server()
+        cache_dir = tempfile.mkdtemp()
+        try:
+            cache = vim_caches.image_cache(cache_dir, max_size=3 * 1024 * 1024, chunk_size=65536)
+            url, md5 = server.add_image("image.qcow2", 1024 * 1024)
+            # concurrent requests of the same image download it once
+            executor = vim_calls.vim_executor(workers=5)
+            results = executor.map(cache.get, [url] * 5, timeout=30)
+            executor.close()
+            self.assertEqual(server.requests, 1)
+            for result, exception in results:
+                self.assertIsNone(exception)
+                self.assertEqual(result, (os.path.join(cache_dir, md5), md5))
+            with open(results[0][0][0], "rb") as f:
+                self.assertEqual(hashlib.md5(f.read()).hexdigest(), md5)
+            # found by checksum, without downloading it
+            self.assertEqual(cache.get(server.url + "other-name.qcow2", md5)[1], md5)
+            self.assertEqual(server.requests, 1)
+            # a wrong checksum is not cached
+            url2, md5_2 = server.add_image("image2.qcow2", 1024 * 1024)
+            with self.assertRaises(vimconn.vimconnException):
+                cache.get(url2, "0" * 32)
+            self.assertEqual(cache.get_stats()["files"], 1)
+            with self.assertRaises(vimconn.vimconnConnectionException):
+                cache.get(server.url + "missing.qcow2")
+            # the least recently used are evicted
+            cache.get(url2)
+            time.sleep(0.01)
+            cache.get(url)
+            url3, md5_3 = server.add_image("image3.qcow2", 2 * 1024 * 1024)
+            cache.get(url3)
+            self.assertEqual(sorted(cache.files.keys()), sorted([md5, md5_3]))
+            self.assertFalse(os.path.exists(os.path.join(cache_dir, md5_2)))
+            self.assertEqual(cache.get_stats()["evictions"], 1)
+            # loaded from the index after a restart, discarding the truncated files
+            with open(os.path.join(cache_dir, md5_3), "ab") as f:
+                f.write("x")
+            cache = vim_caches.image_cache(cache_dir, max_size=3 * 1024 * 1024)
+            self.assertEqual(cache.files.keys(), [md5])
+            requests = server.requests
+            self.assertEqual(cache.get(url)[1], md5)
+            self.assertEqual(server.requests, requests)
+
+            # the image given by URL is downloaded once and uploaded to all the VIMs from the cache
+            old_image_cache = nfvo.image_cache
+            nfvo.image_cache = cache
+            try:
+                vims = collections.OrderedDict(("dc{}".format(index), provisioning_vimconnector())
+                                               for index in range(0, 3))
+                db = provisioning_db()
+                image_dict = {"name": "image", "location": url2, "metadata": None, "universal_name": None,
+                              "checksum": None}
+                image_id = nfvo.create_or_use_image(db, vims, image_dict, [])
+            finally:
+                nfvo.image_cache = old_image_cache
+            self.assertEqual(server.requests, requests + 1)
+            for vim in vims.values():
+                self.assertEqual(vim.local_path, os.path.join(cache_dir, md5_2))
+            self.assertEqual(db.get_rows(FROM="images", WHERE={"uuid": image_id})[0]["checksum"], md5_2)
+        finally:
+            server.close()
+            shutil.rmtree(cache_dir)
+
+
+class test_delete_and_rollback(unittest.TestCase):
+
+    def setUp(self):
+        self.old_global_config = nfvo.global_config
+        nfvo.global_config = {}
+
+    def tearDown(self):
+        nfvo.global_config = self.old_global_config
+
+    def test_140_delete_retries(self):
+        myvim = failing_vimconnector(failures={"vm-1": 2, "vm-2": 5}, missing=("vm-3",))
+        thread = vim_thread.vim_thread(myvim, nfvo.task_lock, "fake-thread", "fake", "fake-dt", db=fake_db(),
+                                       db_lock=Lock(), workers=2, delete_retries=3, delete_retry_delay=0.05)
+        thread.daemon = True
+        thread.start()
+        vm_tasks = {}
+        for vm_id in ("vm-1", "vm-2", "vm-3"):
+            task = nfvo.new_task("del-vm", vm_id)
+            vm_tasks[task["id"]] = task
+        net_task = nfvo.new_task("del-net", "net-1", depends=dict(vm_tasks))
+        operation = nfvo.new_operation("delete")
+        instance_tasks = dict(vm_tasks)
+        instance_tasks[net_task["id"]] = net_task
+        with nfvo.task_lock:
+            nfvo.task_dict.set_instance_tasks("fake-deleted-instance", instance_tasks, operation)
+        for task in vm_tasks.values() + [net_task]:
+            thread.insert_task(task)
+        progress = nfvo.get_instance_progress(None, None, operation["id"])
+        self.assertEqual(progress["instance_id"], "fake-deleted-instance")
+        self.assertEqual(progress["operation"]["name"], "delete")
+        self.assertFalse(progress["completed"])
+        self.assertTrue(wait_tasks(instance_tasks.values(), timeout=5))
+        progress = nfvo.get_instance_progress(None, None, operation["id"])
+        self.assertTrue(progress["completed"])
+        # vm-1 succeeds at the third try, 0.05 + 0.1 seconds later; vm-2 fails after 3 retries and vm-3 was missing
+        tasks = {task["params"]: task for task in instance_tasks.values()}
+        self.assertEqual((tasks["vm-1"]["status"], tasks["vm-1"]["retries"]), ("done", 2))
+        self.assertEqual((tasks["vm-2"]["status"], tasks["vm-2"]["retries"]), ("error", 3))
+        self.assertEqual(tasks["vm-3"]["status"], "done")
+        self.assertEqual([task["id"] for task in progress["failed"]], [tasks["vm-2"]["id"]])
+        self.assertEqual(progress["failed"][0]["retries"], 3)
+        # the net is deleted after the VMs, without waiting for them at a worker
+        self.assertEqual(tasks["net-1"]["status"], "done")
+        self.assertGreater(myvim.started["net-1"], myvim.started["vm-1"])
+        thread.insert_task(nfvo.new_task("exit", None, store=False))
+        thread.join(5)
+
+    def test_150_rollback(self):
+        vims = collections.OrderedDict()
+        db = provisioning_db()
+        rollback_list = [{"where": "mano", "what": "image", "uuid": "image-mano"},
+                         {"where": "mano", "what": "flavor", "uuid": "flavor-mano"}]
+        for index in range(0, 3):
+            datacenter_id = "dc{}".format(index)
+            vims[datacenter_id] = failing_vimconnector(failures={"network-dc2": 1}, missing=("image-dc1",))
+            vims[datacenter_id].delay = 0.2
+            for what in ("image", "flavor"):
+                db.new_row("datacenters_{}s".format(what), {"datacenter_id": datacenter_id,
+                                                            what + "_id": what + "-mano",
+                                                            "vim_id": "{}-{}".format(what, datacenter_id)})
+            rollback_list += [{"where": "vim", "vim_id": datacenter_id, "what": what,
+                               "uuid": "{}-{}".format(what, datacenter_id)}
+                              for what in ("image", "flavor", "network", "vm")]
+            rollback_list.append({"where": "vim", "vim_id": datacenter_id, "what": "vm",
+                                  "uuid": "vm2-" + datacenter_id})
+        db.new_row("images", {"uuid": "image-mano"})
+        db.new_row("flavors", {"uuid": "flavor-mano"})
+        # a datacenter no longer available, a task not started yet and a task already done
+        rollback_list.append({"where": "vim", "vim_id": "dc9", "what": "vm", "uuid": "vm-dc9"})
+        enqueued_task = nfvo.new_task("new-vm", None)
+        done_task = nfvo.new_task("new-vm", None)
+        done_task.update(status="done", result="vm-task")
+        rollback_list += [{"where": "vim", "vim_id": "dc0", "what": "vm", "uuid": task["id"]}
+                          for task in (enqueued_task, done_task)]
+
+        report = nfvo.rollback_report(db, vims, rollback_list)
+        # each kind is deleted concurrently at all the VIMs, 0.2 seconds per kind instead of 0.2 per element
+        self.assertLess(report["seconds"], 1.5)
+        started = {}
+        for vim in vims.values():
+            started.update(vim.started)
+        self.assertLess(max(started["vm-" + dc] for dc in vims), min(started["network-" + dc] for dc in ("dc0", "dc1")))
+        self.assertLess(started["network-dc0"], started["flavor-dc0"])
+        self.assertIn("vm-task", vims["dc0"].started)
+        self.assertEqual(enqueued_task["status"], "deleted")
+        self.assertEqual([item["uuid"] for item in report["failed"]], ["network-dc2"])
+        self.assertIn("fake error", report["failed"][0]["error"])
+        self.assertEqual(sorted((item["uuid"], item["reason"]) for item in report["skipped"]),
+                         sorted([("vm-dc9", "datacenter not available"), (enqueued_task["id"], "not created")]))
+        self.assertEqual(len(report["deleted"]), 3 * 5 - 1 + 1 + 2)
+        # the not found image is deleted from the database too; one command per table
+        self.assertEqual(db.tables["datacenters_images"], [])
+        self.assertEqual(db.tables["datacenters_flavors"], [])
+        self.assertEqual(db.tables["images"], [])
+        self.assertEqual(db.tables["flavors"], [])
+        self.assertEqual(db.deletions, 3 * 2 + 2)
+        # rollback keeps its result and message
+        vims["dc2"].failures["network-dc2"] = 1
+        result, message = nfvo.rollback(db, vims, [{"where": "vim", "vim_id": "dc2", "what": "network",
+                                                    "uuid": "network-dc2"}])
+        self.assertEqual(result, False)
+        self.assertIn("network network-dc2 from VIM", message)
+
+
+if __name__=="__main__":
+    parser = OptionParser()
+    parser.add_option("-v", '--version', help='Show current version', dest='version', action="store_true",
+                      default=False)
+    parser.add_option('--debug', help='Set logs to debug level', dest='debug', action="store_true", default=False)
+    parser.add_option('--benchmark', help='Run the benchmarks instead of the tests', dest='benchmark',
+                      action="store_true", default=False)
+    parser.add_option('-n', '--number', dest='number', type="int", default=1000,
+                      help='Number of tasks used by the benchmarks. By default 1000')
+    parser.add_option('--workers', dest='workers', default="1,2,4,8",
+                      help='Comma separated list of vim_thread_workers for the throughput benchmark. By default 1,2,4,8')
+    parser.add_option('--delay', dest='delay', type="float", default=0.02,
+                      help='Seconds the fake VIM spends at each operation for the throughput benchmark. '
+                           'By default 0.02')
+    (options, args) = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s %(name)s %(levelname)s: %(message)s",
+                        level=logging.DEBUG if options.debug else logging.WARNING)
+    logger.setLevel(logging.INFO)
+    if options.version:
+        print sys.argv[0], __version__ + " version", version_date
+        sys.exit(0)
+
+    if options.benchmark:
+        result = benchmark_dispatch_latency(options.number)
+        print "enqueue to start latency for {} tasks (microseconds): p50={:.0f} p90={:.0f} p99={:.0f} " \
+              "max={:.0f}".format(options.number, result["p50"], result["p90"], result["p99"], result["max"])
+        for processed, stored, memory in soak_task_registry(options.number * 100):
+            print "task registry after {} tasks: {} stored, {} KB max resident memory".format(processed, stored, memory)
+        for idle in (0, 600):
+            logins, elapsed = benchmark_get_vim(options.number, idle)
+            print "get_vim {} times with vim_cache_idle {}: {} VIM logins, {:.3f}s".format(options.number, idle,
+                                                                                        logins, elapsed)
+        for workers in options.workers.split(","):
+            rate = benchmark_throughput(options.number / 2, int(workers), options.delay)
+            print "throughput for {} nets and VMs, {}s per VIM operation, {} workers: {:.1f} tasks/s".format(
+                options.number / 2, options.delay, workers, rate)
+        sys.exit(0)
+
+    suite = unittest.TestSuite()
+    for test_case in (test_vim_thread_dispatch, test_task_registry, test_task_results, test_vim_executor,
+                      test_status_refresh, test_connector_cache, test_provisioning, test_delete_and_rollback):
+        suite.addTest(unittest.TestLoader().loadTestsFromTestCase(test_case))
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    sys.exit(0 if result.wasSuccessful() else 1)
@@ -0,0 +1,743 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+
+##
+# Copyright 2015 Telefónica Investigación y Desarrollo, S.A.U.
+# This file is part of openmano
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# For those usages not covered by the Apache License, Version 2.0 please
+# contact with: nfvlabs@tid.es
+##
+
+'''
+Module for testing the openstack connector without an openstack. The nova and neutron clients of vimconn_openstack are
+replaced by local stubs that keep the VMs, ports, floating ips, networks and subnets in memory and count the API calls
+received. The client classes are also replaced for testing the clients shared among connectors.
+The openstack client libraries must be installed, as vimconn_openstack imports them.
+'''
+__version__="0.0.1"
+version_date="Oct 2026"
+
+import os
+import sys
+import logging
+import yaml
+import hashlib
+import tempfile
+import threading
+import time
+import unittest
+from optparse import OptionParser
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import vimconn
+import vimconn_openstack
+from novaclient import exceptions as nvExceptions
+import glanceclient.exc as gl1Exceptions
+
+global logger
+logger = logging.getLogger("test_vimconn_openstack")
+
+
+class api_counter(object):
+    '''Counts the calls to each API method'''
+    def __init__(self):
+        self.calls = {}
+
+    def count(self, method):
+        self.calls[method] = self.calls.get(method, 0) + 1
+
+    def total(self):
+        return sum(self.calls.values())
+
+
+class fake_server(object):
+    def __init__(self, server):
+        self.id = server["id"]
+        self.server = server
+
+    def to_dict(self):
+        return dict(self.server)
+
+
+class fake_nova_servers(object):
+    '''Lists the servers by pages of at most 'max_limit', as nova does'''
+    def __init__(self, counter, servers, max_limit=1000):
+        self.counter = counter
+        self.servers = servers      # id: server dictionary
+        self.max_limit = max_limit
+
+    def list(self, detailed=True, search_opts=None, marker=None, limit=None):
+        self.counter.count("servers.list")
+        server_ids = sorted(self.servers.keys())
+        start = server_ids.index(marker) + 1 if marker else 0
+        limit = min(limit or self.max_limit, self.max_limit)
+        return [fake_server(self.servers[server_id]) for server_id in server_ids[start:start + limit]]
+
+    def find(self, id):
+        self.counter.count("servers.find")
+        if id not in self.servers:
+            raise nvExceptions.NotFound(404, "No Server matching {}".format(id))
+        return fake_server(self.servers[id])
+
+
+class fake_flavor(object):
+    def __init__(self, counter, flavor_id, name, ram, vcpus, disk, keys=None):
+        self.counter = counter
+        self.id = flavor_id
+        self.name = name
+        self.ram = ram
+        self.vcpus = vcpus
+        self.disk = disk
+        self.keys = keys or {}
+
+    def get_keys(self):
+        self.counter.count("flavor.get_keys")
+        return dict(self.keys)
+
+    def set_keys(self, keys):
+        self.counter.count("flavor.set_keys")
+        self.keys.update(keys)
+
+
+class fake_nova_flavors(object):
+    def __init__(self, counter):
+        self.counter = counter
+        self.flavors = []
+
+    def list(self):
+        self.counter.count("flavors.list")
+        return list(self.flavors)
+
+    def create(self, name, ram, vcpus, disk, is_public=True):
+        self.counter.count("flavors.create")
+        flavor = fake_flavor(self.counter, "flavor-{}".format(len(self.flavors)), name, ram, vcpus, disk)
+        self.flavors.append(flavor)
+        return flavor
+
+    def delete(self, flavor_id):
+        self.counter.count("flavors.delete")
+        self.flavors = [flavor for flavor in self.flavors if flavor.id != flavor_id]
+
+
+class fake_images(object):
+    def __init__(self, counter, images):
+        self.counter = counter
+        self.images = images
+
+    def list(self):
+        self.counter.count("images.list")
+        return iter([dict(image) for image in self.images])
+
+    def delete(self, image_id):
+        self.counter.count("images.delete")
+        self.images[:] = [image for image in self.images if image["id"] != image_id]
+
+
+class fake_glance(object):
+    def __init__(self, counter, images):
+        self.images = fake_images(counter, images)
+
+
+class fake_nova(object):
+    def __init__(self, counter, servers):
+        self.servers = fake_nova_servers(counter, servers)
+        self.flavors = fake_nova_flavors(counter)
+        self.images = None
+
+
+class fake_neutron(object):
+    def __init__(self, counter, ports, floating_ips, networks=(), subnets=()):
+        self.counter = counter
+        self.ports = ports
+        self.floating_ips = floating_ips
+        self.networks = list(networks)
+        self.subnets = list(subnets)
+
+    @staticmethod
+    def _filter(items, filter_dict):
+        return [item for item in items if all(item.get(k) in v if isinstance(v, list) else item.get(k) == v
+                                              for k, v in filter_dict.items())]
+
+    def list_ports(self, **filter_dict):
+        self.counter.count("list_ports")
+        return {"ports": self._filter(self.ports, filter_dict)}
+
+    def list_floatingips(self, **filter_dict):
+        self.counter.count("list_floatingips")
+        return {"floatingips": self._filter(self.floating_ips, filter_dict)}
+
+    def list_networks(self, **filter_dict):
+        self.counter.count("list_networks")
+        return {"networks": [dict(net) for net in self._filter(self.networks, filter_dict)]}
+
+    def list_subnets(self, **filter_dict):
+        self.counter.count("list_subnets")
+        return {"subnets": self._filter(self.subnets, filter_dict)}
+
+
+def new_fake_vim(vms, ports_per_vm=2, tenant_id="fake-tenant-id", nets=0):
+    '''Returns a vimconnector whose clients are stubs with 'vms' ACTIVE VMs, each one with 'ports_per_vm' ports and a
+    floating ip at its first port, and 'nets' ACTIVE networks with a subnet each; and the api_counter of the stubs.
+    There are also VMs and ports of other tenant'''
+    counter = api_counter()
+    servers = {}
+    ports = []
+    floating_ips = []
+    for index in range(0, vms + 5):
+        vm_id = "vm-{}".format(index)
+        vm_tenant_id = tenant_id if index < vms else "other-tenant-id"
+        servers[vm_id] = {"id": vm_id, "name": "vm{}".format(index), "status": "ACTIVE", "tenant_id": vm_tenant_id}
+        for port_index in range(0, ports_per_vm):
+            port_id = "port-{}-{}".format(index, port_index)
+            ports.append({"id": port_id, "device_id": vm_id, "tenant_id": vm_tenant_id,
+                          "network_id": "net-{}".format(port_index), "mac_address": "fa:16:3e:00:00:{:02x}".format(
+                          port_index), "fixed_ips": [{"ip_address": "10.0.{}.{}".format(port_index, index % 250)}]})
+        floating_ips.append({"id": "fip-{}".format(index), "port_id": "port-{}-0".format(index),
+                             "tenant_id": vm_tenant_id, "floating_ip_address": "192.168.0.{}".format(index % 250)})
+    myvim = vimconn_openstack.vimconnector("fake-uuid", "fake", tenant_id, "fake-tenant", "http://fake:5000/v2.0",
+                                           user="fake", passwd="fake")
+    myvim.nova = fake_nova(counter, servers)
+    networks = [{"id": "net-{}".format(index), "name": "net{}".format(index), "status": "ACTIVE",
+                 "admin_state_up": True, "subnets": ["subnet-{}".format(index)]} for index in range(0, nets)]
+    subnets = [{"id": "subnet-{}".format(index), "cidr": "10.{}.0.0/24".format(index % 250)}
+               for index in range(0, nets)]
+    myvim.neutron = fake_neutron(counter, ports, floating_ips, networks, subnets)
+    myvim.reload_client = False
+    return myvim, counter
+
+
+class fake_auth_ref(object):
+    def __init__(self):
+        self.expiring = False
+
+    def will_expire_soon(self, stale_duration=None):
+        return self.expiring
+
+
+class fake_service_catalog(object):
+    def url_for(self, service_type=None, endpoint_type=None):
+        return "http://fake/" + service_type
+
+
+class fake_client(object):
+    '''Replaces the openstack client classes. 'created' counts the clients created, the keystone ones are the logins'''
+    created = {}
+
+    def __init__(self, *args, **kwargs):
+        name = type(self).__name__
+        fake_client.created[name] = fake_client.created.get(name, 0) + 1
+        self.auth_token = "fake-token"
+        self.auth_ref = fake_auth_ref()
+        self.service_catalog = fake_service_catalog()
+
+
+class fake_keystone(fake_client):
+    pass
+
+
+class fake_session_clients(object):
+    '''Context that replaces the openstack client classes of vimconn_openstack by fake_client and empties the
+    session cache'''
+    clients = ("nClient_v2", "cClient_v2", "ksClient_v2", "neClient_v2", "glClient", "gl1Client")
+
+    def __enter__(self):
+        self.old_clients = {}
+        for client in self.clients:
+            self.old_clients[client] = getattr(vimconn_openstack, client)
+            module = type("fake_" + client, (object,), {"Client": fake_keystone if client == "ksClient_v2" else
+                                                         fake_client})
+            setattr(vimconn_openstack, client, module)
+        fake_client.created = {}
+        vimconn_openstack.session_cache.clear()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for client, old_client in self.old_clients.items():
+            setattr(vimconn_openstack, client, old_client)
+        vimconn_openstack.session_cache.clear()
+
+
+def run_threads(target, number=10):
+    '''Runs target at number threads at the same time, and waits for them'''
+    threads = [threading.Thread(target=target) for _ in range(0, number)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def new_vim(user="fake"):
+    return vimconn_openstack.vimconnector("fake-uuid", "fake", "fake-tenant-id", "fake-tenant",
+                                          "http://fake:5000/v2.0", user=user, passwd="fake")
+
+
+class test_vimconn_openstack_session(unittest.TestCase):
+
+    def test_000_shared_session(self):
+        with fake_session_clients():
+            vims = [new_vim() for _ in range(0, 100)]
+            for myvim in vims:
+                myvim._reload_connection()
+            # one login for all the connectors with the same credentials, that share the clients
+            self.assertEqual(fake_client.created["fake_keystone"], 1)
+            self.assertIs(vims[0].neutron, vims[-1].neutron)
+            # other credentials authenticate again
+            other_vim = new_vim(user="other")
+            other_vim._reload_connection()
+            self.assertEqual(fake_client.created["fake_keystone"], 2)
+            self.assertIsNot(other_vim.neutron, vims[0].neutron)
+            # changing the credentials of a connector
+            vims[0]["user"] = "other"
+            vims[0]._reload_connection()
+            self.assertIs(vims[0].neutron, other_vim.neutron)
+
+    def test_010_token_renewal(self):
+        with fake_session_clients():
+            myvim = new_vim()
+            myvim._reload_connection()
+            other_vim = new_vim()
+            other_vim._reload_connection()
+            neutron = myvim.neutron
+            # renewed before the token expires, and shared again
+            myvim.keystone.auth_ref.expiring = True
+            myvim._reload_connection()
+            self.assertEqual(fake_client.created["fake_keystone"], 2)
+            self.assertIsNot(myvim.neutron, neutron)
+            other_vim._reload_connection()
+            self.assertIs(other_vim.neutron, myvim.neutron)
+            self.assertEqual(fake_client.created["fake_keystone"], 2)
+
+    def test_020_connector_shared_by_threads(self):
+        with fake_session_clients():
+            myvim = new_vim()
+            new_session = myvim._new_session
+
+            def slow_new_session():
+                time.sleep(0.05)
+                return new_session()
+            myvim._new_session = slow_new_session
+            # the threads wait for the login of the first one instead of login again
+            run_threads(myvim._reload_connection)
+            self.assertEqual(fake_client.created["fake_keystone"], 1)
+            self.assertFalse(myvim.reload_client)
+
+
+class test_vimconn_openstack_refresh(unittest.TestCase):
+    vms = 200
+
+    def test_000_refresh_vms_status_calls(self):
+        myvim, counter = new_fake_vim(self.vms)
+        # ports of other VMs of the tenant, that are not listed
+        myvim.neutron.ports += [dict(port, id="other-" + port["id"], device_id="other-vm")
+                                for port in myvim.neutron.ports]
+        listed_ports = []
+        list_ports = myvim.neutron.list_ports
+
+        def list_ports_counted(**filter_dict):
+            ports = list_ports(**filter_dict)
+            listed_ports.extend(ports["ports"])
+            return ports
+        myvim.neutron.list_ports = list_ports_counted
+        vm_list = ["vm-{}".format(index) for index in range(0, self.vms)]
+        vm_dict = myvim.refresh_vms_status(vm_list)
+        self.assertEqual(len(listed_ports), 2 * self.vms)
+        logger.info("API calls for refreshing %d VMs: %s", self.vms, counter.calls)
+        # one list of servers, and the ports and floating ips filtered by up to list_filter_size ids per call
+        filter_size = vimconn_openstack.list_filter_size
+        self.assertEqual(counter.calls, {"servers.list": 1, "list_ports": (self.vms + filter_size - 1) / filter_size,
+                                         "list_floatingips": (2 * self.vms + filter_size - 1) / filter_size})
+        self.assertEqual(sorted(vm_dict.keys()), sorted(vm_list))
+        for vm in vm_dict.values():
+            self.assertEqual(vm["status"], "ACTIVE")
+            self.assertEqual(len(vm["interfaces"]), 2)
+        vm = vm_dict["vm-7"]
+        self.assertEqual(vm["interfaces"][0]["vim_interface_id"], "port-7-0")
+        self.assertEqual(vm["interfaces"][0]["vim_net_id"], "net-0")
+        self.assertEqual(vm["interfaces"][0]["mac_address"], "fa:16:3e:00:00:00")
+        self.assertEqual(vm["interfaces"][0]["ip_address"], "192.168.0.7;10.0.0.7")
+        self.assertEqual(vm["interfaces"][1]["ip_address"], "10.0.1.7")
+
+    def test_010_refresh_vms_status_not_found(self):
+        myvim, counter = new_fake_vim(3)
+        vm_dict = myvim.refresh_vms_status(["vm-0", "vm-deleted"])
+        self.assertEqual(vm_dict["vm-0"]["status"], "ACTIVE")
+        # a VM not found at the list is asked individually
+        self.assertEqual(counter.calls["servers.find"], 1)
+        self.assertEqual(vm_dict["vm-deleted"]["status"], "DELETED")
+        self.assertNotIn("interfaces", vm_dict["vm-deleted"])
+
+    def test_015_refresh_vms_status_pages(self):
+        myvim, counter = new_fake_vim(self.vms)
+        myvim.nova.servers.max_limit = 50
+        vm_list = ["vm-{}".format(index) for index in range(0, self.vms)]
+        vm_dict = myvim.refresh_vms_status(vm_list)
+        # the VMs beyond the first page are found at the next ones, not asked individually
+        self.assertNotIn("servers.find", counter.calls)
+        pages = (self.vms + 5 + 49) / 50    # the VMs of the other tenant are listed too
+        self.assertEqual(counter.calls["servers.list"], pages)
+        for vm in vm_dict.values():
+            self.assertEqual(vm["status"], "ACTIVE")
+        # a deleted VM makes all the pages be read, and then it is asked individually
+        counter.calls.clear()
+        vm_dict = myvim.refresh_vms_status(["vm-0", "vm-deleted"])
+        self.assertEqual(counter.calls["servers.list"], pages + 1)
+        self.assertEqual(counter.calls["servers.find"], 1)
+        self.assertEqual(vm_dict["vm-deleted"]["status"], "DELETED")
+
+    def test_017_refresh_vms_status_ports_of_project(self):
+        # a tenant given by name is filtered by the project id of the token; admin users see all the ports
+        myvim, counter = new_fake_vim(3, tenant_id=None)
+        myvim.keystone = fake_client()
+        myvim.keystone.auth_ref.project_id = "fake-tenant-id"
+        for port in myvim.neutron.ports:
+            if port["tenant_id"] is None:
+                port["tenant_id"] = "fake-tenant-id"
+        filters = []
+        list_ports = myvim.neutron.list_ports
+        myvim.neutron.list_ports = lambda **filter_dict: filters.append(filter_dict) or list_ports(**filter_dict)
+        myvim.refresh_vms_status(["vm-0"])
+        self.assertEqual(filters, [{"tenant_id": "fake-tenant-id", "device_id": ["vm-0"]}])
+
+    def test_020_refresh_vms_status_vim_error(self):
+        myvim, counter = new_fake_vim(3)
+
+        def list_error(detailed=True, search_opts=None, marker=None, limit=None):
+            raise nvExceptions.ClientException(500, "fake error")
+        myvim.nova.servers.list = list_error
+        vm_dict = myvim.refresh_vms_status(["vm-0", "vm-1"])
+        for vm in vm_dict.values():
+            self.assertEqual(vm["status"], "VIM_ERROR")
+        self.assertEqual(counter.total(), 0)
+
+    def test_030_refresh_vms_status_ports_error(self):
+        myvim, counter = new_fake_vim(3)
+
+        def list_error(**filter_dict):
+            raise vimconn.vimconnConnectionException("fake error")
+        myvim.neutron.list_ports = list_error
+        vm_dict = myvim.refresh_vms_status(["vm-0", "vm-1"])
+        # the status of the VMs is obtained anyway, without interfaces
+        for vm in vm_dict.values():
+            self.assertEqual(vm["status"], "ACTIVE")
+            self.assertEqual(vm["interfaces"], [])
+
+    def test_040_refresh_nets_status(self):
+        nets = 120
+        myvim, counter = new_fake_vim(0, nets=nets)
+        myvim.neutron.networks[1]["admin_state_up"] = False
+        myvim.neutron.networks[2]["status"] = "UNKNOWN"
+        net_list = ["net-{}".format(index) for index in range(0, nets)] + ["net-deleted"]
+        net_dict = myvim.refresh_nets_status(net_list)
+        # the networks and their subnets are listed in chunks of list_filter_size ids
+        size = vimconn_openstack.list_filter_size
+        self.assertEqual(counter.calls, {"list_networks": (nets + 1 + size - 1) / size,
+                                         "list_subnets": (nets + size - 1) / size})
+        self.assertEqual(sorted(net_dict.keys()), sorted(net_list))
+        self.assertEqual(net_dict["net-0"]["status"], "ACTIVE")
+        self.assertIn("10.0.0.0/24", str(net_dict["net-0"]["vim_info"]))
+        # the subnets keep the format of get_network, the show_subnet answer
+        self.assertEqual(yaml.safe_load(str(net_dict["net-0"]["vim_info"]))["subnets"],
+                         [{"subnet": {"id": "subnet-0", "cidr": "10.0.0.0/24"}}])
+        self.assertEqual(net_dict["net-1"]["status"], "DOWN")
+        self.assertEqual(net_dict["net-2"]["status"], "OTHER")
+        self.assertEqual(net_dict["net-deleted"]["status"], "DELETED")
+        self.assertEqual(net_dict["net-deleted"]["error_msg"], "Network 'net-deleted' not found")
+
+    def test_050_refresh_nets_status_vim_error(self):
+        myvim, counter = new_fake_vim(0, nets=3)
+
+        def list_error(**filter_dict):
+            raise vimconn_openstack.neExceptions.ConnectionFailed("fake error")
+        myvim.neutron.list_networks = list_error
+        net_dict = myvim.refresh_nets_status(["net-0", "net-1"])
+        for net in net_dict.values():
+            self.assertEqual(net["status"], "VIM_ERROR")
+
+
+class test_vimconn_openstack_flavors(unittest.TestCase):
+    numa_flavor = {"name": "numa", "ram": 1024, "vcpus": 1, "disk": 10, "extended": {"numas": [
+        {"memory": 4, "paired-threads": 2, "interfaces": [{"dedicated": "no"}]}]}}
+
+    def new_vim_with_flavors(self, number):
+        myvim, counter = new_fake_vim(0)
+        for index in range(0, number):
+            myvim.nova.flavors.flavors.append(fake_flavor(counter, "flavor-{}".format(index), "f{}".format(index),
+                                                          ram=512 * (index + 1), vcpus=1 + index % 4, disk=10))
+        # a flavor with EPA keys
+        myvim.nova.flavors.flavors.append(fake_flavor(counter, "flavor-numa", "numa", 4096, 4, 10, keys={
+            "hw:numa_nodes": "1", "hw:mem_page_size": "large", "hw:cpu_policy": "dedicated",
+            "hw:numa_mempolicy": "strict", "hw:cpu_threads_policy": "prefer"}))
+        return myvim, counter
+
+    def test_000_flavor_index(self):
+        myvim, counter = self.new_vim_with_flavors(100)
+        for _ in range(0, 1000):
+            self.assertEqual(myvim.get_flavor_id_from_data({"ram": 512 * 10, "vcpus": 2, "disk": 10}), "flavor-9")
+        # listed once, with the keys of each flavor
+        self.assertEqual(counter.calls, {"flavors.list": 1, "flavor.get_keys": 101})
+        with self.assertRaises(vimconn.vimconnNotFoundException):
+            myvim.get_flavor_id_from_data({"ram": 512 * 10, "vcpus": 3, "disk": 10})
+        # listed again after the ttl
+        myvim.flavor_index_time -= vimconn_openstack.flavor_index_ttl + 1
+        myvim.get_flavor_id_from_data({"ram": 512, "vcpus": 1, "disk": 10})
+        self.assertEqual(counter.calls["flavors.list"], 2)
+
+    def test_010_flavor_index_epa(self):
+        myvim, counter = self.new_vim_with_flavors(10)
+        # the flavor with the same keys that new_flavor would add
+        self.assertEqual(myvim.get_flavor_id_from_data(self.numa_flavor), "flavor-numa")
+        # a flavor with the same ram and vcpus but without the EPA keys does not match
+        myvim.nova.flavors.flavors[-1].keys = {}
+        myvim.flavor_index = None
+        with self.assertRaises(vimconn.vimconnNotFoundException):
+            myvim.get_flavor_id_from_data(self.numa_flavor)
+        # more than one numa is not supported
+        two_numas = {"ram": 1024, "vcpus": 1, "disk": 10, "extended": {"numas": [{"memory": 1, "cores": 1}] * 2}}
+        with self.assertRaises(vimconn.vimconnNotFoundException):
+            myvim.get_flavor_id_from_data(two_numas)
+        with self.assertRaises(vimconn.vimconnNotSupportedException):
+            myvim.new_flavor(dict(two_numas, name="two"))
+
+    def test_020_flavor_index_new_delete(self):
+        myvim, counter = self.new_vim_with_flavors(10)
+        myvim.nova.flavors.flavors.pop()
+        with self.assertRaises(vimconn.vimconnNotFoundException):
+            myvim.get_flavor_id_from_data(self.numa_flavor)
+        # a new flavor is added to the index, without listing again
+        flavor_id = myvim.new_flavor(self.numa_flavor)
+        self.assertEqual(myvim.get_flavor_id_from_data(self.numa_flavor), flavor_id)
+        self.assertEqual(counter.calls["flavors.list"], 2)   # the index and the names at new_flavor
+        # a deleted one is removed
+        myvim.delete_flavor(flavor_id)
+        with self.assertRaises(vimconn.vimconnNotFoundException):
+            myvim.get_flavor_id_from_data(self.numa_flavor)
+
+    def test_030_flavor_index_threads(self):
+        myvim, counter = self.new_vim_with_flavors(10)
+        flavors_list = myvim.nova.flavors.list
+
+        def slow_list():
+            time.sleep(0.05)
+            return flavors_list()
+        myvim.nova.flavors.list = slow_list
+        flavor_ids = []
+        run_threads(lambda: flavor_ids.append(myvim.get_flavor_id_from_data({"ram": 512, "vcpus": 1, "disk": 10})))
+        # the index is built once, by the first thread
+        self.assertEqual(flavor_ids, ["flavor-0"] * 10)
+        self.assertEqual(counter.calls["flavors.list"], 1)
+
+
+class test_vimconn_openstack_images(unittest.TestCase):
+    def new_vim_with_images(self, number):
+        myvim, counter = new_fake_vim(0)
+        images = [{"id": "image-{}".format(index), "name": "image{}".format(index % 10),
+                   "checksum": "{:032x}".format(index), "location": "/images/image{}.qcow2".format(index)}
+                  for index in range(0, number)]
+        myvim.glance = fake_glance(counter, images)
+        # nova and glance share the images
+        myvim.nova.images = fake_images(counter, images)
+        return myvim, counter
+
+    def test_000_image_index(self):
+        myvim, counter = self.new_vim_with_images(100)
+        for _ in range(0, 1000):
+            self.assertEqual(myvim.get_image_id_from_path("/images/image42.qcow2"), "image-42")
+            images = myvim.get_image_list({"name": "image2", "checksum": "{:032x}".format(52)})
+            self.assertEqual([image["id"] for image in images], ["image-52"])
+        self.assertEqual(counter.calls, {"images.list": 1})
+        self.assertEqual(len(myvim.get_image_list({"name": "image2"})), 10)
+        self.assertEqual(len(myvim.get_image_list()), 100)
+        # the returned images are copies
+        myvim.get_image_list({"id": "image-1"})[0]["name"] = "changed"
+        self.assertEqual(myvim.get_image_list({"id": "image-1"})[0]["name"], "image1")
+        # listed again after the ttl
+        myvim.image_index_time -= vimconn_openstack.image_index_ttl + 1
+        myvim.get_image_id_from_path("/images/image42.qcow2")
+        self.assertEqual(counter.calls["images.list"], 2)
+
+    def test_010_image_index_miss(self):
+        myvim, counter = self.new_vim_with_images(10)
+        myvim.get_image_id_from_path("/images/image1.qcow2")
+        # an image created out of the connector is found, listing again once
+        myvim.glance.images.images.append({"id": "new", "name": "new", "checksum": "0", "location": "/images/new"})
+        myvim.image_index_time -= 2
+        self.assertEqual(myvim.get_image_id_from_path("/images/new"), "new")
+        self.assertEqual(counter.calls["images.list"], 2)
+        myvim.image_index_time -= 2
+        with self.assertRaises(vimconn.vimconnNotFoundException):
+            myvim.get_image_id_from_path("/images/missing")
+        self.assertEqual(counter.calls["images.list"], 3)
+        self.assertEqual(myvim.get_image_list({"name": "missing"}), [])
+        self.assertEqual(counter.calls["images.list"], 3)
+        # a deleted one is removed
+        myvim.delete_image("new")
+        with self.assertRaises(vimconn.vimconnNotFoundException):
+            myvim.get_image_id_from_path("/images/new")
+        self.assertEqual(counter.calls["images.list"], 4)
+
+
+class fake_glance_v1_images(object):
+    '''Reads the image data as glanceclient does, 64KB at a time. The first 'failures' uploads fail at the middle,
+    leaving the image 'killed', as glance does'''
+    def __init__(self, counter, images, failures=0):
+        self.counter = counter
+        self.images = images
+        self.failures = failures
+        self.read_sizes = set()
+
+    def create(self, name=None, data=None, location=None, **kwargs):
+        self.counter.count("images.create")
+        image = {"id": "image-{}".format(len(self.images)), "name": name, "status": "queued", "checksum": None}
+        self.images.append(image)
+        return type("fake_image", (object,), image)
+
+    def update(self, image_id, data=None, **kwargs):
+        self.counter.count("images.update")
+        image = [image for image in self.images if image["id"] == image_id][0]
+        md5 = hashlib.md5()
+        # as glanceclient utils.get_file_size
+        position = data.tell()
+        data.seek(0, 2)
+        size = data.tell()
+        data.seek(position)
+        sent = 0
+        while True:
+            chunk = data.read(65536)
+            if not chunk:
+                break
+            self.read_sizes.add(len(chunk))
+            md5.update(chunk)
+            sent += len(chunk)
+            if self.failures and sent >= size // 2:
+                self.failures -= 1
+                image["status"] = "killed"
+                raise gl1Exceptions.CommunicationError("fake error")
+        image.update(status="active", checksum=md5.hexdigest())
+        return type("fake_image", (object,), image)
+
+    def delete(self, image_id):
+        self.counter.count("images.delete")
+        self.images[:] = [image for image in self.images if image["id"] != image_id]
+
+
+class fake_nova_images(fake_images):
+    def find(self, id=None):
+        image = [image for image in self.images if image["id"] == id][0]
+        return type("fake_nova_image", (object,), {"id": id, "metadata": image.setdefault("metadata", {})})
+
+
+class test_vimconn_openstack_upload(unittest.TestCase):
+    def setUp(self):
+        self.image_file = tempfile.NamedTemporaryFile(suffix=".qcow2")
+        self.content = os.urandom(1024 * 1024 + 100)
+        self.image_file.write(self.content)
+        self.image_file.flush()
+        self.old_retry_delay = vimconn_openstack.image_upload_retry_delay
+        vimconn_openstack.image_upload_retry_delay = 0
+
+    def tearDown(self):
+        self.image_file.close()
+        vimconn_openstack.image_upload_retry_delay = self.old_retry_delay
+
+    def new_vim_for_upload(self, failures=0, chunk_size=None):
+        myvim, counter = new_fake_vim(0)
+        images = []
+        myvim.glance_v1 = type("fake_glance_v1", (object,), {})()
+        myvim.glance_v1.images = fake_glance_v1_images(counter, images, failures)
+        myvim.nova.images = fake_nova_images(counter, images)
+        if chunk_size:
+            myvim.config["image_upload_chunk_size"] = chunk_size
+        return myvim, counter
+
+    def test_000_streaming_upload(self):
+        myvim, counter = self.new_vim_for_upload(chunk_size=10000)
+        image_dict = {"name": "image", "location": self.image_file.name, "metadata": "{use: test}"}
+        image_id = myvim.new_image(image_dict)
+        # the file is read by chunks, and hashed in the same pass
+        self.assertEqual(max(myvim.glance_v1.images.read_sizes), 10000)
+        self.assertEqual(image_dict["checksum"], hashlib.md5(self.content).hexdigest())
+        self.assertEqual(image_dict["sha256"], hashlib.sha256(self.content).hexdigest())
+        self.assertEqual(myvim.nova.images.images[0]["metadata"], {"location": self.image_file.name, "use": "test"})
+        self.assertEqual(image_id, "image-0")
+
+        reader = vimconn_openstack.image_upload_reader(open(self.image_file.name, "rb"), chunk_size=4096)
+        self.assertEqual("".join(reader), self.content)
+        self.assertEqual(reader.get_stats()["bytes"], len(self.content))
+
+    def test_010_upload_retry(self):
+        myvim, counter = self.new_vim_for_upload(failures=2)
+        image_dict = {"name": "image", "location": self.image_file.name}
+        image_id = myvim.new_image(image_dict)
+        # uploaded again from the start, with the right checksum
+        self.assertEqual(counter.calls["images.update"], 3)
+        self.assertEqual(image_dict["checksum"], hashlib.md5(self.content).hexdigest())
+        # the images killed by the failed attempts are deleted
+        self.assertEqual(counter.calls["images.delete"], 2)
+        self.assertEqual([(image["id"], image["status"]) for image in myvim.glance_v1.images.images],
+                         [(image_id, "active")])
+        # the transfer errors are reported after the last retry, without leaving images
+        myvim, counter = self.new_vim_for_upload(failures=3)
+        with self.assertRaises(vimconn.vimconnConnectionException):
+            myvim.new_image({"name": "image", "location": self.image_file.name})
+        self.assertEqual(counter.calls["images.update"], 3)
+        self.assertEqual(counter.calls["images.delete"], 3)
+        self.assertEqual(myvim.glance_v1.images.images, [])
+
+    def test_015_upload_from_local_copy(self):
+        myvim, counter = self.new_vim_for_upload()
+        url = "http://fake/images/image.qcow2"
+        image_dict = {"name": "image", "location": url, "local_path": self.image_file.name}
+        myvim.new_image(image_dict)
+        # uploaded from the local copy, and found by the URL
+        self.assertEqual(image_dict["checksum"], hashlib.md5(self.content).hexdigest())
+        self.assertEqual(myvim.nova.images.images[0]["metadata"], {"location": url})
+
+    def test_020_upload_wrong_checksum(self):
+        myvim, counter = self.new_vim_for_upload()
+        with self.assertRaises(vimconn.vimconnException) as context:
+            myvim.new_image({"name": "image", "location": self.image_file.name, "checksum": "0" * 32})
+        self.assertEqual(context.exception.http_code, vimconn.HTTP_Bad_Request)
+        # the wrong image is deleted, and not retried
+        self.assertEqual(counter.calls, {"images.create": 1, "images.update": 1, "images.delete": 1})
+        self.assertEqual(myvim.glance_v1.images.images, [])
+
+
+if __name__=="__main__":
+    parser = OptionParser()
+    parser.add_option("-v", '--version', help='Show current version', dest='version', action="store_true",
+                      default=False)
+    parser.add_option('--debug', help='Set logs to debug level', dest='debug', action="store_true", default=False)
+    parser.add_option('-n', '--number', dest='number', type="int", default=200,
+                      help='Number of VMs refreshed. By default 200')
+    (options, args) = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s %(name)s %(levelname)s: %(message)s",
+                        level=logging.DEBUG if options.debug else logging.WARNING)
+    logger.setLevel(logging.INFO)
+    if options.version:
+        print sys.argv[0], __version__ + " version", version_date
+        sys.exit(0)
+
+    test_vimconn_openstack_refresh.vms = options.number
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.TestLoader().loadTestsFromTestCase(test_vimconn_openstack_refresh))
+    suite.addTest(unittest.TestLoader().loadTestsFromTestCase(test_vimconn_openstack_session))
+    suite.addTest(unittest.TestLoader().loadTestsFromTestCase(test_vimconn_openstack_flavors))
+    suite.addTest(unittest.TestLoader().loadTestsFromTestCase(test_vimconn_openstack_images))
+    suite.addTest(unittest.TestLoader().loadTestsFromTestCase(test_vimconn_openstack_upload))
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    sys.exit(0 if result.wasSuccessful() else 1)
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+
+##
+# Copyright 2015 Telefónica Investigación y Desarrollo, S.A.U.
+# This file is part of openvim
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# For those usages not covered by the Apache License, Version 2.0 please
+# contact with: nfvlabs@tid.es
+##
+
+'''
+Caches kept by nfvo between calls: the vimconnectors created by get_vim, the fingerprints of the VIM
+status already written at database, and the local copy of the images given by URL
+'''
+__author__ = "Alfonso Tierno"
+__date__ = "$10-feb-2017 12:07:15$"
+
+import threading
+import logging
+import collections
+import json
+import os
+import hashlib
+import tempfile
+import requests
+from time import time
+import vimconn
+
+
+class connector_cache(object):
+    '''Keeps the vimconnector objects created by nfvo.get_vim, so that next calls reuse them with their VIM sessions
+    instead of authenticating again. The key contains a hash of all the data used to create the connector, so a change
+    at database gives a new entry. Entries not used during 'idle' seconds are evicted; 0 disables the cache.
+    Counters: hits, misses, evictions
+    '''
+    def __init__(self, idle=600):
+        self.idle = idle
+        self.entries = {}   # key: [vimconnector, last used time]
+        self.lock = threading.Lock()
+        self.last_eviction = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def get_key(datacenter_id, datacenter_tenant_id, *credentials):
+        '''Returns the cache key for the connector created with these credentials, a list of json serializable items'''
+        credentials_hash = hashlib.md5(json.dumps(credentials, sort_keys=True, default=str)).hexdigest()
+        return datacenter_id, datacenter_tenant_id, credentials_hash
+
+    def _evict(self, now):
+        if now - self.last_eviction < 1:
+            return
+        self.last_eviction = now
+        for key, entry in self.entries.items():
+            if now - entry[1] > self.idle:
+                del self.entries[key]
+                self.evictions += 1
+
+    def get(self, key):
+        '''Returns the cached vimconnector of this key, or None'''
+        if not self.idle:
+            return None
+        now = time()
+        with self.lock:
+            self._evict(now)
+            entry = self.entries.get(key)
+            if not entry:
+                self.misses += 1
+                return None
+            entry[1] = now
+            self.hits += 1
+            return entry[0]
+
+    def add(self, key, myvim):
+        if not self.idle:
+            return
+        with self.lock:
+            self.entries[key] = [myvim, time()]
+
+    def invalidate(self, datacenter_id=None):
+        '''Removes the connectors of a datacenter, or all if datacenter_id is None'''
+        with self.lock:
+            for key in self.entries.keys():
+                if datacenter_id is None or key[0] == datacenter_id:
+                    del self.entries[key]
+
+    def get_stats(self):
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+class fingerprint_cache(object):
+    '''Fingerprint of the refreshed content last stored at database of each element, to skip the database update of
+    the ones that did not change. It is shared by the threads that refresh, and keeps at most 'max_size' entries,
+    evicting the least recently used. Counters: evictions
+    '''
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self.fingerprints = collections.OrderedDict()  # key: fingerprint, least recently used first
+        self.lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            fingerprint = self.fingerprints.pop(key, None)
+            if fingerprint is not None:
+                self.fingerprints[key] = fingerprint
+            return fingerprint
+
+    def set(self, key, fingerprint):
+        with self.lock:
+            self.fingerprints.pop(key, None)
+            while self.fingerprints and len(self.fingerprints) >= self.max_size:
+                self.fingerprints.popitem(last=False)
+                self.evictions += 1
+            self.fingerprints[key] = fingerprint
+
+    def forget(self, keys):
+        with self.lock:
+            for key in keys:
+                self.fingerprints.pop(key, None)
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+
+class image_cache(object):
+    '''Local copy of the images given by URL, downloaded once to be uploaded to several VIMs. The files are named by
+    their md5, so an image with a known checksum is found without downloading it; and an index.json file keeps the md5
+    of each URL, and the size and sha256 of each file. The least recently used files are removed when the total size
+    exceeds 'max_size' bytes. Counters: hits, misses, evictions, downloaded (bytes)
+    '''
+    def __init__(self, directory, max_size=10*1024*1024*1024, chunk_size=1024*1024, timeout=60):
+        self.directory = directory
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.logger = logging.getLogger('openmano.vim.images')
+        self.lock = threading.Lock()
+        self.url_locks = {}     # url: lock held while downloading it
+        self.urls = {}          # url: md5
+        self.files = {}         # md5: {"size", "sha256", "used": last used time}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.downloaded = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._load()
+
+    def _load(self):
+        index_file = os.path.join(self.directory, "index.json")
+        if not os.path.exists(index_file):
+            return
+        try:
+            with open(index_file) as f:
+                index = json.load(f)
+        except (IOError, ValueError) as e:
+            self.logger.error("Cannot read the image cache index '%s', starting empty: %s", index_file, str(e))
+            return
+        for md5, file_info in index.get("files", {}).items():
+            file_name = os.path.join(self.directory, md5)
+            # discard the files removed or truncated
+            if os.path.isfile(file_name) and os.path.getsize(file_name) == file_info["size"]:
+                file_info["used"] = os.path.getmtime(file_name)
+                self.files[md5] = file_info
+        self.urls = {url: md5 for url, md5 in index.get("urls", {}).items() if md5 in self.files}
+
+    def _save(self):
+        index = {"urls": self.urls, "files": {md5: {"size": file_info["size"], "sha256": file_info["sha256"]}
+                                              for md5, file_info in self.files.items()}}
+        index_file = os.path.join(self.directory, "index.json")
+        with open(index_file + ".tmp", "w") as f:
+            json.dump(index, f)
+        os.rename(index_file + ".tmp", index_file)
+
+    def _get_file(self, md5):
+        '''Returns the file name of a cached md5, or None if it is not cached or its size has changed'''
+        file_info = self.files.get(md5)
+        if not file_info:
+            return None
+        file_name = os.path.join(self.directory, md5)
+        try:
+            if os.path.getsize(file_name) != file_info["size"]:
+                raise OSError("size changed")
+            os.utime(file_name, None)
+        except OSError as e:
+            self.logger.error("Image cache file '%s' discarded: %s", file_name, str(e))
+            del self.files[md5]
+            return None
+        file_info["used"] = time()
+        return file_name
+
+    def get(self, url, checksum=None):
+        '''Returns the local file name and md5 of the image at url, downloading it if not cached. If checksum is given
+        it is the expected md5. Raises a vimconnException if the download fails or the checksum is wrong'''
+        with self.lock:
+            url_lock = self.url_locks.setdefault(url, threading.Lock())
+        # the same url is downloaded only once at a time, the rest wait for it
+        with url_lock:
+            with self.lock:
+                md5 = checksum or self.urls.get(url)
+                file_name = self._get_file(md5) if md5 else None
+                if file_name:
+                    self.hits += 1
+                    return file_name, md5
+                self.misses += 1
+            md5, file_info, temp_name = self._download(url)
+            if checksum and checksum != md5:
+                os.remove(temp_name)
+                raise vimconn.vimconnException("image '{}' has checksum '{}', but '{}' is expected".format(
+                    url, md5, checksum))
+            with self.lock:
+                file_name = os.path.join(self.directory, md5)
+                os.rename(temp_name, file_name)
+                self.files[md5] = file_info
+                self.urls[url] = md5
+                self._evict(keep=md5)
+                self._save()
+            return file_name, md5
+
+    def _download(self, url):
+        '''Downloads url to a temporal file of the cache directory, computing its md5 and sha256.
+        Returns the md5, the file info and the temporal file name'''
+        md5 = hashlib.md5()
+        sha256 = hashlib.sha256()
+        size = 0
+        start_time = time()
+        fd, temp_name = tempfile.mkstemp(suffix=".part", dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as temp_file:
+                response = requests.get(url, stream=True, timeout=self.timeout)
+                response.raise_for_status()
+                for chunk in response.iter_content(self.chunk_size):
+                    temp_file.write(chunk)
+                    md5.update(chunk)
+                    sha256.update(chunk)
+                    size += len(chunk)
+        except (requests.exceptions.RequestException, IOError, OSError) as e:
+            os.remove(temp_name)
+            raise vimconn.vimconnConnectionException("Cannot download image '{}': {}".format(url, str(e)))
+        elapsed = time() - start_time
+        self.downloaded += size
+        self.logger.info("Image '%s' downloaded to the cache: %d bytes in %.1f seconds", url, size, elapsed)
+        return md5.hexdigest(), {"size": size, "sha256": sha256.hexdigest(), "used": time()}, temp_name
+
+    def _evict(self, keep=None):
+        total = sum(file_info["size"] for file_info in self.files.values())
+        for md5, file_info in sorted(self.files.items(), key=lambda item: item[1]["used"]):
+            if total <= self.max_size:
+                break
+            if md5 == keep:
+                continue
+            try:
+                os.remove(os.path.join(self.directory, md5))
+            except OSError as e:
+                self.logger.error("Cannot remove image cache file '%s': %s", md5, str(e))
+            del self.files[md5]
+            total -= file_info["size"]
+            self.evictions += 1
+        for url, md5 in self.urls.items():
+            if md5 not in self.files:
+                del self.urls[url]
+
+    def get_stats(self):
+        return {"files": len(self.files), "size": sum(file_info["size"] for file_info in self.files.values()),
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions, "downloaded": self.downloaded}
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+##
+# Copyright 2015 Telefónica Investigación y Desarrollo, S.A.U.
+# This file is part of openvim
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# For those usages not covered by the Apache License, Version 2.0 please
+# contact with: nfvlabs@tid.es
+##
+
+'''
+Executor of concurrent calls to the VIMs, used by nfvo for the status refresh and the provisioning of images,
+flavors and networks at several datacenters
+'''
+__author__ = "Alfonso Tierno"
+__date__ = "$10-feb-2017 12:07:15$"
+
+import threading
+import Queue
+import logging
+import collections
+from time import time
+import vimconn
+
+
+class vim_call(object):
+    '''A call submitted to a vim_executor. get_result waits for it. A call whose caller stopped waiting is
+    'abandoned', and it is not run if it has not started yet'''
+    def __init__(self, function, args, kwargs, key=None):
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.key = key
+        self.result = None
+        self.exception = None
+        self.abandoned = False
+        self.event = threading.Event()
+
+    def done(self):
+        return self.event.is_set()
+
+    def get_result(self, timeout=None):
+        '''Waits until the call is done, or as much 'timeout' seconds. Returns its result, or raises its exception
+        or a vimconnConnectionException if the time expires. The call keeps running after a timeout'''
+        if not self.event.wait(timeout):
+            self.abandoned = True
+            raise vimconn.vimconnConnectionException("No response from VIM after {} seconds".format(timeout),
+                                                     http_code=vimconn.HTTP_Request_Timeout)
+        if self.exception:
+            raise self.exception
+        return self.result
+
+
+class vim_executor(object):
+    '''Runs calls to the VIMs concurrently with a bounded number of threads. Threads are started on demand and kept
+    for next calls. A call that hangs keeps its thread busy, so callers must wait with a timeout.
+    The calls submitted with submit_at for the same VIM are at most 'vim_workers' at the same time; the rest wait
+    without taking a thread, so a VIM that hangs does not take all the threads from the others
+    '''
+    def __init__(self, workers=10, name="vim_executor", vim_workers=4):
+        self.workers = workers
+        self.vim_workers = vim_workers
+        self.name = name
+        self.queue = Queue.Queue()
+        self.lock = threading.Lock()
+        self.threads = []
+        self.idle = 0
+        self.running = {}   # key: number of calls of this key enqueued or running
+        self.waiting = {}   # key: deque of calls of this key waiting for one of them to finish
+        self.logger = logging.getLogger('openmano.vim.executor')
+
+    def submit(self, function, *args, **kwargs):
+        '''Enqueues function(*args, **kwargs) to be run by a thread of the executor. Returns a vim_call'''
+        call = vim_call(function, args, kwargs)
+        with self.lock:
+            self._enqueue(call)
+        return call
+
+    def submit_at(self, key, function, *args, **kwargs):
+        '''As submit, for a call to the VIM identified by 'key', e.g. the datacenter_id. It waits while there are
+        'vim_workers' calls of the same key enqueued or running'''
+        call = vim_call(function, args, kwargs, key)
+        with self.lock:
+            if self.running.get(key, 0) < self.vim_workers:
+                self.running[key] = self.running.get(key, 0) + 1
+                self._enqueue(call)
+            else:
+                waiting = self.waiting.setdefault(key, collections.deque())
+                for old_call in [old_call for old_call in waiting if old_call.abandoned]:
+                    waiting.remove(old_call)
+                    self._drop(old_call)
+                waiting.append(call)
+        return call
+
+    def _enqueue(self, call):
+        '''Called with the lock'''
+        if not self.idle and len(self.threads) < self.workers:
+            thread = threading.Thread(target=self._run_worker,
+                                      name="{}.{}".format(self.name, len(self.threads)))
+            thread.daemon = True
+            self.threads.append(thread)
+            thread.start()
+        else:
+            self.idle -= 1
+        self.queue.put(call)
+
+    @staticmethod
+    def _drop(call):
+        call.exception = vimconn.vimconnConnectionException("Call not done, nobody waits for it any more",
+                                                            http_code=vimconn.HTTP_Request_Timeout)
+        call.event.set()
+
+    def _release(self, key):
+        '''Called with the lock when a call of this key finishes. Enqueues the next one waiting'''
+        waiting = self.waiting.get(key)
+        while waiting:
+            call = waiting.popleft()
+            if not call.abandoned:
+                self._enqueue(call)
+                break
+            self._drop(call)
+        else:
+            self.waiting.pop(key, None)
+            running = self.running.get(key, 1) - 1     # the counters are reset at close
+            if running:
+                self.running[key] = running
+            else:
+                self.running.pop(key, None)
+
+    def map(self, function, items, timeout=None):
+        '''Calls function(item) for each item concurrently. Returns a list of (result, exception) per item, in the
+        same order. Each call waits at most 'timeout' seconds from now'''
+        calls = [self.submit(function, item) for item in items]
+        deadline = time() + timeout if timeout is not None else None
+        results = []
+        for call in calls:
+            try:
+                remaining = max(0, deadline - time()) if deadline is not None else None
+                results.append((call.get_result(remaining), None))
+            except Exception as e:
+                results.append((None, e))
+        return results
+
+    def _run_worker(self):
+        while True:
+            call = self.queue.get()
+            if call is None:
+                return
+            if call.abandoned:
+                self._drop(call)
+            else:
+                try:
+                    call.result = call.function(*call.args, **call.kwargs)
+                except Exception as e:
+                    if not isinstance(e, vimconn.vimconnException):
+                        self.logger.error("Unexpected exception at %s: %s", self.name, str(e), exc_info=True)
+                    call.exception = e
+                call.event.set()
+            with self.lock:
+                self.idle += 1
+                if call.key is not None:
+                    self._release(call.key)
+
+    def close(self):
+        '''Stops the threads once the enqueued calls are done'''
+        with self.lock:
+            for _ in self.threads:
+                self.queue.put(None)
+            self.threads = []
+            self.idle = 0
+            for waiting in self.waiting.values():
+                for call in waiting:
+                    self._drop(call)
+            self.waiting = {}
+            self.running = {}
@@ -0,0 +1,403 @@
+# -*- coding: utf-8 -*-
+
+##
+# Copyright 2015 Telefónica Investigación y Desarrollo, S.A.U.
+# This file is part of openvim
+# All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# For those usages not covered by the Apache License, Version 2.0 please
+# contact with: nfvlabs@tid.es
+##
+
+'''
+Task bookkeeping shared by nfvo and the vim_threads: the registry of the tasks in memory, the journal
+that records them at a local file to resume them after a restart, and the writer of their results at database
+'''
+__author__ = "Alfonso Tierno"
+__date__ = "$10-feb-2017 12:07:15$"
+
+import threading
+import logging
+import collections
+import json
+import os
+from time import time, sleep
+from db_base import db_base_Exception
+
+
+class _task_entry(object):
+    __slots__ = ("task", "finished", "operation")
+
+    def __init__(self, task, operation=None):
+        self.task = task
+        self.finished = None    # time when the task was first seen finished and persisted
+        self.operation = operation
+
+
+class task_registry(object):
+    """Stores the tasks by task_id, as the former global task_dict, but with a retention policy:
+    A task is removed 'ttl' seconds after it reaches a terminal state (done, error, deleted) and, for the creation tasks,
+    its result has been written at database (the task has 'persisted' set). Besides, when there are more than
+    'max_size' tasks, the least recently used finished ones are removed.
+    The same policy is applied to the groups of tasks stored per instance.
+    Methods must be called with the task_lock taken
+    """
+    terminal_status = ("done", "error", "deleted")
+    purge_interval = 100    # number of insertions between purges
+
+    def __init__(self, ttl=3600, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.tasks = collections.OrderedDict()      # task_id: _task_entry, least recently used first
+        self.instances = collections.OrderedDict()  # instance_id: _task_entry with the dict of tasks as 'task'
+        self.operations = {}                        # operation_id: instance_id
+        self.insertions = 0
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def __contains__(self, task_id):
+        return task_id in self.tasks
+
+    def add(self, task):
+        self.tasks[task["id"]] = _task_entry(task)
+        self.insertions += 1
+        if self.insertions % self.purge_interval == 0 or len(self.tasks) > self.max_size:
+            self.purge()
+
+    def get(self, task_id, default=None):
+        entry = self.tasks.pop(task_id, None)
+        if not entry:
+            return default
+        self.tasks[task_id] = entry
+        return entry.task
+
+    def set_instance_tasks(self, instance_id, tasks, operation=None):
+        """Stores the dictionary task_id: task with the tasks of the last operation over an instance. 'operation' is a
+        dictionary with its 'id', that can be used instead of the instance_id at get_instance_tasks"""
+        old_entry = self.instances.pop(instance_id, None)
+        if old_entry and old_entry.operation:
+            self.operations.pop(old_entry.operation["id"], None)
+        self.instances[instance_id] = _task_entry(tasks, operation)
+        if operation:
+            self.operations[operation["id"]] = instance_id
+
+    def get_instance_tasks(self, instance_id):
+        entry = self.instances.get(self.operations.get(instance_id, instance_id))
+        return entry.task if entry else None
+
+    def get_instance_operation(self, instance_id):
+        """Returns the instance_id and the operation dictionary of the last operation over an instance, that can be
+        given by instance_id or operation_id; or None, None"""
+        instance_id = self.operations.get(instance_id, instance_id)
+        entry = self.instances.get(instance_id)
+        if not entry:
+            return None, None
+        return instance_id, entry.operation
+
+    def _is_finished(self, task):
+        if task["status"] not in self.terminal_status:
+            return False
+        if task["status"] == "done" and task["name"] in ("new-net", "new-vm") and not task.get("persisted"):
+            return False
+        return True
+
+    def _purge(self, entries, is_finished, now):
+        expired = []
+        finished = []
+        for key, entry in entries.iteritems():
+            if entry.finished is None:
+                if not is_finished(entry.task):
+                    continue
+                entry.finished = now
+            if now - entry.finished >= self.ttl:
+                expired.append(key)
+            else:
+                finished.append(key)
+        for key in expired:
+            del entries[key]
+        # LRU among the finished ones. Unfinished tasks are never removed
+        excess = len(entries) - self.max_size
+        for key in finished[:excess]:
+            del entries[key]
+
+    def purge(self):
+        now = time()
+        self._purge(self.tasks, self._is_finished, now)
+        self._purge(self.instances, lambda tasks: all(self._is_finished(t) for t in tasks.values()), now)
+        for operation_id, instance_id in self.operations.items():
+            if instance_id not in self.instances:
+                del self.operations[operation_id]
+
+
+class task_journal(object):
+    """Append-only file with a json line per event of the VIM tasks: enqueue, start, finish, and persist when the result
+    is written at database after finishing. It is read at start up to resume the tasks interrupted by a restart.
+    Lines are written by a background thread that groups them, so that there is at most one fsync each
+    'sync_interval' seconds. After 'compact_size' lines the file is rewritten with only the tasks still needed
+    """
+    creation_tasks = {"new-net": ("instance_nets", "vim_net_id"), "new-vm": ("instance_vms", "vim_vm_id")}
+
+    def __init__(self, file_name, sync_interval=0.1, compact_size=100000):
+        self.file_name = file_name
+        self.sync_interval = sync_interval
+        self.compact_size = compact_size
+        self.logger = logging.getLogger('openmano.vim.journal')
+        self.lines = []
+        self.written = 0
+        self.closing = False
+        self.file = None
+        self.writer = None
+        self.lock = threading.Condition()
+
+    def _append(self, record):
+        line = json.dumps(record, default=str) + "\n"
+        with self.lock:
+            self.lines.append(line)
+            self.lock.notify()
+
+    def enqueue(self, thread_id, task):
+        depends = task.get("depends")
+        self._append({"op": "enqueue", "id": task["id"], "name": task["name"], "params": task["params"],
+                      "depends": depends.keys() if depends else None, "thread": thread_id})
+
+    def start(self, task):
+        self._append({"op": "start", "id": task["id"]})
+
+    def finish(self, task):
+        self._append({"op": "finish", "id": task["id"], "status": task["status"], "result": task.get("result"),
+                      "persisted": task.get("persisted", False)})
+
+    def persist(self, task):
+        self._append({"op": "persist", "id": task["id"]})
+
+    def load(self):
+        """Reads the journal file. Returns an ordered dictionary task_id: task with the last known status of each task,
+        with the keys: id, name, params, depends (list of task_id), thread, status, result, persisted"""
+        tasks = collections.OrderedDict()
+        if not os.path.exists(self.file_name):
+            return tasks
+        with open(self.file_name) as journal_file:
+            for line in journal_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # last line can be truncated after a crash
+                    self.logger.warning("Ignoring invalid line at task journal '%s': %s", self.file_name, line)
+                    continue
+                operation = record.pop("op")
+                if operation == "enqueue":
+                    record.update({"status": "enqueued", "result": None, "persisted": False})
+                    tasks[record["id"]] = record
+                    continue
+                task = tasks.get(record["id"])
+                if not task:
+                    continue
+                if operation == "start":
+                    task["status"] = "processing"
+                elif operation == "finish":
+                    task.update(record)
+                elif operation == "persist":
+                    task["persisted"] = True
+        return tasks
+
+    def _is_needed(self, task):
+        if task["status"] in ("enqueued", "processing"):
+            return True
+        return task["status"] == "done" and task["name"] in self.creation_tasks and not task["persisted"]
+
+    def _compact(self):
+        """Rewrites the journal file with only the unfinished tasks, the ones they depend on, and the creations
+        whose result is not written at database"""
+        tasks = self.load()
+        needed = set()
+        for task in tasks.values():
+            if task["status"] in ("enqueued", "processing"):
+                needed.update(task["depends"] or ())
+        temp_file_name = self.file_name + ".tmp"
+        with open(temp_file_name, "w") as journal_file:
+            for task in tasks.values():
+                if task["id"] not in needed and not self._is_needed(task):
+                    continue
+                journal_file.write(json.dumps({"op": "enqueue", "id": task["id"], "name": task["name"],
+                                               "params": task["params"], "depends": task["depends"],
+                                               "thread": task["thread"]}) + "\n")
+                if task["status"] != "enqueued":
+                    journal_file.write(json.dumps({"op": "start", "id": task["id"]}) + "\n")
+                if task["status"] not in ("enqueued", "processing"):
+                    journal_file.write(json.dumps({"op": "finish", "id": task["id"], "status": task["status"],
+                                                   "result": task["result"], "persisted": task["persisted"]},
+                                                  default=str) + "\n")
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        os.rename(temp_file_name, self.file_name)
+
+    def start_writer(self):
+        """Compacts the journal file and starts writing on it the events of the tasks. Must be called after load and
+        after resuming the loaded tasks"""
+        if os.path.exists(self.file_name):
+            self._compact()
+        self.file = open(self.file_name, "a")
+        self.writer = threading.Thread(target=self._run_writer, name="task_journal")
+        self.writer.daemon = True
+        self.writer.start()
+
+    def _run_writer(self):
+        while True:
+            with self.lock:
+                while not self.lines and not self.closing:
+                    self.lock.wait()
+                closing = self.closing
+            if not closing:
+                # group the lines arriving meanwhile in the same write and fsync
+                sleep(self.sync_interval)
+            with self.lock:
+                lines = self.lines
+                self.lines = []
+            try:
+                self.file.writelines(lines)
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.written += len(lines)
+                if self.written >= self.compact_size:
+                    self.file.close()
+                    self._compact()
+                    self.file = open(self.file_name, "a")
+                    self.written = 0
+            except (IOError, OSError) as e:
+                self.logger.error("Error writing task journal '%s': %s", self.file_name, str(e))
+            if closing:
+                self.file.close()
+                return
+
+    def close(self):
+        """Writes the pending events and stops the writer"""
+        if not self.writer:
+            return
+        with self.lock:
+            self.closing = True
+            self.lock.notify()
+        self.writer.join()
+
+
+class task_result_writer(object):
+    """Writes at database the VIM id obtained by the creation tasks, replacing the task_id used as placeholder.
+    Results arriving during 'window' seconds, from any vim_thread, are merged in a multi-row UPDATE per table, so that
+    the database lock is taken once per batch instead of once per task. Tasks written are marked as 'persisted'.
+    Counters: batches, rows, last_batch_size, max_batch_size, flush_time and max_flush_time (seconds)
+    """
+
+    def __init__(self, db, db_lock, window=0.05, max_batch=200, journal=None, poller=None):
+        self.db = db
+        self.db_lock = db_lock
+        self.window = window
+        self.max_batch = max_batch
+        self.journal = journal
+        self.poller = poller
+        self.logger = logging.getLogger('openmano.vim.writer')
+        self.pending = []   # list of (task, table, column, vim_id, datacenter_id)
+        self.closing = False
+        self.writer = None
+        self.lock = threading.Condition()
+        self.flush_lock = threading.Lock()
+        self.batches = 0
+        self.rows = 0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        self.flush_time = 0.0
+        self.max_flush_time = 0.0
+
+    def start(self):
+        self.writer = threading.Thread(target=self._run_writer, name="task_result_writer")
+        self.writer.daemon = True
+        self.writer.start()
+
+    def add(self, task, table, column, vim_id, datacenter_id=None):
+        '''Enqueues the result of a creation task. Once written, the status_poller refreshes the datacenter_id'''
+        with self.lock:
+            self.pending.append((task, table, column, vim_id, datacenter_id))
+            if self.writer and not self.closing:
+                self.lock.notify()
+                return
+        self.flush()     # not running, write it now
+
+    def get_stats(self):
+        return {"batches": self.batches, "rows": self.rows, "last_batch_size": self.last_batch_size,
+                "max_batch_size": self.max_batch_size,
+                "mean_batch_size": float(self.rows) / self.batches if self.batches else 0,
+                "flush_time": self.flush_time, "max_flush_time": self.max_flush_time,
+                "mean_flush_time": self.flush_time / self.batches if self.batches else 0}
+
+    def _run_writer(self):
+        while True:
+            with self.lock:
+                while not self.pending and not self.closing:
+                    self.lock.wait()
+                closing = self.closing
+                full = len(self.pending) >= self.max_batch
+            if not closing and not full:
+                # merge the results arriving meanwhile
+                sleep(self.window)
+            self.flush()
+            if closing:
+                return
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                pending = self.pending
+                self.pending = []
+            if not pending:
+                return
+            tables = collections.OrderedDict()
+            for task, table, column, vim_id, datacenter_id in pending:
+                tables.setdefault((table, column), {})[task["id"]] = (task, vim_id)
+            init_time = time()
+            with self.db_lock:
+                for (table, column), tasks in tables.items():
+                    try:
+                        updated = self.db.update_rows_case(table, column,
+                                                           {task_id: vim_id for task_id, (task, vim_id) in tasks.items()})
+                        not_written = ()
+                        if updated < len(tasks):
+                            # some rows are not at database yet, or were deleted
+                            rows = self.db.get_rows(FROM=table, SELECT=(column,), WHERE={column: tasks.keys()})
+                            not_written = [row[column] for row in rows]
+                        for task_id, (task, vim_id) in tasks.items():
+                            if task_id not in not_written:
+                                task["persisted"] = True
+                                if self.journal:
+                                    self.journal.persist(task)
+                    except db_base_Exception as e:
+                        self.logger.error("Error updating database %s", str(e))
+            elapsed = time() - init_time
+            self.batches += 1
+            self.rows += len(pending)
+            self.last_batch_size = len(pending)
+            self.max_batch_size = max(self.max_batch_size, len(pending))
+            self.flush_time += elapsed
+            self.max_flush_time = max(self.max_flush_time, elapsed)
+            self.logger.debug("written %d task results in %.3f seconds", len(pending), elapsed)
+            if self.poller:
+                self.poller.wake(set(datacenter_id for _, _, _, _, datacenter_id in pending if datacenter_id), 0)
+
+    def close(self):
+        """Writes the pending results and stops the writer. Later results are written without delay"""
+        if not self.writer:
+            return
+        with self.lock:
+            self.closing = True
+            self.lock.notify()
+        self.writer.join()
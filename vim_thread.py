@@ -29,7 +29,6 @@ __author__ = "Alfonso Tierno"
 __date__ = "$10-feb-2017 12:07:15$"
 
 import threading
-import time
 import Queue
 import logging
 import vimconn
@@ -46,13 +45,22 @@ def is_task_id(id):
 
 class vim_thread(threading.Thread):
 
-    def __init__(self, vimconn, task_lock, name=None, datacenter_name=None, datacenter_tenant_id=None, db=None, db_lock=None):
+    def __init__(self, vimconn, task_lock, name=None, datacenter_name=None, datacenter_tenant_id=None, db=None, db_lock=None,
+                 workers=1, journal=None, thread_id=None, result_writer=None, delete_retries=3, delete_retry_delay=5,
+                 poller=None):
         """Init a thread.
         Arguments:
             'id' number of thead
             'name' name of thread
             'host','user':  host ip or name to manage and user
             'db', 'db_lock': database class and lock to use it in exclusion
+            'workers': number of tasks processed in parallel against this VIM. The thread itself is one of them
+            'journal', 'thread_id': task_journal where the tasks are recorded, and the identifier of this thread at it
+            'result_writer': task_result_writer used to write the results at database. If None they are written
+                directly by this thread
+            'delete_retries', 'delete_retry_delay': times a VIM delete that fails is retried, after a delay in seconds
+                that doubles at each retry
+            'poller': status_poller woken up when the VIM id of a created element is written at database
         """
         self.tasksResult = {}
         """ It will contain a dictionary with
@@ -75,80 +83,187 @@ class vim_thread(threading.Thread):
 
         self.task_lock = task_lock
         self.task_queue = Queue.Queue(2000)
+        # tasks whose dependencies are not finished yet. They are enqueued when the last of them finishes.
+        # Protected by task_lock. The tasks at 'depends' must be processed by this same thread
+        self.waiting_tasks = {}     # task_id: number of unfinished dependencies
+        self.dependants = {}        # task_id: list of waiting tasks that depends on it
+        self.pending_tasks = set()  # task_id of the unfinished tasks inserted at this thread
+        self.workers = workers if workers and workers > 1 else 1
+        self.journal = journal
+        self.thread_id = thread_id
+        self.result_writer = result_writer
+        self.delete_retries = delete_retries
+        self.delete_retry_delay = delete_retry_delay
+        self.poller = poller
 
     def insert_task(self, task):
+        """Inserts a task to be processed. If it depends on other tasks, it is not runnable until all of them finish,
+        and meanwhile it does not occupy any worker. The unfinished dependencies must be tasks of this same thread"""
+        with self.task_lock:
+            for depend in task.get("depends", {}).values():
+                if depend["status"] in ("enqueued", "processing") and depend["id"] not in self.pending_tasks:
+                    raise vimconn.vimconnException("{}: task {} depends on task {}, that is not processed by this "
+                                                   "thread".format(self.name, task["id"], depend["id"]))
+        if self.journal and task["name"] not in ("exit", "reload"):
+            self.journal.enqueue(self.thread_id, task)
+        with self.task_lock:
+            self.pending_tasks.add(task["id"])
+            unfinished = 0
+            for depend in task.get("depends", {}).values():
+                if depend["status"] in ("enqueued", "processing"):
+                    self.dependants.setdefault(depend["id"], []).append(task)
+                    unfinished += 1
+            if unfinished:
+                self.waiting_tasks[task["id"]] = unfinished
+                return task["id"]
         try:
             self.task_queue.put(task, False)
             return task["id"]
         except Queue.Full:
+            with self.task_lock:
+                self.pending_tasks.discard(task["id"])
             raise vimconn.vimconnException(self.name + ": timeout inserting a task")
 
+    def _release_dependants(self, task):
+        """Called with task_lock when a task finishes. Returns the waiting tasks that become runnable"""
+        self.pending_tasks.discard(task["id"])
+        runnable = []
+        for dependant in self.dependants.pop(task["id"], ()):
+            self.waiting_tasks[dependant["id"]] -= 1
+            if not self.waiting_tasks[dependant["id"]]:
+                del self.waiting_tasks[dependant["id"]]
+                runnable.append(dependant)
+        return runnable
+
+    def _enqueue_runnable(self, runnable):
+        for task in runnable:
+            try:
+                self.task_queue.put(task, False)
+            except Queue.Full:
+                self.logger.error("task id={} name={} cannot be enqueued: queue full".format(task["id"], task["name"]))
+                with self.task_lock:
+                    task["status"] = "error"
+                    task["result"] = "Cannot process task: " + self.name + " queue full"
+                    runnable += self._release_dependants(task)
+                if self.journal:
+                    self.journal.finish(task)
+
     def del_task(self, task):
+        """Marks an enqueued task as deleted, so it is skipped when dequeued. Returns False if it is already being
+        processed"""
         with self.task_lock:
             if task["status"] == "enqueued":
-                task["status"] == "deleted"
+                task["status"] = "deleted"
                 return True
             else:   # task["status"] == "processing"
-                self.task_lock.release()
                 return False
 
     def run(self):
         self.logger.debug("Starting")
+        workers = []
+        for index in range(1, self.workers):
+            worker = threading.Thread(target=self._run_worker, name="{}.{}".format(self.name, index))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+        self._run_worker()
+        for worker in workers:
+            worker.join()
+        self.logger.debug("Finishing")
+
+    def _run_worker(self):
         while True:
-            #TODO reload service
-            while True:
-                if not self.task_queue.empty():
-                    task = self.task_queue.get()
-                    self.task_lock.acquire()
-                    if task["status"] == "deleted":
-                        self.task_lock.release()
-                        continue
-                    task["status"] == "processing"
-                    self.task_lock.release()
-                else:
-                    now=time.time()
-                    time.sleep(1)
-                    continue
-                self.logger.debug("processing task id={} name={} params={}".format(task["id"], task["name"],
-                                                                                   str(task["params"])))
-                if task["name"] == 'exit' or task["name"] == 'reload':
-                    result, content = self.terminate(task)
-                elif task["name"] == 'new-vm':
-                    result, content = self.new_vm(task)
-                elif task["name"] == 'del-vm':
-                    result, content = self.del_vm(task)
-                elif task["name"] == 'new-net':
-                    result, content = self.new_net(task)
-                elif task["name"] == 'del-net':
-                    result, content = self.del_net(task)
+            # block until a task is inserted; 'exit' and 'reload' are also tasks, so they wake up the thread
+            task = self.task_queue.get()
+            if task is None:    # 'exit' processed by other worker
+                self.task_queue.task_done()
+                return 0
+            with self.task_lock:
+                if task["status"] == "deleted":
+                    runnable = self._release_dependants(task)
                 else:
-                    error_text = "unknown task {}".format(task["name"])
-                    self.logger.error(error_text)
-                    result = False
-                    content = error_text
+                    task["status"] = "processing"
+                    runnable = None
+            if runnable is not None:
+                if self.journal:
+                    self.journal.finish(task)
+                self._enqueue_runnable(runnable)
+                self.task_queue.task_done()
+                continue
+            self.logger.debug("processing task id={} name={} params={}".format(task["id"], task["name"],
+                                                                               str(task["params"])))
+            if self.journal and task["name"] not in ("exit", "reload"):
+                self.journal.start(task)
+            if task["name"] == 'exit' or task["name"] == 'reload':
+                #TODO reload service
+                result, content = self.terminate(task)
+            elif task["name"] == 'new-vm':
+                result, content = self.new_vm(task)
+            elif task["name"] == 'del-vm':
+                result, content = self.del_vm(task)
+            elif task["name"] == 'new-net':
+                result, content = self.new_net(task)
+            elif task["name"] == 'del-net':
+                result, content = self.del_net(task)
+            else:
+                error_text = "unknown task {}".format(task["name"])
+                self.logger.error(error_text)
+                result = False
+                content = error_text
 
-                with self.task_lock:
-                    task["status"] = "done" if result else "error"
-                    task["result"] = content
+            if not result and task.pop("retry", False) and task.get("retries", 0) < self.delete_retries:
+                self._retry_task(task, content)
                 self.task_queue.task_done()
+                continue
+            with self.task_lock:
+                task["status"] = "done" if result else "error"
+                task["result"] = content
+                runnable = self._release_dependants(task)
+            if self.journal and task["name"] not in ("exit", "reload"):
+                self.journal.finish(task)
+            self._enqueue_runnable(runnable)
+            self.task_queue.task_done()
 
-                if task["name"] == 'exit':
-                    return 0
-                elif task["name"] == 'reload':
-                    break
+            if task["name"] == 'exit':
+                # wake up the rest of workers, after the tasks already enqueued
+                for index in range(1, self.workers):
+                    self.task_queue.put(None)
+                return 0
 
-        self.logger.debug("Finishing")
+    def _retry_task(self, task, error_text):
+        """Enqueues again a failed task after a delay, that doubles at each retry. Meanwhile it keeps its dependants
+        waiting, and does not occupy any worker"""
+        with self.task_lock:
+            retries = task.get("retries", 0)
+            task["retries"] = retries + 1
+            task["status"] = "enqueued"
+            task["result"] = error_text
+        delay = self.delete_retry_delay * 2 ** retries
+        self.logger.warn("task id={} name={} failed: {}. Retry {} in {} seconds".format(task["id"], task["name"],
+                                                                                       error_text, retries + 1, delay))
+        timer = threading.Timer(delay, self._enqueue_runnable, ([task],))
+        timer.daemon = True
+        timer.start()
 
     def terminate(self, task):
         return True, None
 
+    def _write_result(self, task, table, column, vim_id):
+        """Replaces the task_id by the VIM id at the database"""
+        if self.result_writer:
+            self.result_writer.add(task, table, column, vim_id, self.vim["id"])
+            return
+        with self.db_lock:
+            if self.db.update_rows(table, UPDATE={column: vim_id}, WHERE={column: task["id"]}):
+                task["persisted"] = True
+        if self.poller:
+            self.poller.wake((self.vim["id"],), 0)
+
     def new_net(self, task):
         try:
-            task_id = task["id"]
             params = task["params"]
             net_id = self.vim.new_network(*params)
-            with self.db_lock:
-                self.db.update_rows("instance_nets", UPDATE={"vim_net_id": net_id}, WHERE={"vim_net_id": task_id})
+            self._write_result(task, "instance_nets", "vim_net_id", net_id)
             return True, net_id
         except db_base_Exception as e:
             self.logger.error("Error updating database %s", str(e))
@@ -170,6 +285,9 @@ class vim_thread(threading.Thread):
                             if task_net["status"] == "error":
                                 return False, "Cannot create VM because depends on a network that cannot be created: " + \
                                        str(task_net["result"])
+                            elif task_net["status"] == "deleted":
+                                return False, "Cannot create VM because depends on a network whose creation was " \
+                                              "deleted"
                             elif task_net["status"] == "enqueued" or task_net["status"] == "processing":
                                 return False, "Cannot create VM because depends on a network still not created"
                             network_id = task_net["result"]
@@ -178,8 +296,7 @@ class vim_thread(threading.Thread):
                         return False, "Error trying to map from task_id={} to task result: {}".format(net["net_id"],
                                                                                                       str(e))
             vm_id = self.vim.new_vminstance(*params)
-            with self.db_lock:
-                self.db.update_rows("instance_vms", UPDATE={"vim_vm_id": vm_id}, WHERE={"vim_vm_id": task_id})
+            self._write_result(task, "instance_vms", "vim_vm_id", vm_id)
             return True, vm_id
         except db_base_Exception as e:
             self.logger.error("Error updtaing database %s", str(e))
@@ -195,6 +312,8 @@ class vim_thread(threading.Thread):
                 with self.task_lock:
                     if task_create["status"] == "error":
                         return True, "VM was not created. It has error: " + str(task_create["result"])
+                    elif task_create["status"] == "deleted":
+                        return True, "VM was not created. Its creation was deleted"
                     elif task_create["status"] == "enqueued" or task_create["status"] == "processing":
                         return False, "Cannot delete VM because still creating"
                     vm_id = task_create["result"]
@@ -202,7 +321,10 @@ class vim_thread(threading.Thread):
                 return False, "Error trying to get task_id='{}':".format(vm_id, str(e))
         try:
             return True, self.vim.delete_vminstance(vm_id)
+        except vimconn.vimconnNotFoundException as e:
+            return True, "VM already deleted: " + str(e)
         except vimconn.vimconnException as e:
+            task["retry"] = True
             return False, str(e)
 
     def del_net(self, task):
@@ -213,6 +335,8 @@ class vim_thread(threading.Thread):
                 with self.task_lock:
                     if task_create["status"] == "error":
                         return True, "net was not created. It has error: " + str(task_create["result"])
+                    elif task_create["status"] == "deleted":
+                        return True, "net was not created. Its creation was deleted"
                     elif task_create["status"] == "enqueued" or task_create["status"] == "processing":
                         return False, "Cannot delete net because still creating"
                     net_id = task_create["result"]
@@ -220,7 +344,10 @@ class vim_thread(threading.Thread):
                 return False, "Error trying to get task_id='{}':".format(net_id, str(e))
         try:
             return True, self.vim.delete_network(net_id)
+        except vimconn.vimconnNotFoundException as e:
+            return True, "net already deleted: " + str(e)
         except vimconn.vimconnException as e:
+            task["retry"] = True
             return False, str(e)
 
 
@@ -29,6 +29,9 @@ __author__="Alfonso Tierno"
 __date__ ="$16-oct-2015 11:09:29$"
 
 import logging
+import json
+import hashlib
+import yaml
 
 #Error variables 
 HTTP_Bad_Request = 400
@@ -82,6 +85,30 @@ class vimconnNotImplemented(vimconnException):
     def __init__(self, message, http_code=HTTP_Not_Implemented):
         vimconnException.__init__(self, message, http_code)
 
+class lazy_vim_info(object):
+    """vim_info of an element returned by refresh_vms_status and refresh_nets_status. It keeps the object obtained from
+    the VIM and builds the yaml text only when str() is called. 'fingerprint' is a hash of the object, cheaper than the
+    yaml dump, used to skip the elements not changed since last refresh"""
+    def __init__(self, content, **dump_kwargs):
+        self.content = content
+        self.dump_kwargs = dump_kwargs
+        self._text = None
+        self._fingerprint = None
+
+    @property
+    def fingerprint(self):
+        if self._fingerprint is None:
+            self._fingerprint = hashlib.md5(json.dumps(self.content, sort_keys=True, default=str)).hexdigest()
+        return self._fingerprint
+
+    def __str__(self):
+        if self._text is None:
+            try:
+                self._text = yaml.safe_dump(self.content, **self.dump_kwargs)
+            except yaml.representer.RepresenterError:
+                self._text = str(self.content)
+        return self._text
+
 class vimconnector():
     """Abstract base class for all the VIM connector plugins
     These plugins must implement a vimconnector class derived from this 
@@ -323,6 +350,8 @@ class vimconnector():
 
     def new_image(self, image_dict):
         """ Adds a tenant image to VIM
+        image_dict can contain a 'local_path' with a local copy of the image at 'location', to be used instead of
+        downloading it again
         Returns the image id or raises an exception if failed
         """
         raise vimconnNotImplemented( "Should have implemented this" )
@@ -423,9 +452,9 @@ class vimconnector():
                                 #  ACTIVE:NoMgmtIP (Active but any of its interface has an IP address
                                 #
                     error_msg:  #Text with VIM error message, if any. Or the VIM connection ERROR 
-                    vim_info:   #Text with plain information obtained from vim (yaml.safe_dump)
+                    vim_info:   #Text with plain information obtained from vim (yaml.safe_dump), or a lazy_vim_info
                     interfaces: list with interface info. Each item a dictionary with:
-                        vim_info:         #Text with plain information obtained from vim (yaml.safe_dump)
+                        vim_info:         #Text with plain information obtained from vim (yaml.safe_dump), or a lazy_vim_info
                         mac_address:      #Text format XX:XX:XX:XX:XX:XX
                         vim_net_id:       #network id where this interface is connected, if provided at creation
                         vim_interface_id: #interface/port VIM id
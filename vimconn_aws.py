@@ -265,10 +265,7 @@ class vimconnector(vimconn.vimconnector):
                 else:
                     subnet_dict['status'] = 'DELETED'
                     subnet_dict['error_msg'] = 'Network not found'
-                try:
-                    subnet_dict['vim_info'] = yaml.safe_dump(subnet, default_flow_style=True, width=256)
-                except yaml.representer.RepresenterError:
-                    subnet_dict['vim_info'] = str(net_vim)
+                subnet_dict['vim_info'] = vimconn.lazy_vim_info(subnet, default_flow_style=True, width=256)
                 dict_entry[net]=subnet_dict
         except:
             self.logger.debug("Error in refresh_nets_status")
@@ -408,10 +405,7 @@ class vimconnector(vimconn.vimconnector):
                 else:
                     vm['status'] = "other"
                     vm['error_msg'] = "VIM status reported " + vm_vim['status']
-                try:
-                    vm['vim_info'] = yaml.safe_dump(vm_vim, default_flow_style=True, width=256)
-                except yaml.representer.RepresenterError:
-                    vm['vim_info'] = str(vm_vim)
+                vm['vim_info'] = vimconn.lazy_vim_info(vm_vim, default_flow_style=True, width=256)
                 vm["interfaces"] = []
                 if vm_vim.get('fault'):
                     vm['error_msg'] = str(vm_vim['fault'])
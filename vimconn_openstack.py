@@ -35,6 +35,8 @@ import netaddr
 import time
 import yaml
 import random
+import threading
+import hashlib
 
 from novaclient import client as nClient_v2, exceptions as nvExceptions
 from novaclient import api_versions
@@ -66,6 +68,75 @@ netStatus2manoFormat={'ACTIVE':'ACTIVE','PAUSED':'PAUSED','INACTIVE':'INACTIVE',
 #global var to have a timeout creating and deleting volumes
 volume_timeout = 60
 server_timeout = 60
+#max number of ids at the filter of a list call, to keep the request URL short
+list_filter_size = 50
+#servers requested per page when listing them. Nova returns at most its 'max_limit', by default 1000
+server_list_page_size = 1000
+#clients and token shared by the connectors with the same credentials, see _reload_connection
+session_cache = {}
+session_cache_lock = threading.Lock()
+#seconds before the token expiration when the shared clients are renewed
+token_refresh_margin = 300
+#seconds the flavor index is used before listing the flavors again. Can be changed with 'flavor_index_ttl' at config
+flavor_index_ttl = 300
+#seconds the image index is used before listing the images again. Can be changed with 'image_index_ttl' at config
+image_index_ttl = 300
+#image fields that can be looked up at the image index
+image_index_fields = ("id", "name", "checksum", "location")
+#bytes read from a local image file at a time while uploading it. Can be changed with 'image_upload_chunk_size' at config
+image_upload_chunk_size = 1024*1024
+#seconds to wait before retrying a failed upload, doubled at each retry
+image_upload_retry_delay = 5
+
+
+class image_upload_reader(object):
+    '''File-like wrapper of a local image file given to glance as the image data. It reads at most 'chunk_size' bytes
+    at a time, so the image is never loaded in memory, and computes its md5 and sha256 in the same pass.
+    Seeking to the start, as done to know the size or to send it again, resets the hashes'''
+    def __init__(self, fimage, chunk_size=image_upload_chunk_size):
+        self.fimage = fimage
+        self.chunk_size = chunk_size
+        self._reset()
+
+    def _reset(self):
+        self.md5 = hashlib.md5()
+        self.sha256 = hashlib.sha256()
+        self.bytes_read = 0
+        self.start_time = time.time()
+        self.end_time = None
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.chunk_size:
+            size = self.chunk_size
+        chunk = self.fimage.read(size)
+        if chunk:
+            self.md5.update(chunk)
+            self.sha256.update(chunk)
+            self.bytes_read += len(chunk)
+        elif self.end_time is None:
+            self.end_time = time.time()
+        return chunk
+
+    def __iter__(self):
+        while True:
+            chunk = self.read()
+            if not chunk:
+                return
+            yield chunk
+
+    def seek(self, offset, whence=0):
+        self.fimage.seek(offset, whence)
+        if self.fimage.tell() == 0:
+            self._reset()
+
+    def tell(self):
+        return self.fimage.tell()
+
+    def get_stats(self):
+        '''Returns a dictionary with the bytes read, the seconds spent and the throughput in MB/s'''
+        elapsed = (self.end_time or time.time()) - self.start_time
+        return {"bytes": self.bytes_read, "seconds": elapsed,
+                "MBps": self.bytes_read / (1024.0*1024.0) / elapsed if elapsed > 0 else 0}
 
 class vimconnector(vimconn.vimconnector):
     def __init__(self, uuid, name, tenant_id, tenant_name, url, url_admin=None, user=None, passwd=None,
@@ -109,6 +180,12 @@ class vimconnector(vimconn.vimconnector):
             self.n_creds['region_name'] = config.get('region_name')
 
         self.reload_client       = True
+        self.session = None
+        self.lock = threading.RLock()   # guards the credentials, clients and indexes, as the connector is shared by threads
+        self.flavor_index = None        # (ram, vcpus, disk, extra specs): flavor_id, see _get_flavor_index
+        self.flavor_index_time = 0
+        self.image_index = None         # (field, value): [image dict], see _get_image_index
+        self.image_index_time = 0
         self.logger = logging.getLogger('openmano.vim.openstack')
         if log_level:
             self.logger.setLevel( getattr(logging, log_level) )
@@ -117,94 +194,126 @@ class vimconnector(vimconn.vimconnector):
         '''Set individuals parameters 
         Throw TypeError, KeyError
         '''
-        if index=='tenant_id':
-            self.reload_client=True
-            self.tenant_id = value
-            if self.osc_api_version == 'v3.3':
-                if value:
-                    self.k_creds['project_id'] = value
-                    self.n_creds['project_id']  = value
+        with self.lock:
+            if index=='tenant_id':
+                self.reload_client=True
+                self.tenant_id = value
+                if self.osc_api_version == 'v3.3':
+                    if value:
+                        self.k_creds['project_id'] = value
+                        self.n_creds['project_id']  = value
+                    else:
+                        del self.k_creds['project_id']
+                        del self.n_creds['project_id']
                 else:
-                    del self.k_creds['project_id']
-                    del self.n_creds['project_id']
-            else:
+                    if value:
+                        self.k_creds['tenant_id'] = value
+                        self.n_creds['tenant_id']  = value
+                    else:
+                        del self.k_creds['tenant_id']
+                        del self.n_creds['tenant_id']
+            elif index=='tenant_name':
+                self.reload_client=True
+                self.tenant_name = value
+                if self.osc_api_version == 'v3.3':
+                    if value:
+                        self.k_creds['project_name'] = value
+                        self.n_creds['project_name']  = value
+                    else:
+                        del self.k_creds['project_name']
+                        del self.n_creds['project_name']
+                else:
+                    if value:
+                        self.k_creds['tenant_name'] = value
+                        self.n_creds['project_id']  = value
+                    else:
+                        del self.k_creds['tenant_name']
+                        del self.n_creds['project_id']
+            elif index=='user':
+                self.reload_client=True
+                self.user = value
                 if value:
-                    self.k_creds['tenant_id'] = value
-                    self.n_creds['tenant_id']  = value
+                    self.k_creds['username'] = value
+                    self.n_creds['username'] = value
                 else:
-                    del self.k_creds['tenant_id']
-                    del self.n_creds['tenant_id']
-        elif index=='tenant_name':
-            self.reload_client=True
-            self.tenant_name = value
-            if self.osc_api_version == 'v3.3':
+                    del self.k_creds['username']
+                    del self.n_creds['username']
+            elif index=='passwd':
+                self.reload_client=True
+                self.passwd = value
                 if value:
-                    self.k_creds['project_name'] = value
-                    self.n_creds['project_name']  = value
+                    self.k_creds['password'] = value
+                    self.n_creds['api_key']  = value
                 else:
-                    del self.k_creds['project_name']
-                    del self.n_creds['project_name']
-            else:
+                    del self.k_creds['password']
+                    del self.n_creds['api_key']
+            elif index=='url':
+                self.reload_client=True
+                self.url = value
                 if value:
-                    self.k_creds['tenant_name'] = value
-                    self.n_creds['project_id']  = value
+                    self.k_creds['auth_url'] = value
+                    self.n_creds['auth_url'] = value
                 else:
-                    del self.k_creds['tenant_name']
-                    del self.n_creds['project_id']
-        elif index=='user':
-            self.reload_client=True
-            self.user = value
-            if value:
-                self.k_creds['username'] = value
-                self.n_creds['username'] = value
-            else:
-                del self.k_creds['username']
-                del self.n_creds['username']
-        elif index=='passwd':
-            self.reload_client=True
-            self.passwd = value
-            if value:
-                self.k_creds['password'] = value
-                self.n_creds['api_key']  = value
+                    raise TypeError, 'url param can not be NoneType'
             else:
-                del self.k_creds['password']
-                del self.n_creds['api_key']
-        elif index=='url':
-            self.reload_client=True
-            self.url = value
-            if value:
-                self.k_creds['auth_url'] = value
-                self.n_creds['auth_url'] = value
-            else:
-                raise TypeError, 'url param can not be NoneType'
-        else:
-            vimconn.vimconnector.__setitem__(self,index, value)
+                vimconn.vimconnector.__setitem__(self,index, value)
      
     def _reload_connection(self):
         '''Called before any operation, it check if credentials has changed
         Throw keystoneclient.apiclient.exceptions.AuthorizationFailure
+        The clients, with their token and HTTP connections, are shared by all the connectors with the same credentials.
+        They are created again when the token is going to expire
         '''
-        #TODO control the timing and possible token timeout, but it seams that python client does this task for us :-) 
-        if self.reload_client:
-            #test valid params
-            if len(self.n_creds) <4:
-                raise ksExceptions.ClientException("Not enough parameters to connect to openstack")
-            if self.osc_api_version == 'v3.3':
-                self.nova = nClient(api_version=api_versions.APIVersion(version_str='2.0'), **self.n_creds)
-                #TODO To be updated for v3
-                #self.cinder = cClient.Client(**self.n_creds)
-                self.keystone = ksClient.Client(**self.k_creds)
-                self.ne_endpoint=self.keystone.service_catalog.url_for(service_type='network', endpoint_type='publicURL')
-                self.neutron = neClient.Client(api_version=api_versions.APIVersion(version_str='2.0'), endpoint_url=self.ne_endpoint, token=self.keystone.auth_token, **self.k_creds)
-            else:
-                self.nova = nClient_v2.Client(version='2', **self.n_creds)
-                self.cinder = cClient_v2.Client(**self.n_creds)
-                self.keystone = ksClient_v2.Client(**self.k_creds)
-                self.ne_endpoint=self.keystone.service_catalog.url_for(service_type='network', endpoint_type='publicURL')
-                self.neutron = neClient_v2.Client('2.0', endpoint_url=self.ne_endpoint, token=self.keystone.auth_token, **self.k_creds)
-            self.glance_endpoint = self.keystone.service_catalog.url_for(service_type='image', endpoint_type='publicURL')
-            self.glance = glClient.Client(self.glance_endpoint, token=self.keystone.auth_token, **self.k_creds)  #TODO check k_creds vs n_creds
-            self.reload_client = False
+        with self.lock:
+            if self.reload_client or self._session_expiring(self.session):
+                #test valid params
+                if len(self.n_creds) <4:
+                    raise ksExceptions.ClientException("Not enough parameters to connect to openstack")
+                session_key = json.dumps([self.osc_api_version, self.k_creds, self.n_creds], sort_keys=True)
+                with session_cache_lock:
+                    session = session_cache.get(session_key)
+                if not session or self._session_expiring(session):
+                    session = self._new_session()
+                    with session_cache_lock:
+                        session_cache[session_key] = session
+                self.session = session
+                for client in ("nova", "cinder", "keystone", "ne_endpoint", "neutron", "glance_endpoint", "glance",
+                               "glance_v1"):
+                    if client in session:
+                        setattr(self, client, session[client])
+                self.reload_client = False
+
+    @staticmethod
+    def _session_expiring(session):
+        '''True if the token of these shared clients expires in less than token_refresh_margin seconds'''
+        if not session:
+            return False
+        auth_ref = getattr(session["keystone"], "auth_ref", None)
+        if auth_ref is None or not hasattr(auth_ref, "will_expire_soon"):
+            return False
+        return auth_ref.will_expire_soon(stale_duration=token_refresh_margin)
+
+    def _new_session(self):
+        '''Authenticates and creates the clients. Returns a dictionary with them'''
+        session = {}
+        if self.osc_api_version == 'v3.3':
+            session["nova"] = nClient(api_version=api_versions.APIVersion(version_str='2.0'), **self.n_creds)
+            #TODO To be updated for v3
+            #session["cinder"] = cClient.Client(**self.n_creds)
+            session["keystone"] = ksClient.Client(**self.k_creds)
+            session["ne_endpoint"] = session["keystone"].service_catalog.url_for(service_type='network', endpoint_type='publicURL')
+            session["neutron"] = neClient.Client(api_version=api_versions.APIVersion(version_str='2.0'), endpoint_url=session["ne_endpoint"], token=session["keystone"].auth_token, **self.k_creds)
+        else:
+            session["nova"] = nClient_v2.Client(version='2', **self.n_creds)
+            session["cinder"] = cClient_v2.Client(**self.n_creds)
+            session["keystone"] = ksClient_v2.Client(**self.k_creds)
+            session["ne_endpoint"] = session["keystone"].service_catalog.url_for(service_type='network', endpoint_type='publicURL')
+            session["neutron"] = neClient_v2.Client('2.0', endpoint_url=session["ne_endpoint"], token=session["keystone"].auth_token, **self.k_creds)
+        session["glance_endpoint"] = session["keystone"].service_catalog.url_for(service_type='image', endpoint_type='publicURL')
+        session["glance"] = glClient.Client(session["glance_endpoint"], token=session["keystone"].auth_token, **self.k_creds)  #TODO check k_creds vs n_creds
+        #version 1 of glance client, used for creating images
+        session["glance_v1"] = gl1Client.Client('1', session["glance_endpoint"], token=session["keystone"].auth_token, **self.k_creds)  #TODO check k_creds vs n_creds
+        return session
 
     def __net_os2mano(self, net_list_dict):
         '''Transform the net openstack format to mano format
@@ -229,11 +338,12 @@ class vimconnector(vimconn.vimconnector):
                                   ConnectionError, ksExceptions.ConnectionError, neExceptions.ConnectionFailed
                                   )):
             raise vimconn.vimconnConnectionException(type(exception).__name__ + ": " + str(exception))            
+        elif isinstance(exception, (neExceptions.NetworkNotFoundClient, nvExceptions.NotFound)):
+            # before ClientException and NeutronException, that are their base classes
+            raise vimconn.vimconnNotFoundException(type(exception).__name__ + ": " + str(exception))
         elif isinstance(exception, (nvExceptions.ClientException, ksExceptions.ClientException, 
                                     neExceptions.NeutronException, nvExceptions.BadRequest)):
             raise vimconn.vimconnUnexpectedResponse(type(exception).__name__ + ": " + str(exception))
-        elif isinstance(exception, (neExceptions.NetworkNotFoundClient, nvExceptions.NotFound)):
-            raise vimconn.vimconnNotFoundException(type(exception).__name__ + ": " + str(exception))
         elif isinstance(exception, nvExceptions.Conflict):
             raise vimconn.vimconnConflictException(type(exception).__name__ + ": " + str(exception))
         else: # ()
@@ -425,37 +535,65 @@ class vimconnector(vimconn.vimconnector):
                     error_msg:  #Text with VIM error message, if any. Or the VIM connection ERROR 
                     vim_info:   #Text with plain information obtained from vim (yaml.safe_dump)
 
+           The networks and their subnets are obtained with list calls filtered by id, of up to list_filter_size ids
         '''        
         net_dict={}
+        if not net_list:
+            return net_dict
+        try:
+            nets_vim = self._get_networks(net_list)
+        except vimconn.vimconnException as e:
+            self.logger.error("Exception getting net status: %s", str(e))
+            for net_id in net_list:
+                net_dict[net_id] = {'status': "VIM_ERROR", 'error_msg': str(e)}
+            return net_dict
         for net_id in net_list:
             net = {}
-            try:
-                net_vim = self.get_network(net_id)
-                if net_vim['status'] in netStatus2manoFormat:
-                    net["status"] = netStatus2manoFormat[ net_vim['status'] ]
-                else:
-                    net["status"] = "OTHER"
-                    net["error_msg"] = "VIM status reported " + net_vim['status']
-                    
-                if net['status'] == "ACTIVE" and not net_vim['admin_state_up']:
-                    net['status'] = 'DOWN'
-                try:
-                    net['vim_info'] = yaml.safe_dump(net_vim, default_flow_style=True, width=256)
-                except yaml.representer.RepresenterError:
-                    net['vim_info'] = str(net_vim)
-                if net_vim.get('fault'):  #TODO
-                    net['error_msg'] = str(net_vim['fault'])
-            except vimconn.vimconnNotFoundException as e:
-                self.logger.error("Exception getting net status: %s", str(e))
+            net_vim = nets_vim.get(net_id)
+            if net_vim is None:
+                error_text = "Network '{}' not found".format(net_id)
+                self.logger.error("Exception getting net status: %s", error_text)
                 net['status'] = "DELETED"
-                net['error_msg'] = str(e)
-            except vimconn.vimconnException as e:
-                self.logger.error("Exception getting net status: %s", str(e))
-                net['status'] = "VIM_ERROR"
-                net['error_msg'] = str(e)
+                net['error_msg'] = error_text
+                net_dict[net_id] = net
+                continue
+            if net_vim['status'] in netStatus2manoFormat:
+                net["status"] = netStatus2manoFormat[ net_vim['status'] ]
+            else:
+                net["status"] = "OTHER"
+                net["error_msg"] = "VIM status reported " + net_vim['status']
+
+            if net['status'] == "ACTIVE" and not net_vim['admin_state_up']:
+                net['status'] = 'DOWN'
+            net['vim_info'] = vimconn.lazy_vim_info(net_vim, default_flow_style=True, width=256)
+            if net_vim.get('fault'):  #TODO
+                net['error_msg'] = str(net_vim['fault'])
             net_dict[net_id] = net
         return net_dict
 
+    def _get_networks(self, net_list):
+        '''Returns a dictionary net_id: network, as get_network, with the networks of net_list found at VIM'''
+        net_ids = list(set(net_list))
+        nets = {}
+        for index in range(0, len(net_ids), list_filter_size):
+            for net in self.get_network_list({"id": net_ids[index:index + list_filter_size]}):
+                nets[net["id"]] = net
+        subnet_ids = list(set(subnet_id for net in nets.values() for subnet_id in net.get("subnets", ())))
+        subnets = {}
+        try:
+            for index in range(0, len(subnet_ids), list_filter_size):
+                for subnet in self.neutron.list_subnets(id=subnet_ids[index:index + list_filter_size])["subnets"]:
+                    subnets[subnet["id"]] = subnet
+            subnets_error = "Subnet not found"
+        except Exception as e:
+            self.logger.error("osconnector.get_network(): Error getting subnets %s" % str(e))
+            subnets_error = str(e)
+        for net in nets.values():
+            # same content than get_network, that uses show_subnet: {"subnet": {...}}, or the id and fault if not found
+            net["subnets"] = [{"subnet": subnets[subnet_id]} if subnet_id in subnets else
+                              {"id": subnet_id, "fault": subnets_error} for subnet_id in net.get("subnets", ())]
+        return nets
+
     def get_flavor(self, flavor_id):
         '''Obtain flavor details from the  VIM. Returns the flavor dict details'''
         self.logger.debug("Getting flavor '%s'", flavor_id)
@@ -468,36 +606,75 @@ class vimconnector(vimconn.vimconnector):
             self._format_exception(e)
 
     def get_flavor_id_from_data(self, flavor_dict):
-        """Obtain flavor id that match the flavor description
+        """Obtain flavor id that match the flavor description, including its EPA/NUMA requirements
            Returns the flavor_id or raises a vimconnNotFoundException
         """
         try:
-            self._reload_connection()
-            numa=None
-            numas = flavor_dict.get("extended",{}).get("numas")
-            if numas:
-                #TODO
-                raise vimconn.vimconnNotFoundException("Flavor with EPA still not implemted")
-                # if len(numas) > 1:
-                #     raise vimconn.vimconnNotFoundException("Cannot find any flavor with more than one numa")
-                # numa=numas[0]
-                # numas = extended.get("numas")
-            for flavor in self.nova.flavors.list():
-                epa = flavor.get_keys()
-                if epa:
-                    continue
-                    #TODO 
-                if flavor.ram != flavor_dict["ram"]:
-                    continue
-                if flavor.vcpus != flavor_dict["vcpus"]:
-                    continue
-                if flavor.disk != flavor_dict["disk"]:
-                    continue
-                return flavor.id
-            raise vimconn.vimconnNotFoundException("Cannot find any flavor matching '{}'".format(str(flavor_dict)))
+            ram, vcpus, extra_specs = self._get_flavor_epa(flavor_dict)
+        except vimconn.vimconnNotSupportedException as e:
+            raise vimconn.vimconnNotFoundException("Cannot find any flavor matching '{}': {}".format(str(flavor_dict),
+                                                                                                    str(e)))
+        try:
+            flavor_key = (ram, vcpus, flavor_dict.get('disk', 1), tuple(sorted((extra_specs or {}).items())))
+            flavor_id = self._get_flavor_index().get(flavor_key)
         except (nvExceptions.NotFound, nvExceptions.ClientException, ksExceptions.ClientException, ConnectionError) as e:
             self._format_exception(e)
+        if not flavor_id:
+            raise vimconn.vimconnNotFoundException("Cannot find any flavor matching '{}'".format(str(flavor_dict)))
+        return flavor_id
 
+    def _get_flavor_index(self):
+        '''Returns a dictionary (ram, vcpus, disk, sorted tuple of extra specs): flavor_id with the flavors of the VIM.
+        It is built listing the flavors and their keys, and kept during 'flavor_index_ttl' seconds'''
+        ttl = self.config.get('flavor_index_ttl', flavor_index_ttl)
+        with self.lock:
+            if self.flavor_index is None or time.time() - self.flavor_index_time > ttl:
+                self._reload_connection()
+                index_time = time.time()
+                flavor_index = {}
+                for flavor in self.nova.flavors.list():
+                    flavor_key = (flavor.ram, flavor.vcpus, flavor.disk, tuple(sorted(flavor.get_keys().items())))
+                    if flavor_key not in flavor_index:
+                        flavor_index[flavor_key] = flavor.id
+                self.flavor_index = flavor_index
+                self.flavor_index_time = index_time
+            return self.flavor_index
+
+    def _get_flavor_epa(self, flavor_data):
+        '''Returns the ram, vcpus and extra specs (a dictionary or None) of the openstack flavor for flavor_data,
+        translating the EPA/NUMA requirements at 'extended'. Raises vimconnNotSupportedException if not possible'''
+        ram = flavor_data.get('ram',64)
+        vcpus = flavor_data.get('vcpus',1)
+        numa_properties=None
+
+        extended = flavor_data.get("extended")
+        if extended:
+            numas=extended.get("numas")
+            if numas:
+                numa_nodes = len(numas)
+                if numa_nodes > 1:
+                    raise vimconn.vimconnNotSupportedException("Can not add flavor with more than one numa")
+                numa_properties = {"hw:numa_nodes":str(numa_nodes)}
+                numa_properties["hw:mem_page_size"] = "large"
+                numa_properties["hw:cpu_policy"] = "dedicated"
+                numa_properties["hw:numa_mempolicy"] = "strict"
+                for numa in numas:
+                    #overwrite ram and vcpus
+                    ram = numa['memory']*1024
+                    if 'paired-threads' in numa:
+                        vcpus = numa['paired-threads']*2
+                        numa_properties["hw:cpu_threads_policy"] = "prefer"
+                    elif 'cores' in numa:
+                        vcpus = numa['cores']
+                        #numa_properties["hw:cpu_threads_policy"] = "prefer"
+                    elif 'threads' in numa:
+                        vcpus = numa['threads']
+                        numa_properties["hw:cpu_policy"] = "isolated"
+                    for interface in numa.get("interfaces",() ):
+                        if interface["dedicated"]=="yes":
+                            raise vimconn.vimconnNotSupportedException("Passthrough interfaces are not supported for the openstack connector")
+                        #TODO, add the key 'pci_passthrough:alias"="<label at config>:<number ifaces>"' when a way to connect it is available
+        return ram, vcpus, numa_properties
 
     def new_flavor(self, flavor_data, change_name_if_used=True):
         '''Adds a tenant flavor to openstack VIM
@@ -509,6 +686,7 @@ class vimconnector(vimconn.vimconnector):
         max_retries=3
         name_suffix = 0
         name=flavor_data['name']
+        ram, vcpus, numa_properties = self._get_flavor_epa(flavor_data)
         while retry<max_retries:
             retry+=1
             try:
@@ -522,39 +700,7 @@ class vimconnector(vimconn.vimconnector):
                     while name in fl_names:
                         name_suffix += 1
                         name = flavor_data['name']+"-" + str(name_suffix)
-                        
-                ram = flavor_data.get('ram',64)
-                vcpus = flavor_data.get('vcpus',1)
-                numa_properties=None
-
-                extended = flavor_data.get("extended")
-                if extended:
-                    numas=extended.get("numas")
-                    if numas:
-                        numa_nodes = len(numas)
-                        if numa_nodes > 1:
-                            return -1, "Can not add flavor with more than one numa"
-                        numa_properties = {"hw:numa_nodes":str(numa_nodes)}
-                        numa_properties["hw:mem_page_size"] = "large"
-                        numa_properties["hw:cpu_policy"] = "dedicated"
-                        numa_properties["hw:numa_mempolicy"] = "strict"
-                        for numa in numas:
-                            #overwrite ram and vcpus
-                            ram = numa['memory']*1024
-                            if 'paired-threads' in numa:
-                                vcpus = numa['paired-threads']*2
-                                numa_properties["hw:cpu_threads_policy"] = "prefer"
-                            elif 'cores' in numa:
-                                vcpus = numa['cores']
-                                #numa_properties["hw:cpu_threads_policy"] = "prefer"
-                            elif 'threads' in numa:
-                                vcpus = numa['threads']
-                                numa_properties["hw:cpu_policy"] = "isolated"
-                            for interface in numa.get("interfaces",() ):
-                                if interface["dedicated"]=="yes":
-                                    raise vimconn.vimconnException("Passthrough interfaces are not supported for the openstack connector", http_code=vimconn.HTTP_Service_Unavailable)
-                                #TODO, add the key 'pci_passthrough:alias"="<label at config>:<number ifaces>"' when a way to connect it is available
-                                
+
                 #create flavor                 
                 new_flavor=self.nova.flavors.create(name, 
                                 ram, 
@@ -565,6 +711,11 @@ class vimconnector(vimconn.vimconnector):
                 #add metadata
                 if numa_properties:
                     new_flavor.set_keys(numa_properties)
+                with self.lock:
+                    if self.flavor_index is not None:
+                        flavor_key = (ram, vcpus, flavor_data.get('disk',1),
+                                      tuple(sorted((numa_properties or {}).items())))
+                        self.flavor_index.setdefault(flavor_key, new_flavor.id)
                 return new_flavor.id
             except nvExceptions.Conflict as e:
                 if change_name_if_used and retry < max_retries:
@@ -580,6 +731,8 @@ class vimconnector(vimconn.vimconnector):
         try:
             self._reload_connection()
             self.nova.flavors.delete(flavor_id)
+            with self.lock:
+                self.flavor_index = None
             return flavor_id
         #except nvExceptions.BadRequest as e:
         except (nvExceptions.NotFound, ksExceptions.ClientException, nvExceptions.ClientException, ConnectionError) as e:
@@ -593,14 +746,19 @@ class vimconnector(vimconn.vimconnector):
             location: path or URI
             public: "yes" or "no"
             metadata: metadata of the image
+            checksum: (optional) md5 that a local file must have
+            local_path: (optional) local copy of the image at location, uploaded instead of letting glance get it
+        A local file is streamed to glance, computing its md5 and sha256 in the same pass; they are added to image_dict
+        as 'checksum' and 'sha256'. Glance cannot resume an upload, so a transfer error uploads it again from the start
+        after a delay. The image created by a failed attempt is deleted before retrying or raising
         Returns the image_id
         '''
-        #using version 1 of glance client
-        glancev1 = gl1Client.Client('1',self.glance_endpoint, token=self.keystone.auth_token, **self.k_creds)  #TODO check k_creds vs n_creds
         retry=0
         max_retries=3
+        retry_delay = image_upload_retry_delay
         while retry<max_retries:
             retry+=1
+            new_image = None    # created at glance by this attempt, deleted if it fails
             try:
                 self._reload_connection()
                 #determine format  http://docs.openstack.org/developer/glance/formats.html
@@ -626,13 +784,14 @@ class vimconnector(vimconn.vimconnector):
                     else:
                         disk_format="raw"
                 self.logger.debug("new_image: '%s' loading from '%s'", image_dict['name'], image_dict['location'])
-                if image_dict['location'][0:4]=="http":
-                    new_image = glancev1.images.create(name=image_dict['name'], is_public=image_dict.get('public',"yes")=="yes",
+                if image_dict['location'][0:4]=="http" and not image_dict.get('local_path'):
+                    new_image = self.glance_v1.images.create(name=image_dict['name'], is_public=image_dict.get('public',"yes")=="yes",
                             container_format="bare", location=image_dict['location'], disk_format=disk_format)
                 else: #local path
-                    with open(image_dict['location']) as fimage:
-                        new_image = glancev1.images.create(name=image_dict['name'], is_public=image_dict.get('public',"yes")=="yes",
-                            container_format="bare", data=fimage, disk_format=disk_format)
+                    #the image is created before sending its data, so that it can be deleted if the transfer fails
+                    new_image = self.glance_v1.images.create(name=image_dict['name'], is_public=image_dict.get('public',"yes")=="yes",
+                            container_format="bare", disk_format=disk_format)
+                    new_image = self._upload_image(new_image, image_dict)
                 #insert metadata. We cannot use 'new_image.properties.setdefault' 
                 #because nova and glance are "INDEPENDENT" and we are using nova for reading metadata
                 new_image_nova=self.nova.images.find(id=new_image.id)
@@ -641,23 +800,72 @@ class vimconnector(vimconn.vimconnector):
                 if metadata_to_load:
                     for k,v in yaml.load(metadata_to_load).iteritems():
                         new_image_nova.metadata.setdefault(k,v)
-                return new_image.id
+                with self.lock:
+                    self.image_index = None
+                image_id = new_image.id
+                new_image = None
+                return image_id
             except (nvExceptions.Conflict, ksExceptions.ClientException, nvExceptions.ClientException) as e:
                 self._format_exception(e)
-            except (HTTPException, gl1Exceptions.HTTPException, gl1Exceptions.CommunicationError, ConnectionError) as e:
-                if retry==max_retries:
-                    continue
-                self._format_exception(e)
+            except (HTTPException, gl1Exceptions.HTTPException, gl1Exceptions.CommunicationError, ConnectionError,
+                    vimconn.vimconnConnectionException) as e:
+                #retry the transfer errors, and the glance server errors, but not the glance client errors
+                if retry==max_retries or getattr(e, "code", 500) < 500:
+                    if isinstance(e, vimconn.vimconnException):
+                        raise
+                    self._format_exception(e)
+                self.logger.warn("new_image: error uploading '%s': %s. Retrying in %s seconds", image_dict['location'],
+                                 str(e), retry_delay)
+                time.sleep(retry_delay)
+                retry_delay *= 2
             except IOError as e:  #can not open the file
                 raise vimconn.vimconnConnectionException(type(e).__name__ + ": " + str(e)+ " for " + image_dict['location'],
                                                          http_code=vimconn.HTTP_Bad_Request)
-     
+            finally:
+                if new_image is not None:
+                    self._delete_failed_image(new_image.id)
+
+    def _delete_failed_image(self, image_id):
+        '''Deletes the image left at glance by a failed new_image attempt, logging the error if it cannot'''
+        try:
+            self.glance_v1.images.delete(image_id)
+        except (HTTPException, gl1Exceptions.HTTPException, gl1Exceptions.CommunicationError, ConnectionError) as e:
+            self.logger.error("new_image: cannot delete the failed image '%s': %s", image_id, str(e))
+
+    def _upload_image(self, new_image, image_dict):
+        '''Streams the local image file at image_dict 'local_path' or 'location' to the glance image new_image, checking its md5 against
+        the 'checksum' of image_dict, if present, and against the one computed by glance. Returns the updated glance image'''
+        chunk_size = self.config.get('image_upload_chunk_size', image_upload_chunk_size)
+        with open(image_dict.get('local_path') or image_dict['location'], "rb") as fimage:
+            reader = image_upload_reader(fimage, chunk_size)
+            new_image = self.glance_v1.images.update(new_image.id, data=reader)
+        stats = reader.get_stats()
+        self.logger.info("new_image: '%s' uploaded %d bytes in %.1f seconds, %.1f MB/s", image_dict['location'],
+                         stats["bytes"], stats["seconds"], stats["MBps"])
+        checksum = reader.md5.hexdigest()
+        error_text = None
+        if getattr(new_image, "checksum", None) and new_image.checksum != checksum:
+            error_text = "checksum mismatch after uploading '{}': '{}' at VIM, '{}' sent".format(
+                image_dict['location'], new_image.checksum, checksum)
+            exception = vimconn.vimconnConnectionException
+        elif image_dict.get('checksum') and image_dict['checksum'] != checksum:
+            error_text = "image file '{}' has checksum '{}', but '{}' is expected".format(
+                image_dict['location'], checksum, image_dict['checksum'])
+            exception = vimconn.vimconnException
+        if error_text:
+            raise exception(error_text)
+        image_dict['checksum'] = checksum
+        image_dict['sha256'] = reader.sha256.hexdigest()
+        return new_image
+
     def delete_image(self, image_id):
         '''Deletes a tenant image from openstack VIM. Returns the old id
         '''
         try:
             self._reload_connection()
             self.nova.images.delete(image_id)
+            with self.lock:
+                self.image_index = None
             return image_id
         except (nvExceptions.NotFound, ksExceptions.ClientException, nvExceptions.ClientException, gl1Exceptions.CommunicationError, ConnectionError) as e: #TODO remove
             self._format_exception(e)
@@ -665,14 +873,51 @@ class vimconnector(vimconn.vimconnector):
     def get_image_id_from_path(self, path):
         '''Get the image id from image path in the VIM database. Returns the image_id''' 
         try:
-            self._reload_connection()
-            images = self.nova.images.list()
-            for image in images:
-                if image.metadata.get("location")==path:
-                    return image.id
-            raise vimconn.vimconnNotFoundException("image with location '{}' not found".format( path))
-        except (ksExceptions.ClientException, nvExceptions.ClientException, gl1Exceptions.CommunicationError, ConnectionError) as e:
+            images = self._find_images({"location": path})
+        except (ksExceptions.ClientException, nvExceptions.ClientException, gl1Exceptions.HTTPException,
+                gl1Exceptions.CommunicationError, ConnectionError) as e:
             self._format_exception(e)
+        if not images:
+            raise vimconn.vimconnNotFoundException("image with location '{}' not found".format( path))
+        return images[0]["id"]
+
+    def _get_image_index(self, force=False):
+        '''Returns a dictionary (field, value): [image dict] with the images of the VIM for the image_index_fields, and
+        (None, None): [all the images]. It is built with one listing at glance, and kept during 'image_index_ttl' seconds
+        or until an image is created or deleted by this connector'''
+        ttl = self.config.get('image_index_ttl', image_index_ttl)
+        with self.lock:
+            if force or self.image_index is None or time.time() - self.image_index_time > ttl:
+                self._reload_connection()
+                index_time = time.time()
+                image_index = {(None, None): []}
+                for image in self.glance.images.list():
+                    image = image.copy()
+                    image_index[(None, None)].append(image)
+                    for field in image_index_fields:
+                        if image.get(field):
+                            image_index.setdefault((field, image[field]), []).append(image)
+                self.image_index = image_index
+                self.image_index_time = index_time
+            return self.image_index
+
+    def _find_images(self, filter_dict):
+        '''Returns the list of image dicts of the index that match all the fields of filter_dict.
+        When nothing matches, the images are listed again once, as they can be created out of this connector'''
+        for force in (False, True):
+            if force and time.time() - self.image_index_time < 1:
+                break    # just listed
+            image_index = self._get_image_index(force=force)
+            key = (None, None)
+            for field in image_index_fields:
+                if filter_dict.get(field):
+                    key = (field, filter_dict[field])
+                    break
+            images = [image for image in image_index.get(key, ())
+                      if all(image.get(k) == v for k, v in filter_dict.items())]
+            if images:
+                return images
+        return []
         
     def get_image_list(self, filter_dict={}):
         '''Obtain tenant images from VIM
@@ -686,21 +931,9 @@ class vimconnector(vimconn.vimconnector):
         '''
         self.logger.debug("Getting image list from VIM filter: '%s'", str(filter_dict))
         try:
-            self._reload_connection()
-            filter_dict_os=filter_dict.copy()
-            #First we filter by the available filter fields: name, id. The others are removed.
-            filter_dict_os.pop('checksum',None)
-            image_list=self.nova.images.findall(**filter_dict_os)
-            if len(image_list)==0:
-                return []
-            #Then we filter by the rest of filter fields: checksum
-            filtered_list = []
-            for image in image_list:
-                image_class=self.glance.images.get(image.id)
-                if 'checksum' not in filter_dict or image_class['checksum']==filter_dict.get('checksum'):
-                    filtered_list.append(image_class.copy())
-            return filtered_list
-        except (ksExceptions.ClientException, nvExceptions.ClientException, gl1Exceptions.CommunicationError, ConnectionError) as e:
+            return [image.copy() for image in self._find_images(filter_dict)]
+        except (ksExceptions.ClientException, nvExceptions.ClientException, gl1Exceptions.HTTPException,
+                gl1Exceptions.CommunicationError, ConnectionError) as e:
             self._format_exception(e)
 
     def new_vminstance(self,name,description,start,image_id,flavor_id,net_list,cloud_config=None,disk_list=None):
@@ -1092,50 +1325,55 @@ class vimconnector(vimconn.vimconnector):
                         vim_net_id:       #network id where this interface is connected
                         vim_interface_id: #interface/port VIM id
                         ip_address:       #null, or text with IPv4, IPv6 address
+           The VMs, ports and floating ips are obtained with list calls and joined here, instead of asking for each VM,
+           port and floating ip. VMs not found at the list are asked individually
         '''
         vm_dict={}
         self.logger.debug("refresh_vms status: Getting tenant VM instance information from VIM")
+        if not vm_list:
+            return vm_dict
+        try:
+            servers = self._get_vm_servers(vm_list)
+        except vimconn.vimconnException as e:
+            self.logger.error("Exception getting vm status: %s", str(e))
+            for vm_id in vm_list:
+                vm_dict[vm_id] = {'status': "VIM_ERROR", 'error_msg': str(e)}
+            return vm_dict
+        try:
+            vm_ports, floating_ips = self._get_vm_ports(vm_list)
+        except Exception as e:
+            self.logger.error("Error getting vm interface information " + type(e).__name__ + ": "+  str(e))
+            vm_ports, floating_ips = {}, {}
         for vm_id in vm_list:
             vm={}
             try:
-                vm_vim = self.get_vminstance(vm_id)
+                vm_vim = servers.get(vm_id)
+                if vm_vim is None:
+                    vm_vim = self.get_vminstance(vm_id)
                 if vm_vim['status'] in vmStatus2manoFormat:
                     vm['status']    =  vmStatus2manoFormat[ vm_vim['status'] ]
                 else:
                     vm['status']    = "OTHER"
                     vm['error_msg'] = "VIM status reported " + vm_vim['status']
-                try:
-                    vm['vim_info']  = yaml.safe_dump(vm_vim, default_flow_style=True, width=256)
-                except yaml.representer.RepresenterError:
-                    vm['vim_info'] = str(vm_vim)
+                vm['vim_info']  = vimconn.lazy_vim_info(vm_vim, default_flow_style=True, width=256)
                 vm["interfaces"] = []
                 if vm_vim.get('fault'):
                     vm['error_msg'] = str(vm_vim['fault'])
                 #get interfaces
-                try:
-                    self._reload_connection()
-                    port_dict=self.neutron.list_ports(device_id=vm_id)
-                    for port in port_dict["ports"]:
-                        interface={}
-                        try:
-                            interface['vim_info'] = yaml.safe_dump(port, default_flow_style=True, width=256)
-                        except yaml.representer.RepresenterError:
-                            interface['vim_info'] = str(port)
-                        interface["mac_address"] = port.get("mac_address")
-                        interface["vim_net_id"] = port["network_id"]
-                        interface["vim_interface_id"] = port["id"]
-                        ips=[]
-                        #look for floating ip address
-                        floating_ip_dict = self.neutron.list_floatingips(port_id=port["id"])
-                        if floating_ip_dict.get("floatingips"):
-                            ips.append(floating_ip_dict["floatingips"][0].get("floating_ip_address") )
-
-                        for subnet in port["fixed_ips"]:
-                            ips.append(subnet["ip_address"])
-                        interface["ip_address"] = ";".join(ips)
-                        vm["interfaces"].append(interface)
-                except Exception as e:
-                    self.logger.error("Error getting vm interface information " + type(e).__name__ + ": "+  str(e))
+                for port in vm_ports.get(vm_id, ()):
+                    interface={}
+                    interface['vim_info'] = vimconn.lazy_vim_info(port, default_flow_style=True, width=256)
+                    interface["mac_address"] = port.get("mac_address")
+                    interface["vim_net_id"] = port["network_id"]
+                    interface["vim_interface_id"] = port["id"]
+                    ips=[]
+                    #look for floating ip address
+                    if port["id"] in floating_ips:
+                        ips.append(floating_ips[port["id"]])
+                    for subnet in port["fixed_ips"]:
+                        ips.append(subnet["ip_address"])
+                    interface["ip_address"] = ";".join(ips)
+                    vm["interfaces"].append(interface)
             except vimconn.vimconnNotFoundException as e:
                 self.logger.error("Exception getting vm status: %s", str(e))
                 vm['status'] = "DELETED"
@@ -1146,7 +1384,58 @@ class vimconnector(vimconn.vimconnector):
                 vm['error_msg'] = str(e)
             vm_dict[vm_id] = vm
         return vm_dict
-    
+
+    def _get_vm_servers(self, vm_list):
+        '''Returns a dictionary vm_id: server dictionary, with the VMs of vm_list found at the tenant server list.
+        The list is obtained by pages, as nova limits the servers returned by call, until all the VMs are found'''
+        try:
+            self._reload_connection()
+            vm_ids = set(vm_list)
+            servers = {}
+            marker = None
+            while len(servers) < len(vm_ids):
+                page = self.nova.servers.list(detailed=True, marker=marker, limit=server_list_page_size)
+                if not page:
+                    break
+                for server in page:
+                    if server.id in vm_ids:
+                        servers[server.id] = server.to_dict()
+                marker = page[-1].id
+            return servers
+        except (ksExceptions.ClientException, nvExceptions.ClientException, ConnectionError) as e:
+            self._format_exception(e)
+
+    def _get_project_id(self):
+        '''Returns the id of the tenant/project of the connector, from the token if it was given by name'''
+        if self.tenant_id:
+            return self.tenant_id
+        project_id = getattr(getattr(self.keystone, "auth_ref", None), "project_id", None)
+        if not project_id:
+            raise vimconn.vimconnConnectionException("Cannot get the id of the tenant '{}'".format(self.tenant_name))
+        return project_id
+
+    def _get_vm_ports(self, vm_list):
+        '''Returns a dictionary vm_id: list of ports of the VM, and a dictionary port_id: floating ip address. The
+        ports are listed filtered by the VM ids and the floating ips by the port ids, up to list_filter_size ids per
+        call, so that the other ports of a large tenant are not listed'''
+        self._reload_connection()
+        project_id = self._get_project_id()
+        vm_ids = list(set(vm_list))
+        vm_ports = {}
+        for index in range(0, len(vm_ids), list_filter_size):
+            for port in self.neutron.list_ports(tenant_id=project_id,
+                                                device_id=vm_ids[index:index + list_filter_size])["ports"]:
+                vm_ports.setdefault(port["device_id"], []).append(port)
+        port_ids = [port["id"] for ports in vm_ports.values() for port in ports]
+        floating_ips = {}
+        for index in range(0, len(port_ids), list_filter_size):
+            for floating_ip in self.neutron.list_floatingips(tenant_id=project_id,
+                                                             port_id=port_ids[index:index + list_filter_size]
+                                                             )["floatingips"]:
+                if floating_ip.get("port_id") and floating_ip["port_id"] not in floating_ips:
+                    floating_ips[floating_ip["port_id"]] = floating_ip.get("floating_ip_address")
+        return vm_ports, floating_ips
+
     def action_vminstance(self, vm_id, action_dict):
         '''Send and action over a VM instance from VIM
         Returns the vm_id if the action was successfully sent to the VIM'''
@@ -932,7 +932,7 @@ class vimconnector(vimconn.vimconnector):
                     vm['error_msg'] = "VIM status reported " + response['server']['status']
                 if response['server'].get('last_error'):
                     vm['error_msg'] = response['server']['last_error']
-                vm["vim_info"] = yaml.safe_dump(response['server'])
+                vm["vim_info"] = vimconn.lazy_vim_info(response['server'])
                 #get interfaces info
                 try:
                     management_ip = False
@@ -945,7 +945,7 @@ class vimconnector(vimconn.vimconnector):
                         vm["interfaces"]=[]
                     for port in client_data.get("ports"):
                         interface={}
-                        interface['vim_info']  = yaml.safe_dump(port)
+                        interface['vim_info']  = vimconn.lazy_vim_info(port)
                         interface["mac_address"] = port.get("mac_address")
                         interface["vim_net_id"] = port.get("network_id")
                         interface["vim_interface_id"] = port["id"]
@@ -1011,7 +1011,7 @@ class vimconnector(vimconn.vimconnector):
                     net["status"] = "DOWN"
                 if net_vim.get('last_error'):
                     net['error_msg'] = net_vim['last_error']
-                net["vim_info"] = yaml.safe_dump(net_vim)
+                net["vim_info"] = vimconn.lazy_vim_info(net_vim)
             except vimconn.vimconnNotFoundException as e:
                 self.logger.error("Exception getting net status: %s", str(e))
                 net['status'] = "DELETED"